@@ -7,7 +7,7 @@ implicit none
 type (ele_pointer_struct), allocatable :: eles(:)
 type (bbu_beam_struct) bbu_beam
 type (bbu_param_struct) bbu_param
-type (lat_struct) lat, lat_in, lat0
+type (lat_struct) lat, lat_in, lat0, lat_base
 type (beam_init_struct) beam_init
 type (ele_struct), pointer :: ele
 type (wake_lr_mode_struct), pointer :: lr(:)
@@ -24,9 +24,12 @@ logical err
 logical lost
 
 integer :: file_unit, file_unit2
-integer k, status
+integer k, status, ios, ix_word
 
-character(200) init_file
+character(200) init_file, arg
+character(400) line, cmd_arg
+character(20) cmd
+logical worker, list_cavities, parse_needed, setup_needed
 
 namelist / bbu_params / bbu_param, beam_init, bmad_com
 
@@ -34,15 +37,29 @@ namelist / bbu_params / bbu_param, beam_init, bmad_com
 ! Defaults for namelist
 beam_init%n_particle = 1
 
-select case (command_argument_count())
-case (0)
-  init_file = 'bbu.init'
-case (1)
-  call get_command_argument(1, init_file)
-case default
+! Command line: bbu {-worker} {-list_cavities} {init_file}
+
+init_file = 'bbu.init'
+worker = .false.
+list_cavities = .false.
+n = 0
+
+do i = 1, command_argument_count()
+  call get_command_argument(i, arg)
+  if (arg == '-worker') then
+    worker = .true.
+  elseif (arg == '-list_cavities') then
+    list_cavities = .true.
+  else
+    n = n + 1
+    init_file = arg
+  endif
+enddo
+
+if (n > 1) then
   print *, 'CONFUSED: MULTIPLE COMMAND LINE ARGUMENTS!'
   stop
-end select
+endif
 
 print *,'Reading input file: ' // trim(init_file)
 print *
@@ -59,12 +76,100 @@ if (bbu_param%ran_gauss_sigma_cut > 0) then
   call ran_gauss_converter (set_sigma_cut = bbu_param%ran_gauss_sigma_cut)
 endif
 
+! List cavities only: Write hom_info.txt without tracking.
+
+if (list_cavities) then
+  bbu_param%write_hom_info = .true.
+  call parse_lattice()
+  call setup_lattice()
+  print *, 'Wrote cavity names to hom_info.txt'
+  stop
+endif
+
+if (.not. worker) then
+  call parse_lattice()
+  call setup_lattice()
+  call run_bbu()
+  stop
+endif
+
+! Worker mode: The lattice is kept in memory between runs. Commands are read from stdin, one per line:
+!   current <I>       Set the test current (A).
+!   lat2 {<file>}     Set lat2_filename (blank => no lat2 file). The lat2 file is (re)applied at the next run,
+!                       so this command must be sent whenever the contents of the lat2 file change.
+!   reparse           Reparse the lattice file at the next run (EG: after new HOM assignments).
+!   run               Track and write for_py.txt. BBU_WORKER_DONE is then printed.
+!   quit              Stop.
+
+parse_needed = .true.
+setup_needed = .true.
+
+do
+  read (*, '(a)', iostat = ios) line
+  if (ios /= 0) exit
+  call string_trim(line, line, ix_word)
+  if (ix_word == 0) cycle
+  cmd = line(1:ix_word)
+  cmd_arg = adjustl(line(ix_word+1:))
+
+  select case (cmd)
+  case ('current')
+    read (cmd_arg, *, iostat = ios) bbu_param%current
+    if (ios /= 0) print '(2a)', 'BBU_WORKER_ERROR: BAD CURRENT: ', trim(cmd_arg)
+
+  case ('lat2')
+    bbu_param%lat2_filename = cmd_arg
+    setup_needed = .true.
+
+  case ('reparse')
+    parse_needed = .true.
+
+  case ('run')
+    if (parse_needed) then
+      call parse_lattice()
+      parse_needed = .false.
+      setup_needed = .true.
+    endif
+    if (setup_needed) then
+      call setup_lattice()
+      setup_needed = .false.
+    endif
+    call ran_seed_put (bbu_param%ran_seed)
+    call run_bbu()
+    print '(a)', 'BBU_WORKER_DONE'
+    flush (6)
+
+  case ('quit')
+    exit
+
+  case default
+    print '(2a)', 'BBU_WORKER_ERROR: UNKNOWN COMMAND: ', trim(line)
+    flush (6)
+  end select
+enddo
+
+!------------------------------------------------------------------------
+contains
+
+! Parse the lattice file. The result, lat_base, does not include lat2.
+
+subroutine parse_lattice()
+
 ! Init and parse
 print *, 'Lattice file: ', trim(bbu_param%lat_filename)
-call bmad_parser (bbu_param%lat_filename, lat_in) 
+call bmad_parser (bbu_param%lat_filename, lat_base)
 
 bmad_com%auto_bookkeeper = .false. ! To speed things up.
 
+end subroutine parse_lattice
+
+!------------------------------------------------------------------------
+! Apply lat2 to lat_base, remove high order HOMs, hybridize and find the tracking end element.
+
+subroutine setup_lattice()
+
+lat_in = lat_base
+
 !For DR-scan, parse additional lattice (lat2) 
 if (bbu_param%lat2_filename /= '') then
   print *, 'DR-scan or Phase-scan, parsing: ',bbu_param%lat2_filename
@@ -117,7 +222,7 @@ if (bbu_param%hybridize) then
       ele%select = .true.
       cycle
     endif    
-    
+  
     if (ele%key /= lcavity$) cycle
     if (.not. bbu_param%keep_all_lcavities) then
       if (.not. associated (ele%wake)) cycle
@@ -173,6 +278,13 @@ call check_rf_freq(lat, bbu_param%bunch_freq)
 call bbu_setup (lat, beam_init%dt_bunch, bbu_param, bbu_beam)
 print *, 'bbu_setup complete !!!'
 
+end subroutine setup_lattice
+
+!------------------------------------------------------------------------
+! Track at bbu_param%current and write for_py.txt.
+
+subroutine run_bbu()
+
 beam_init%bunch_charge = bbu_param%current * beam_init%dt_bunch
 
 print '(a, 2i10)', 'Number of stages and elements in the tracking lattice: ' , size(bbu_beam%stage),  lat%n_ele_track
@@ -195,4 +307,6 @@ write(o,'(2a)') 'growth_rate_set = ', logical_to_python( .NOT.(growth_rate == re
 write(o,'(a, es14.6)') 'growth_rate = ', growth_rate
 close(o)
  
+end subroutine run_bbu
+
 end program
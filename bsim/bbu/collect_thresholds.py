@@ -1,12 +1,33 @@
 #!/usr/bin/env python3
 
+# Combine threshold mode results into bbu_combined_thresholds.txt.
+# Usage:
+#   collect_thresholds.py <dir>              -- from the bbu_threshold* files in <dir>
+#   collect_thresholds.py <db_file> {scan}   -- from the results store <db_file> (threshold mode rows of
+#                                               all scans, or of scan {scan}). Output is put next to <db_file>.
+
 import os, sys
 
 def main(argv):
 
   total = 0
   didnot = 0
-  d = sys.argv[1]  # Directory of bbu threshold files 
+  d = sys.argv[1]  # Directory of bbu threshold files, or results store
+
+  if os.path.isfile(d):
+    from bbu import results_store  #imports bbu package in user python path
+    scan = sys.argv[2] if len(sys.argv) > 2 else None
+    rows = results_store.get_results(d, 'threshold', scan)
+    with open(os.path.join(os.path.dirname(os.path.abspath(d)),'bbu_combined_thresholds.txt'),'a') as myfile:
+      for r in rows:
+        total = total + 1
+        if (r['converged']):
+          myfile.write(str(r['threshold'])+'\n')
+        else:
+          didnot = didnot + 1
+    print ("Of ", total, " threshold calculations, ", didnot, " did not converge")
+    return
+
   files = os.listdir(d)
   for file in files:
     if (not file.startswith('bbu_threshold')): continue
@@ -20,10 +41,9 @@ def main(argv):
           didnot = didnot + 1
         else:
           myfile.write(line)
-      myfile.close  
+      myfile.close
 
   print ("Of ", total, " threshold calculations, ", didnot, " did not converge")
 
 if __name__ == "__main__":
   main(sys.argv[1:])
-
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Monte-Carlo HOM threshold campaign: Compute the threshold current for many random HOM assignments.
+# The bbu and python parameters are taken from test_run.py (or the file given by -settings).
+# See the README.TXT file for details.
+
+import os, sys, importlib.util
+from bbu import campaign  #imports bbu package in user python path
+
+def print_help():
+  print ('''
+Usage:
+  hom_campaign.py {-n <n_seed>} {-seed0 <seed0>} {-n_proc <n_proc>} {-dir <campaign_dir>} {-out <results_file>}
+                  {-settings <settings_file>} {-keep} {-qsub} {-qsub_options <options>} {-stats} {-job <seed>}
+
+  -n         Number of seeds. The seeds are seed0, seed0+1, ... seed0+n_seed-1.
+  -n_proc    Number of seeds computed at the same time. 0 => number of cores.
+  -dir       Directory in which the seed_<seed> working directories are created.
+  -out       Results file. One JSON record per seed with seed, threshold, converged, hom_files, wall_time.
+  -settings  Python file defining the bbu_par and py_par dictionaries.
+  -keep      Keep the seed_<seed> working directories.
+  -qsub      Instead of running locally, write <campaign_dir>/campaign.sge and submit it as an SGE array job.
+  -qsub_options  Extra SGE options put in campaign.sge. EG: -qsub_options "-l h_rt=24:00:00".
+  -stats     Print the threshold statistics of the results file and exit.
+  -job       Run the single seed <seed> and append the result to the results file (used by batch jobs).
+
+Defaults:
+  <n_seed>        = 100
+  <seed0>         = 1
+  <n_proc>        = 1
+  <campaign_dir>  = hom_campaign
+  <results_file>  = <campaign_dir>/campaign_results.jsonl
+  <settings_file> = test_run.py in the directory of this script
+''')
+  exit()
+
+#==========================================================
+def load_settings ( settings_file ):
+# Import settings_file and return its bbu_par and py_par dictionaries.
+  spec = importlib.util.spec_from_file_location('campaign_settings', settings_file)
+  settings = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(settings)
+  return settings.bbu_par, settings.py_par
+
+#==========================================================
+def main(argv):
+
+  n_seed = 100
+  seed0 = 1
+  n_proc = 1
+  campaign_dir = 'hom_campaign'
+  results_file = ''
+  settings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_run.py')
+  keep_dir = False
+  qsub = False
+  qsub_options = ''
+  stats_only = False
+  job_seed = None
+
+  i = 0
+  while i < len(argv):
+    n = len(argv[i])
+    if argv[i] == '-n':
+      n_seed = int(argv[i+1]); i += 1
+    elif argv[i] == '-seed0'[:n] and n > 2:
+      seed0 = int(argv[i+1]); i += 1
+    elif argv[i] == '-n_proc'[:n] and n > 2:
+      n_proc = int(argv[i+1]); i += 1
+    elif argv[i] == '-dir'[:n] and n > 1:
+      campaign_dir = argv[i+1]; i += 1
+    elif argv[i] == '-out'[:n] and n > 1:
+      results_file = argv[i+1]; i += 1
+    elif argv[i] == '-settings'[:n] and n > 2:
+      settings_file = argv[i+1]; i += 1
+    elif argv[i] == '-keep'[:n] and n > 1:
+      keep_dir = True
+    elif argv[i] == '-qsub_options'[:n] and n > 5:
+      qsub_options = argv[i+1]; i += 1
+    elif argv[i] == '-qsub':
+      qsub = True
+    elif argv[i] == '-stats'[:n] and n > 2:
+      stats_only = True
+    elif argv[i] == '-job'[:n] and n > 1:
+      job_seed = int(argv[i+1]); i += 1
+    else:
+      print_help()
+    i += 1
+
+  campaign_dir = os.path.abspath(campaign_dir)
+  if results_file == '': results_file = os.path.join(campaign_dir, 'campaign_results.jsonl')
+  results_file = os.path.abspath(results_file)
+
+  if stats_only:
+    campaign.print_stats(campaign.campaign_stats(campaign.read_results(results_file)))
+    return
+
+  os.makedirs(campaign_dir, exist_ok = True)
+  bbu_par, py_par = load_settings(settings_file)
+  if py_par.get('results_db', '') != '': py_par['results_db'] = os.path.join(campaign_dir, py_par['results_db'])
+
+  # Single seed (batch job)
+  if job_seed is not None:
+    result = campaign.run_seed(bbu_par, py_par, job_seed, campaign_dir, keep_dir)
+    campaign.append_result(results_file, result)
+    return
+
+  # Batch system
+  if qsub:
+    command = 'python3 ' + os.path.abspath(__file__) + ' -settings ' + os.path.abspath(settings_file) + \
+              ' -dir ' + campaign_dir + ' -out ' + results_file + ' -job $((' + str(seed0) + ' + $SGE_TASK_ID - 1))'
+    if keep_dir: command += ' -keep'
+    script_file = os.path.join(campaign_dir, 'campaign.sge')
+    campaign.write_batch_script(script_file, command, n_seed, qsub_options)
+    campaign.submit_batch(script_file)
+    print('When the jobs are done, use: ' + os.path.basename(__file__) + ' -stats -out ' + results_file)
+    return
+
+  # Local process pool
+  campaign.run_campaign(bbu_par, py_par, list(range(seed0, seed0 + n_seed)), campaign_dir, results_file, n_proc, keep_dir)
+  campaign.print_stats(campaign.campaign_stats(campaign.read_results(results_file)))
+
+# Boilerplate
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
 import subprocess
-from bbu import find_threshold, drscan, phase_scan
-import os
+from bbu import find_threshold, drscan, phase_scan, results_store, scan_plot, checkpoint
+import os, shutil, time
 import math
+import concurrent.futures
+import numpy as np
 
 # Parse the tracking result of a bbu run
 # In: for_py.txt file generated by the bbu run
@@ -24,6 +26,18 @@ def parse_for_py(filename='for_py.txt'):
   f.close()
   return d
 
+# Number of bbu runs and wall time of the last loop_to_pin_down_Ith call in this process (see store_result)
+last_search = {'n_runs': None, 'wall_time': None}
+
+#==========================================================
+
+def store_result( py_par, mode, is_Ith_found, final_curr, x = None, y = None ):
+  # Append the result of the last threshold search to the results store py_par['results_db'], if set.
+  # x, y is the scan coordinate of the point (see results_store.py)
+  if (py_par.get('results_db', '') == ''): return
+  results_store.add_result(py_par['results_db'], py_par.get('scan_id', ''), mode, is_Ith_found, final_curr, x, y,
+                           last_search['n_runs'], last_search['wall_time'], py_par.get('ran_seed'))
+
 #==========================================================
 
 def single_threshold( py_par ):
@@ -33,6 +47,7 @@ def single_threshold( py_par ):
 #  if ( os.path.exists(os.path.join(py_par['temp_dir'],"for_py.txt")) ): os.remove(os.path.join(py_par['temp_dir'],"for_py.txt"))    
 
   is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, 'threshold')
+  store_result(py_par, 'threshold', is_Ith_found, final_curr)
   
   if (is_Ith_found):
     my_file.write(str(final_curr)+'\n')
@@ -45,6 +60,7 @@ def single_threshold( py_par ):
 
 
 def drscanner( py_par ):
+  checkpoint.setup( py_par, 'drscan' )
   # Create thres_v_trotb.txt in temp_dir to store the computed Ith for each tr/tb 
   my_file = open(os.path.join(py_par['temp_dir'],'thresh_v_trotb.txt'),'w')
 
@@ -58,16 +74,19 @@ def drscanner( py_par ):
   else:
     print('Invalid ndata_pnts_DR specified!!!')
 
-  for n in range (0, py_par['ndata_pnts_DR']):
-    
-    temp_arctime = py_par['start_dr_arctime'] + n*(step_size)
-    # Make lat2 file to vary the arctime (i.e. vary arclength)
-    drscan.setup_drscan( temp_arctime, py_par ) 
+  arctimes = [py_par['start_dr_arctime'] + n*(step_size) for n in range (0, py_par['ndata_pnts_DR'])]
 
-    is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, 'drscan')
-    d = parse_for_py(os.path.join(py_par['temp_dir'],'for_py.txt')) # just to retrieve d['bunch_dt']
+  # With plot_live, the plot is updated as each point is done
+  live = None
+  if (py_par['plot_drscan'] and py_par.get('plot_live', False)):
+    live = scan_plot.LivePlot(py_par, len(arctimes), "Arc Time / Bunch Time", 'thresh_v_trotb')
+    def point_done( n, result ):
+      if (result[0]): live.add(n, result[1], result[2])
+  else:
+    point_done = None
+
+  for is_Ith_found, trotb, final_curr in run_scan_points( py_par, drscan_point, arctimes, point_done ):
     if (is_Ith_found):
-      trotb = temp_arctime / d['bunch_dt'] #tr/tb
       my_file.write(str(trotb)+'	'+str(final_curr)+'\n')
     else:
       my_file.write('DID NOT CONVERGE\n')
@@ -77,34 +96,176 @@ def drscanner( py_par ):
 
   # If requested, plot Log(Ith) vs tr/tb for all arctimes 
   if (py_par['plot_drscan']):
-    print('Producing plot(s). To continue, exit the plots.') 
-    drscan.make_dr_plot(py_par)  
+    if (py_par.get('plot_format', 'png') == 'show'): print('Producing plot(s). To continue, exit the plots.') 
+    if (live is None):
+      drscan.make_dr_plot(py_par)  
+    else:
+      live.close()
+
+#==========================================================
+
+def drscan_point( py_par, temp_arctime, guess = None ):
+  # Find Ith for one arctime. Returns (is_Ith_found, tr/tb, Ith)
+  # guess is an estimate of Ith used to start the search (see loop_to_pin_down_Ith)
+  # Make lat2 file to vary the arctime (i.e. vary arclength)
+  drscan.setup_drscan( temp_arctime, py_par ) 
+
+  is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, 'drscan', guess)
+  d = parse_for_py(os.path.join(py_par['temp_dir'],'for_py.txt')) # just to retrieve d['bunch_dt']
+  trotb = temp_arctime / d['bunch_dt'] #tr/tb
+  store_result(py_par, 'drscan', is_Ith_found, final_curr, trotb)
+  return is_Ith_found, trotb, final_curr
+
+#==========================================================
+
+def make_point_dir( py_par, n ):
+  # Create a working directory for scan point n, with its own bbu_template.init.
+  # bbu.init, lat2.lat, for_py.txt and the bbu output of the point all go in this directory.
+  # Returns a copy of py_par with temp_dir set to the point directory.
+  point_par = dict(py_par)
+  point_par['temp_dir'] = os.path.join(py_par['temp_dir'], 'point_'+str(n).zfill(4))
+  point_par['bbu_log'] = True
+  os.makedirs(point_par['temp_dir'], exist_ok = True)
+  shutil.copy(os.path.join(py_par['temp_dir'],'bbu_template.init'), point_par['temp_dir'])
+  return point_par
+
+#==========================================================
+
+def run_scan_points( py_par, point_func, coords, point_done = None ):
+  # Run point_func(py_par, coord, guess) for each scan coordinate and return the results in scan order.
+  # Each result is a tuple (is_Ith_found, ..., Ith).
+  # If given, point_done(n, result) is called as soon as the result of point n is available.
+  # If py_par['n_proc'] > 1 (or 0 = number of cores), the points run in a process pool,
+  # each in its own working directory.
+  # If py_par['warm_start'] is True, the threshold search of a point starts from the threshold of 
+  # the nearest point already converged (guess). Otherwise guess = None.
+  # With py_par['checkpoint_dir'] set, each completed point and the bracket of each point in progress 
+  # are saved, and with py_par['resume'] the saved points are not run again (see checkpoint.py).
+  n_proc = py_par.get('n_proc', 1)
+  if (n_proc == 0): n_proc = os.cpu_count()
+  warm_start = py_par.get('warm_start', False)
+  results = [checkpoint.read_point(py_par, c) for c in coords]
+  if (point_done is not None):
+    for n in range(len(coords)):
+      if (results[n] is not None): point_done(n, results[n])
+
+  if (n_proc <= 1 or len(coords) <= 1):
+    guess = None
+    for n, c in enumerate(coords):
+      if (results[n] is None):
+        results[n] = point_func(checkpoint_par(py_par, c), c, guess)
+        checkpoint.write_point(py_par, c, results[n])
+        if (point_done is not None): point_done(n, results[n])
+      if (warm_start and results[n][0]): guess = results[n][-1]
+    return results
 
+  print('Running', len(coords), 'scan points with', n_proc, 'processes')
+  point_pars = [checkpoint_par(make_point_dir(py_par, n), c) for n, c in enumerate(coords)]
+
+  # With warm start, the scan is done in passes. The first pass does every stride-th point, 
+  # and each following pass halves the stride, seeding each point from the nearest converged point.
+  if (warm_start):
+    stride = max(1, len(coords) // n_proc)
+  else:
+    stride = 1
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers = n_proc) as pool:
+    while True:
+      todo = [n for n in range(0, len(coords), stride) if results[n] is None]
+      futures = {pool.submit(run_point, point_func, point_pars[n], coords[n],
+                             nearest_threshold(results, n) if warm_start else None): n for n in todo}
+      # Results are handled in the order the points finish, so point_done (EG: a live plot) is not 
+      # held up by a slow point earlier in the scan.
+      for future in concurrent.futures.as_completed(futures):
+        n = futures[future]
+        r = future.result()
+        results[n] = r
+        checkpoint.write_point(py_par, coords[n], r)
+        if (point_done is not None): point_done(n, r)
+      if (stride == 1): break
+      stride = stride // 2
+
+  return results
+
+#==========================================================
+
+def checkpoint_par( py_par, coord ):
+  # Returns py_par with the bracket checkpoint file of the scan point set (see loop_to_pin_down_Ith).
+  if (py_par.get('checkpoint_dir', '') == ''): return py_par
+  return dict(py_par, bracket_file = checkpoint.bracket_file(py_par, coord))
+
+#==========================================================
+
+def run_point( point_func, py_par, coord, guess ):
+  # Run one scan point in a pool process. A bbu worker started for the point directory is stopped afterwards.
+  result = point_func(py_par, coord, guess)
+  find_threshold.stop_bbu_worker(py_par['temp_dir'])
+  return result
+
+#==========================================================
+
+def nearest_threshold( results, n ):
+  # Return the threshold of the converged result nearest to index n, or None if there is none.
+  for dn in range(1, len(results)):
+    for m in (n-dn, n+dn):
+      if (m >= 0 and m < len(results) and results[m] is not None and results[m][0]): return results[m][-1]
+  return None
 
 #def loop_to_pin_down_Ith(py_par, t, d):
 # Mode allowed: 'threshold', 'drscan', 'phase_scan', 'phase_xy_scan'
-def loop_to_pin_down_Ith(py_par, mode):
+# If guess (an estimate of Ith, for example the threshold at a neighboring scan point) is given, the search 
+# starts with the bracket [guess*(1-w), guess*(1+w)], w = py_par['warm_start_width'], instead of 
+# py_par['threshold_start_curr']. The lower end is run first and, if stable, the upper end next. 
+# If the lower end is unstable or the upper end stable, the search continues from there as usual.
+# If py_par['bracket_file'] is set, the search state is saved there before each bbu run and, 
+# with py_par['resume'], a search interrupted by the end of the job continues from the saved state.
+def loop_to_pin_down_Ith(py_par, mode, guess = None):
+  # Search method: 'bisection' (default) or 'regula_falsi' (see find_threshold.calc_new_charge)
+  search = py_par.get('threshold_search', 'bisection')
+  t_start = time.time()
   t  = {'charge0':0,'charge1':-1,'growth_rate':0,'bunch_charge':0}
-  find_threshold.run_bbu( py_par['threshold_start_curr'], py_par, mode )
+  n_run = 0
+  bracket_file = py_par.get('bracket_file', '')
+  saved = None
+  if (py_par.get('resume', False) and bracket_file != '' and os.path.exists(bracket_file)):
+    saved = checkpoint.read_json(bracket_file)
+
+  if (saved is not None):
+    t = saved['t']
+    start_curr = saved['temp_curr']
+    n_run = saved['n_run']
+    print('Resuming threshold search: bracket [', t['charge0'], ',', t['charge1'], '] (C), test current', start_curr, '(A)')
+  elif (guess is None):
+    start_curr = py_par['threshold_start_curr']
+  else:
+    w = py_par.get('warm_start_width', 0.05)
+    start_curr = guess * (1 - w)
+    print('Warm start: validating threshold bracket [', start_curr, ',', guess * (1 + w), '] (A)')
+  find_threshold.run_bbu( start_curr, py_par, mode )
+  n_run += 1
   d = parse_for_py(os.path.join(py_par['temp_dir'],'for_py.txt')) # parse the result (from Fortran to Python)
-  t['bunch_charge'] = py_par['threshold_start_curr'] * d['bunch_dt']   
+  if (saved is None):
+    t['bunch_charge'] = start_curr * d['bunch_dt']   
+    if (guess is not None): t['warm_charge'] = guess * (1 + w) * d['bunch_dt']
   
   keep_looking = 1
   while ( keep_looking ):   # Nudge stable current very close to the higher, unstable current
-    t['growth_rate'] = d['growth_rate']
+    t['growth_rate'] = find_threshold.get_growth_rate(d)
     bool_stable = find_threshold.get_stability(d['v_gain'], d['lostbool']) #check stability 
-    find_threshold.calc_new_charge( t, bool_stable ) # update t based on the stability of the test current
+    find_threshold.calc_new_charge( t, bool_stable, search, py_par['final_rel_tol'] ) # update t based on the stability of the test current
+    if ('warm_charge' in t):   # Warm start: If the lower end of the bracket is stable, try the upper end next
+      if (t['charge1'] < 0): t['bunch_charge'] = t['warm_charge']
+      del t['warm_charge']
     temp_curr = t['bunch_charge'] / d['bunch_dt']                # compute new test current with updated t[bunch_charge]
-    find_threshold.run_bbu( temp_curr, py_par, mode )    # Try the new test current
-    d = parse_for_py(os.path.join(py_par['temp_dir'],'for_py.txt'))
     
     # If the difference between min_I_unstable and max_I_stable is within the tolerance, Ith is considered found 
+    # The test current is then inside the bracket and there is no need to run it.
     #if ( abs(t['charge1'] - t['charge0']) < abs(t['charge1']*d['rel_tol']) ): 
     if ( abs(t['charge1'] - t['charge0']) < abs(t['charge1']*py_par['final_rel_tol']) ): 
       keep_looking = 0 
       Ith_found = 1
       print('= = = Ith found = = =')
-    if ( temp_curr < 10**-12 or temp_curr > 10**5 ): 
+    elif ( temp_curr < 10**-12 or temp_curr > 10**5 ): 
       keep_looking = 0
       Ith_found = 0
       print('==!!==!!==!!==')
@@ -113,6 +274,14 @@ def loop_to_pin_down_Ith(py_par, mode):
         print('Test current below 10^-12 A, no stable current found')
       else:
         print('Test current above 10^5 A, no unstable current found')
+    else:
+      if (bracket_file != ''): checkpoint.write_json(bracket_file, {'t': t, 'temp_curr': temp_curr, 'n_run': n_run})
+      find_threshold.run_bbu( temp_curr, py_par, mode )    # Try the new test current
+      n_run += 1
+      d = parse_for_py(os.path.join(py_par['temp_dir'],'for_py.txt'))
+  print('Number of bbu runs: ', n_run)
+  last_search['n_runs'] = n_run
+  last_search['wall_time'] = time.time() - t_start
   d.clear()
   t.clear()
   return Ith_found, temp_curr
@@ -120,6 +289,7 @@ def loop_to_pin_down_Ith(py_par, mode):
 #==========================================================================
 
 def phase_scanner( py_par ):
+  checkpoint.setup( py_par, 'phase_scan' )
   # Create thres_v_phase.txt in temp_dir to store the computed Ith for each phase
   my_file = open(os.path.join(py_par['temp_dir'],'thresh_v_phase.txt'),'w')
   
@@ -134,18 +304,26 @@ def phase_scanner( py_par ):
     print('Invalid ndata_pnts_PHASE specified!!! ')
 
   # Looping over phases 
+  phases = []
   for n in range (0, py_par['ndata_pnts_PHASE']):
-    
     if (step_size > 0):  # If step_size is not defined, user has given invalid ndata_pnts_PHASE
-      temp_phase = py_par['start_phase'] + n*(step_size)    # For scan (more than one data point, can be slow)
+      phases.append(py_par['start_phase'] + n*(step_size))    # For scan (more than one data point, can be slow)
     elif (step_size == 0):
-      temp_phase = py_par['ONE_phase']                      # For one data point
-    
-    # Make lat2 file with the temp_phase
-    phase_scan.setup_phase_scan( temp_phase, py_par ) 
+      phases.append(float(py_par['ONE_phase']))               # For one data point
 
-    is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, 'phase_scan')
-    
+  # The lat2 files of all phases are made at once
+  lat2_files = phase_scan.make_phase_grid( py_par, phases )
+
+  # With plot_live, the plot is updated as each point is done
+  live = None
+  if (py_par['plot_phase_scan'] and py_par.get('plot_live', False)):
+    live = scan_plot.LivePlot(py_par, len(phases), "Phase", 'thresh_v_phase')
+    def point_done( n, result ):
+      if (result[0]): live.add(n, phases[n], result[1])
+  else:
+    point_done = None
+
+  for temp_phase, (is_Ith_found, final_curr) in zip(phases, run_scan_points( py_par, phase_scan_point, list(zip(phases, lat2_files)), point_done )):
     if (is_Ith_found):
       my_file.write(str(temp_phase)+'	'+str(final_curr)+'\n')
     else:
@@ -156,8 +334,27 @@ def phase_scanner( py_par ):
 
   # If requested, plot Log(Ith) vs phase 
   if (py_par['plot_phase_scan']):
-    print('Producing plot(s). To continue, exit the plots.') 
-    phase_scan.make_phase_plot(py_par)  
+    if (py_par.get('plot_format', 'png') == 'show'): print('Producing plot(s). To continue, exit the plots.') 
+    if (live is None):
+      phase_scan.make_phase_plot(py_par)  
+    else:
+      live.close()
+
+#==========================================================================
+
+def phase_scan_point( py_par, point, guess = None ):
+  # Find Ith for one phase point. Returns (is_Ith_found, Ith)
+  # point = (phase, lat2_file) or, for an x-y grid, (phase_x, phase_y, lat2_file)
+  # where lat2_file is the pre-generated lat2 file of the point (see phase_scan.make_phase_grid).
+  # guess is an estimate of Ith used to start the search (see loop_to_pin_down_Ith)
+  shutil.copyfile( point[-1], os.path.join(py_par['temp_dir'],'lat2.lat') )
+  if (len(point) == 2):
+    mode = 'phase_scan'
+  else:
+    mode = 'phase_xy_scan'
+  is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, mode, guess)
+  store_result(py_par, mode, is_Ith_found, final_curr, *point[:-1])
+  return is_Ith_found, final_curr
 
 #==========================================================================
 
@@ -171,6 +368,7 @@ def phase_xy_scanner( py_par ):
 
   # For a specific x-y phase combination, find the Ith
   is_Ith_found, final_curr = loop_to_pin_down_Ith(py_par, 'phase_xy_scan')
+  store_result(py_par, 'phase_xy_scan', is_Ith_found, final_curr, float(py_par['phase_x']), float(py_par['phase_y']))
   if (is_Ith_found):
     my_file.write(str(py_par['phase_x'])+' '+str(py_par['phase_y'])+'	'+str(final_curr)+'\n')
   else:
@@ -178,3 +376,89 @@ def phase_xy_scanner( py_par ):
   print('JUST WROTE TO thresh_v_phase_xy.txt in the temporary directory')
   my_file.close()
 
+
+#==========================================================================
+
+def phase_xy_grid_scanner( py_par ):
+  # Find Ith on the 2D grid of phase_x from start_phase_x to end_phase_x (ndata_pnts_PHASE_X points) 
+  # and phase_y from start_phase_y to end_phase_y (ndata_pnts_PHASE_Y points). 
+  # The lat2 files of all grid points are made at once and the points can be run in parallel (py_par['n_proc']).
+  # Output: thresh_v_phase_xy.txt in temp_dir with lines "phase_x phase_y	Ith"
+  checkpoint.setup( py_par, 'phase_xy_grid' )
+
+  px = np.linspace(py_par['start_phase_x'], py_par['end_phase_x'], py_par['ndata_pnts_PHASE_X'])
+  py = np.linspace(py_par['start_phase_y'], py_par['end_phase_y'], py_par['ndata_pnts_PHASE_Y'])
+  px, py = [a.flatten() for a in np.meshgrid(px, py, indexing = 'ij')]
+  print('Phase x-y grid with', len(px), 'points')
+
+  lat2_files = phase_scan.make_phase_grid( py_par, px, py )
+  points = list(zip(px, py, lat2_files))
+
+  my_file = open(os.path.join(py_par['temp_dir'],'thresh_v_phase_xy.txt'),'w')
+  for (phase_x, phase_y, f), (is_Ith_found, final_curr) in zip(points, run_scan_points( py_par, phase_scan_point, points )):
+    if (is_Ith_found):
+      my_file.write(str(phase_x)+' '+str(phase_y)+'	'+str(final_curr)+'\n')
+    else:
+      my_file.write('DID NOT CONVERGE\n')
+  my_file.close()
+  print('JUST WROTE TO thresh_v_phase_xy.txt in the temporary directory')
+
+#==========================================================================
+
+def phase_xy_adaptive_scanner( py_par ):
+  # Adaptive (quadtree) map of Ith over phase_x from start_phase_x to end_phase_x and phase_y 
+  # from start_phase_y to end_phase_y. Ith is first found on an adaptive_n0 x adaptive_n0 grid. 
+  # Then cells are split into four, up to adaptive_max_level times, where log10(Ith) changes by more 
+  # than adaptive_tol over the cell, a corner did not converge, or a corner is within 
+  # adaptive_floor_tol (decades) of the lowest Ith found (see phase_scan.cells_to_refine).
+  # Output in temp_dir:
+  #   thresh_v_phase_xy.txt -- evaluated points, lines "phase_x phase_y	Ith"
+  #   phase_xy_map.npz      -- phase_x, phase_y, Ith on the finest grid (interpolated between evaluated points), evaluated mask
+  #   phase_xy_map.png      -- plot of the map
+  checkpoint.setup( py_par, 'phase_xy_adaptive' )
+
+  n0 = py_par.get('adaptive_n0', 5)
+  max_level = py_par.get('adaptive_max_level', 3)
+  tol = py_par.get('adaptive_tol', 0.2)
+  floor_tol = py_par.get('adaptive_floor_tol', 0.3)
+
+  step = 2**max_level
+  nf = (n0-1) * step + 1
+  px = np.linspace(py_par['start_phase_x'], py_par['end_phase_x'], nf)
+  py = np.linspace(py_par['start_phase_y'], py_par['end_phase_y'], nf)
+
+  ith = {}
+  leaves = []
+  cells = [(i, j, step) for i in range(0, nf-1, step) for j in range(0, nf-1, step)]
+
+  for level in range(max_level+1):
+    new = sorted(set(c for cell in cells for c in phase_scan.cell_corners(cell) if c not in ith))
+    print('Adaptive phase map level', level, ':', len(cells), 'cells,', len(new), 'new points')
+    lat2_files = phase_scan.make_phase_grid( py_par, px[[i for i, j in new]], py[[j for i, j in new]] )
+    points = [(px[i], py[j], f) for (i, j), f in zip(new, lat2_files)]
+    for c, (is_Ith_found, final_curr) in zip(new, run_scan_points( py_par, phase_scan_point, points )):
+      ith[c] = final_curr if is_Ith_found else np.nan
+
+    if (level == max_level): break
+    refine = phase_scan.cells_to_refine( cells, ith, tol, floor_tol )
+    leaves += [cell for cell in cells if cell not in refine]
+    cells = [sub for cell in refine for sub in phase_scan.split_cell(cell)]
+    if (len(cells) == 0): break
+
+  leaves += cells
+
+  my_file = open(os.path.join(py_par['temp_dir'],'thresh_v_phase_xy.txt'),'w')
+  for (i, j) in sorted(ith):
+    if (np.isnan(ith[(i, j)])):
+      my_file.write('DID NOT CONVERGE\n')
+    else:
+      my_file.write(str(px[i])+' '+str(py[j])+'	'+str(ith[(i, j)])+'\n')
+  my_file.close()
+
+  ith_grid, evaluated = phase_scan.grid_phase_map( leaves, ith, nf )
+  np.savez(os.path.join(py_par['temp_dir'],'phase_xy_map.npz'), phase_x = px, phase_y = py, ith = ith_grid, evaluated = evaluated)
+  phase_scan.make_phase_xy_map_plot( py_par )
+
+  i, j = min(ith, key = lambda c: ith[c] if not np.isnan(ith[c]) else np.inf)
+  print('Ith evaluated at', len(ith), 'of', nf*nf, 'grid points')
+  print('Lowest Ith:', ith[(i, j)], '(A) at phase_x, phase_y =', px[i], py[j])
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Monte-Carlo HOM threshold campaigns:
+# Each seed is one random HOM assignment, computed in its own directory <campaign_dir>/seed_<seed>.
+# The seed is used for both the python HOM choice and the bbu ran_seed, so a seed can be rerun exactly.
+# Results are appended, one JSON record per line, to a single results file.
+
+import os, time, json, random, shutil, fcntl, statistics, contextlib, subprocess
+import concurrent.futures
+from bbu import bbu_main, find_threshold
+
+#==========================================================
+def run_seed ( bbu_par, py_par, seed, campaign_dir, keep_dir = False ):
+# Compute the threshold for one random HOM assignment.
+# In: bbu and python parameters (as in test_run.py), the seed, and the campaign directory
+# Out: result dictionary with keys seed, threshold (None if not converged), converged, hom_files, wall_time
+###########################################################
+  t0 = time.time()
+  seed_dir = os.path.join(os.path.abspath(campaign_dir), 'seed_'+str(seed))
+  if os.path.exists(seed_dir): shutil.rmtree(seed_dir)
+  os.makedirs(seed_dir)
+
+  bbu_par = dict(bbu_par)
+  py_par = dict(py_par)
+  py_par['temp_dir'] = seed_dir
+  py_par['bbu_log'] = True
+  py_par['cache_dir'] = os.path.abspath(campaign_dir)   # Cavity name cache shared by all seeds
+  py_par['scan_id'] = os.path.basename(os.path.abspath(campaign_dir))   # Results store scan name
+  py_par['ran_seed'] = seed
+  user_lattice = bbu_par['lat_filename']
+  bbu_par['lat_filename'] = '\''+os.path.join(seed_dir,'temp_lat.lat')+'\''
+  bbu_par['ran_seed'] = seed
+
+  with open(os.path.join(seed_dir, 'campaign.log'), 'w') as log, contextlib.redirect_stdout(log):
+    random.seed(seed)
+    find_threshold.keep_bbu_param( bbu_par, seed_dir )
+    find_threshold.prepare_lat( py_par, user_lattice )
+    find_threshold.prepare_HOM( py_par )
+    is_Ith_found, final_curr = bbu_main.loop_to_pin_down_Ith( py_par, 'threshold' )
+    bbu_main.store_result( py_par, 'threshold', is_Ith_found, final_curr )
+    find_threshold.stop_bbu_worker( seed_dir )
+
+  result = {'seed': seed, 'threshold': final_curr if is_Ith_found else None, 'converged': bool(is_Ith_found),
+            'hom_files': read_hom_assignment(os.path.join(seed_dir, 'rand_assign_homs.bmad')),
+            'wall_time': time.time() - t0}
+
+  if (not keep_dir): shutil.rmtree(seed_dir)
+  return result
+
+#==========================================================
+def read_hom_assignment ( file_name ):
+# Return the {cavity_name: hom_file} dictionary of a rand_assign_homs.bmad file.
+###########################################################
+  homs = {}
+  with open(file_name, 'r') as f:
+    for line in f:
+      if '[lr_wake_file]' not in line: continue
+      cav, hom_file = line.split('[lr_wake_file]')
+      homs[cav.strip()] = os.path.basename(hom_file.split('=')[1].strip())
+  return homs
+
+#==========================================================
+def append_result ( results_file, result ):
+# Append one result record to the results file. The file is locked so that
+# batch jobs running at the same time can share it.
+###########################################################
+  with open(results_file, 'a') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.write(json.dumps(result) + '\n')
+    f.flush()
+    fcntl.flock(f, fcntl.LOCK_UN)
+
+#==========================================================
+def read_results ( results_file ):
+# Return the list of result records in the results file.
+###########################################################
+  results = []
+  with open(results_file, 'r') as f:
+    for line in f:
+      if line.strip() == '': continue
+      results.append(json.loads(line))
+  return results
+
+#==========================================================
+def run_campaign ( bbu_par, py_par, seeds, campaign_dir, results_file, n_proc = 1, keep_dir = False ):
+# Run the seeds in a local process pool. Each result is appended to results_file as soon as it is done.
+# Seeds already in results_file are skipped so that an interrupted campaign can be continued.
+###########################################################
+  if os.path.exists(results_file):
+    done = set(r['seed'] for r in read_results(results_file))
+    seeds = [s for s in seeds if s not in done]
+    if len(done) > 0: print('Skipping', len(done), 'seeds already in', results_file)
+
+  if (n_proc == 0): n_proc = os.cpu_count()
+  print('Running', len(seeds), 'seeds with', n_proc, 'processes')
+
+  n_done = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers = n_proc) as pool:
+    futures = {pool.submit(run_seed, bbu_par, py_par, s, campaign_dir, keep_dir): s for s in seeds}
+    for future in concurrent.futures.as_completed(futures):
+      seed = futures[future]
+      n_done += 1
+      try:
+        result = future.result()
+      except Exception as err:
+        print('Seed', seed, 'FAILED:', err)
+        continue
+      append_result(results_file, result)
+      print('[', n_done, '/', len(seeds), '] seed', seed, ' threshold:', result['threshold'])
+
+#==========================================================
+def write_batch_script ( script_file, command, n_seed, options = '' ):
+# Write an SGE array job script that runs "command <seed>" for n_seed seeds.
+# The task id SGE_TASK_ID runs from 1 to n_seed.
+###########################################################
+  with open(script_file, 'w') as f:
+    f.write('#$ -S /bin/bash\n')
+    f.write('#$ -cwd\n')
+    f.write('#$ -t 1-' + str(n_seed) + '\n')
+    if options != '': f.write('#$ ' + options + '\n')
+    f.write(command + '\n')
+
+#==========================================================
+def submit_batch ( script_file, submit_command = 'qsub' ):
+###########################################################
+  print('Submitting:', submit_command, script_file)
+  return subprocess.call(submit_command + ' ' + script_file, shell = True)
+
+#==========================================================
+def campaign_stats ( results ):
+# Threshold statistics of a list of result records.
+###########################################################
+  ith = sorted([r['threshold'] for r in results if r['converged']])
+  stats = {'n_total': len(results), 'n_not_converged': len(results) - len(ith)}
+  if len(ith) == 0: return stats
+  stats['mean'] = statistics.mean(ith)
+  stats['std'] = statistics.stdev(ith) if len(ith) > 1 else 0.0
+  stats['min'] = ith[0]
+  stats['median'] = statistics.median(ith)
+  stats['max'] = ith[-1]
+  if len(ith) > 1:
+    q = statistics.quantiles(ith, n = 20, method = 'inclusive')
+    stats['p05'] = q[0]
+    stats['p95'] = q[-1]
+  return stats
+
+#==========================================================
+def print_stats ( stats ):
+###########################################################
+  print ("Of ", stats['n_total'], " threshold calculations, ", stats['n_not_converged'], " did not converge")
+  for key in ['mean', 'std', 'min', 'p05', 'median', 'p95', 'max']:
+    if key in stats: print ('  ' + key.ljust(8) + ' Ith = ' + '%.6g' % stats[key] + ' (A)')
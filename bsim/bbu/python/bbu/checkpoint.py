@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Checkpoints for DR_SCAN and PHASE_SCAN modes, so that an interrupted scan can be resumed.
+# Checkpoints are off by default. The checkpoint directory py_par['checkpoint_dir'] ('' => no checkpoints)
+# has one subdirectory per scan mode (drscan, phase_scan, ...), set as py_par['checkpoint_dir'] by setup,
+# so scans of different modes do not clear each other's checkpoints. Each subdirectory holds:
+#   scan.json            -- mode and scan name (results store) of the scan
+#   point_<coord>.json   -- result of a completed scan point
+#   bracket_<coord>.json -- threshold search state of a point in progress (the charge0/charge1 bracket,
+#                           growth rates and the next test current), written before each bbu run
+# <coord> is the scan coordinate (arctime, phase, or phase_x_phase_y), so checkpoints do not depend on
+# the order in which the points are run.
+# With py_par['resume'] = True, completed points are not run again and points in progress continue
+# from their saved bracket. Otherwise the checkpoint directory is cleared when the scan starts.
+# All files are written to a temporary file first and then renamed, so a job killed while writing
+# cannot leave a corrupt checkpoint.
+
+import os, glob, json
+
+#==========================================================
+def setup ( py_par, mode ):
+# Prepare the checkpoint directory of the mode at the start of a scan.
+# Jobs running at the same time must not share a checkpoint directory: a new scan clears it.
+# On resume, the scan name of the interrupted scan is reused (py_par['scan_id']) so that
+# all points of the scan are together in the results store.
+###########################################################
+  cdir = py_par.get('checkpoint_dir', '')
+  if (cdir == ''): return
+  if (os.path.basename(os.path.normpath(cdir)) != mode): cdir = os.path.join(cdir, mode)
+  py_par['checkpoint_dir'] = cdir
+  os.makedirs(cdir, exist_ok = True)
+  scan_file = os.path.join(cdir, 'scan.json')
+
+  if (py_par.get('resume', False) and os.path.exists(scan_file)):
+    info = read_json(scan_file)
+    if (info['mode'] == mode):
+      py_par['scan_id'] = info['scan_id']
+      print('Resuming scan', info['scan_id'], 'from checkpoints in', cdir, ':',
+                           len(glob.glob(os.path.join(cdir, 'point_*.json'))), 'points done')
+      return
+    print('CHECKPOINTS IN', cdir, 'ARE FOR MODE', info['mode'], '. STARTING A NEW SCAN.')
+
+  for f in glob.glob(os.path.join(cdir, 'point_*.json')) + glob.glob(os.path.join(cdir, 'bracket_*.json')): os.remove(f)
+  write_json(scan_file, {'mode': mode, 'scan_id': py_par.get('scan_id', '')})
+
+#==========================================================
+def coord_name ( coord ):
+# Name of a scan coordinate: a number, or a tuple of numbers followed by file names (ignored).
+###########################################################
+  if (not isinstance(coord, (tuple, list))): coord = [coord]
+  return '_'.join('%.12g' % float(v) for v in coord if not isinstance(v, str))
+
+#==========================================================
+def point_file ( py_par, coord ):
+###########################################################
+  return os.path.join(py_par['checkpoint_dir'], 'point_' + coord_name(coord) + '.json')
+
+#==========================================================
+def bracket_file ( py_par, coord ):
+###########################################################
+  return os.path.join(py_par['checkpoint_dir'], 'bracket_' + coord_name(coord) + '.json')
+
+#==========================================================
+def read_point ( py_par, coord ):
+# Return the saved result tuple of a scan point, or None if the point is not done (or not resuming).
+###########################################################
+  if (py_par.get('checkpoint_dir', '') == '' or not py_par.get('resume', False)): return None
+  file_name = point_file(py_par, coord)
+  if (not os.path.exists(file_name)): return None
+  return tuple(read_json(file_name)['result'])
+
+#==========================================================
+def write_point ( py_par, coord, result ):
+# Save the result tuple (is_Ith_found, ..., Ith) of a completed scan point.
+###########################################################
+  if (py_par.get('checkpoint_dir', '') == ''): return
+  result = [bool(result[0])] + [float(v) for v in result[1:]]
+  write_json(point_file(py_par, coord), {'coord': coord_name(coord), 'result': result})
+  if (os.path.exists(bracket_file(py_par, coord))): os.remove(bracket_file(py_par, coord))
+
+#==========================================================
+def read_json ( file_name ):
+###########################################################
+  with open(file_name, 'r') as f:
+    return json.load(f)
+
+#==========================================================
+def write_json ( file_name, data ):
+###########################################################
+  with open(file_name + '.' + str(os.getpid()), 'w') as f: json.dump(data, f)
+  os.replace(file_name + '.' + str(os.getpid()), file_name)
@@ -5,6 +5,7 @@ import pylab
 import os
 import matplotlib.pyplot as plt
 import numpy as np
+from bbu import results_store, scan_plot
 
 #######################
 def setup_drscan ( arc_time, py_par ):
@@ -28,33 +29,14 @@ def calc_arcl ( arctime ):
 #######################
 def make_dr_plot ( py_par ):
 ####################### 
-  x = []
-  y = []
-  f = []
-  lines = []
-  p = []
-  my_plotfile = "thresh_v_trotb.txt"
-  f = open(os.path.join(py_par['temp_dir'],my_plotfile), 'r')
-  lines = f.readlines()
-  f.close()
-
-  for line in lines:
-    p = line.split()
-    x.append(float(p[0]))
-    y.append(float(p[1]))
-
-    xv = np.array(x)
-    yv = np.array(y)
-
-  plt.scatter(xv, yv, marker = 'o', color = 'b')
-#  plt.title("DR Scan for Q=10^-4, R/Q=100Ohm, f=2E9Hz, m12=10")
-  plt.rcParams.update({'font.size': 20})
-  plt.xlabel("Arc Time / Bunch Time")
-  plt.ylabel("Ith (A)")
-  #plt.text(.15, .9, 'PRSTAB 7 (2004) Fig. 3.')
-  #fig = plt.figure()
-  #ax = fig.add_subplot(2,1,1)  
-  #ax.annotate('PRSTAB 7 (2004) Fig. 3.',xy=(0,0))
-  plt.yscale('log')
-  plt.show()
+  # Plot Log(Ith) vs tr/tb (see scan_plot.py for py_par['plot_format'])
+  # Results are taken from the results store if there is one, else from thresh_v_trotb.txt in temp_dir
+  if (py_par.get('results_db', '') != ''):
+    rows = results_store.get_results(py_par['results_db'], 'drscan', py_par.get('scan_id', ''), True)
+    xv = np.array([r['x'] for r in rows])
+    yv = np.array([r['threshold'] for r in rows])
+  else:
+    xv, yv = scan_plot.read_scan_file(os.path.join(py_par['temp_dir'],'thresh_v_trotb.txt'))
+
+  scan_plot.make_scan_plot(py_par, xv, yv, "Arc Time / Bunch Time", 'thresh_v_trotb')
 
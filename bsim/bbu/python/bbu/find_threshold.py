@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
-import subprocess, os, tempfile, shutil
-import glob, math, random
+import subprocess, os, tempfile, shutil, atexit, hashlib
+import glob, math, random, re
 
 #===============================================================
 # Report stability of a bbu run 
 # In: d[v_gain] and d[lostbool] from dictionary "d" (parsed for_py.txt) 
 # Out: 0(unstable) or 1(stable)
+
+## This number is critical in determining the stability of the test current 
+## Ideally this number is 1.0, but there is noise
+## A stable test current may have voltage noise up to (by observation) 3.0%
+stability_criterion = 1.03
+
 def get_stability(gain, lost_bool):
 ####################### 
-  ## This number is critical in determining the stability of the test current 
-  ## Ideally this number is 1.0, but there is noise
-  ## A stable test current may have voltage noise up to (by observation) 3.0%
-  criterion = 1.03
+  criterion = stability_criterion
   
   if (lost_bool):  
     is_stable = 0
@@ -26,27 +29,82 @@ def get_stability(gain, lost_bool):
 
   return is_stable
 
+#===============================================================
+# Growth rate of a bbu run measured relative to the stability boundary
+# In: dictionary "d" (parsed for_py.txt) 
+# Out: log(v_gain / stability_criterion), which is negative for a stable current and positive for an unstable one,
+#      or None if the run does not give a usable growth rate (beam lost or tracking ended before settling).
+def get_growth_rate(d):
+
+  if (d['lostbool']): return None
+  if (d['growth_rate_set']): return d['growth_rate'] - math.log(stability_criterion)
+  if (d['v_gain'] > 0): return math.log(d['v_gain'] / stability_criterion)
+  return None
+
 #===============================================================
 
 # Update dictionary t when finding Ith
-# In: dictionary t, stability of the current run, tolerance in finding Ith 
+# In: dictionary t, stability of the current run, search method, tolerance in finding Ith 
 # charge0 is the temporary lower bound, charge1 is the higher bound
-def calc_new_charge( t, bool_stable):
+#
+# search = 'bisection':    Bisect [charge0, charge1].
+# search = 'regula_falsi': Interpolate the growth rates at charge0 and charge1 to the stability boundary
+#                          (Illinois variant of regula falsi). Falls back to bisection if a growth rate is unknown.
+# In both cases the charge is doubled until an unstable charge is found.
+def calc_new_charge( t, bool_stable, search = 'bisection', rel_tol = 1e-2 ):
 
   if (not bool_stable):  # Current is unstable at this charge, update upper-bound
     print ('Test current NOT STABLE, reset charge1')
     t['charge1'] = t['bunch_charge']
     t['growth_rate1'] = t['growth_rate']
+    side = 1
   else:     # Current is stable at the charge, update lower-bound
     print ('Test current STABLE, reset charge0')
     t['charge0'] = t['bunch_charge']
     t['growth_rate0'] = t['growth_rate']
+    side = 0
+
+  # Illinois modification: If the same bound is moved twice in a row, halve the growth rate 
+  # at the other bound so that the interpolation does not stall on one side.
+  if (side == t.get('side', -1)):
+    t['n_same_side'] = t.get('n_same_side', 0) + 1
+    other = 'growth_rate' + str(1-side)
+    if (t.get(other) is not None): t[other] = t[other] / 2
+  else:
+    t['n_same_side'] = 0
+  t['side'] = side
 
   if (t['charge1'] > 0):   # Unstable charge has been found
+    if (search == 'regula_falsi'):
+      t['bunch_charge'] = regula_falsi_charge( t, rel_tol )
+    else:
       t['bunch_charge'] = (t['charge0'] + t['charge1']) / 2
   else:  # Still searching for an unstable charge
       t['bunch_charge'] = t['bunch_charge'] * 2
 
+#===============================================================
+# New test charge from linear interpolation of the growth rate between charge0 and charge1.
+# Safeguards:
+#   Bisect if a growth rate is unknown or the unstable one is not positive, or if 
+#   the bracket has failed to shrink from the other side after three steps.
+#   Keep the test charge at least rel_tol/4 (relative to charge1) away from the bracket ends, so 
+#   that a threshold close to one end is bracketed within rel_tol by the following run.
+def regula_falsi_charge( t, rel_tol ):
+
+  c0, c1 = t['charge0'], t['charge1']
+  g0, g1 = t.get('growth_rate0'), t.get('growth_rate1')
+
+  if (g0 is None or g1 is None or g1 <= 0 or t['n_same_side'] > 2):
+    print ('Bisecting the threshold bracket')
+    return (c0 + c1) / 2
+  g0 = min(g0, 0)   # A stable run with growth rate above the boundary is taken to be at the boundary (noise).
+
+  charge = c0 - g0 * (c1 - c0) / (g1 - g0)
+  eps = min(0.25 * rel_tol * c1, 0.5 * (c1 - c0))
+  charge = min(max(charge, c0 + eps), c1 - eps)
+  print ('Interpolating the growth rate to the stability boundary')
+  return charge
+
 #==========================================================
 def keep_bbu_param ( bbu_params, temp_dir ):
 # Creates temporary bbu_template.init to store user-defined bbu parameters
@@ -69,43 +127,22 @@ def prepare_lat (py_par, lat_file):
   f_lat = open(f_name, 'w')
   f_lat.write('call, file = '+lat_file+'\n')
   f_lat.close()
+  py_par['lat_file'] = lat_file
 
 #==========================================================
 def prepare_HOM ( py_par ):
 # For threshold mode only, assign RANDOM HOMs.
-#    - BBU will run once (may fail if no pre-assignment) to output hom_info.txt, which contains cavity names
+#    - The cavity names are found with get_cavity_names (BBU runs once in list cavities mode, or the names are cached)
 #    - HOMs are assigned from py_par['hom_dir'] 
 #    - Create rand_assign_homs.bmad
 #    - Commands to call rand_assign_homs.bmad are added in temp_lat.lat, called by bbu.init
 ###############################################################################
    
 ## For threshold mode:
-  # Runs bbu ONCE to get the cavity names 
-  # The names are stored in hom_info.txt (check bbu_program.f90) 
-  print(' Running BBU ONCE to generate hom_info.txt ')
-  print(' If no fail, the user has pre-assigned HOMs, and will be overwritten by the random HOMs.')
-  print(' To prevent overwritting, set "py_par["random_homs"]" to FALSE before running. ')
-  run_bbu( py_par['threshold_start_curr'], py_par, 'threshold' )  
-
-  # Get all cavity names from hom_info.txt
-  f = open(os.path.join(py_par['temp_dir'], 'hom_info.txt'),'r')     
+  cav_names = get_cavity_names( py_par )
   # Make sure hom_dir contains ONLY hom data files ended in "dat"
-  hom_files = glob.glob( os.path.join( os.path.expandvars(py_par['hom_dir']), '*dat') ) 
+  hom_files = list_hom_files( py_par['hom_dir'] )
   print('The number of cavity HOM files located:', len(hom_files))
-  cav_names = []
-  #Skip the first line, which says "cavity_name"
-  next(f)
-  for line in f:        
-    s = line.split()
-    seen = False
-    if len(s) > 0:
-      cav_name = s[0]
-      # Exit so no double-count any cavity for multipass 
-      for i in range(len(cav_names)):
-        if (cav_name == cav_names[i]):
-          seen = True
-      if (not seen): cav_names.append(cav_name) 
-
 
   # Create HOM assignement file
   f_assign = open(os.path.join(py_par['temp_dir'],'rand_assign_homs.bmad'), 'w')
@@ -142,9 +179,124 @@ def prepare_HOM ( py_par ):
   f_lat2.close()
 
 
+#==========================================================
+# Caches for prepare_HOM:
+#   cavity_name_cache[key] = list of cavity names, where key is computed by cavity_cache_key.
+#   hom_file_cache[hom_dir] = (modification time of hom_dir, sorted list of the HOM files in hom_dir)
+
+cavity_name_cache = {}
+hom_file_cache = {}
+
+#==========================================================
+def get_cavity_names ( py_par ):
+# Return the list of cavity names of the lattice, without duplicates (EG: multipass), in lattice order.
+# The names are found by running bbu in list-cavities-only mode (see bbu_program.f90), which writes 
+# hom_info.txt without tracking. The pre-assigned HOMs, if any, will be overwritten by the random HOMs.
+# The list is cached in memory and, if py_par['cache_dir'] is set, in <cache_dir>/cavities_<key>.txt 
+# so that it is found only once for a given lattice and bbu parameters.
+###############################################################################
+  key = cavity_cache_key( py_par )
+  if ( key in cavity_name_cache ): return cavity_name_cache[key]
+
+  cache_file = None
+  if ( py_par.get('cache_dir', '') != '' ):
+    cache_file = os.path.join(py_par['cache_dir'], 'cavities_' + key + '.txt')
+    if ( os.path.isfile(cache_file) ):
+      with open(cache_file, 'r') as f: cav_names = f.read().split()
+      cavity_name_cache[key] = cav_names
+      return cav_names
+
+  print(' Running BBU in list cavities mode to generate hom_info.txt ')
+  print(' To prevent overwritting pre-assigned HOMs, set "py_par["random_homs"]" to FALSE before running. ')
+  write_bbu_init( py_par['threshold_start_curr'], py_par, 'threshold' )
+  subprocess.call( py_par['exec_path'] + ' -list_cavities', shell = True, cwd = py_par['temp_dir'],
+                   stdout = subprocess.DEVNULL if py_par.get('bbu_log', False) else None )
+
+  # Get all cavity names from hom_info.txt. Skip the first line, which says "cavity_name"
+  cav_names = []
+  seen = set()
+  with open(os.path.join(py_par['temp_dir'], 'hom_info.txt'),'r') as f:
+    next(f)
+    for line in f:        
+      s = line.split()
+      # Do not double-count any cavity for multipass 
+      if len(s) > 0 and s[0] not in seen:
+        seen.add(s[0])
+        cav_names.append(s[0])
+
+  cavity_name_cache[key] = cav_names
+  if ( cache_file is not None ):
+    with open(cache_file + '.' + str(os.getpid()), 'w') as f: f.write('\n'.join(cav_names) + '\n')
+    os.replace(cache_file + '.' + str(os.getpid()), cache_file)
+  return cav_names
+
+#==========================================================
+def cavity_cache_key ( py_par ):
+# Hash of the lattice file, of all files it calls (see lattice_files), and of bbu_template.init 
+# (without the lat_filename, current and ran_seed lines, which do not affect the cavity list).
+# Files read by the lattice in other ways than "call, file = ..." are not in the hash: if such a file 
+# changes the cavities, delete the cavities_*.txt files in py_par['cache_dir'].
+###############################################################################
+  h = hashlib.sha1()
+  lat_file = os.path.expandvars(py_par.get('lat_file', '').strip('\'"'))
+  if ( os.path.isfile(lat_file) ):
+    for file_name in lattice_files(lat_file):
+      h.update(file_name.encode())
+      with open(file_name, 'rb') as f: h.update(f.read())
+  else:
+    h.update(lat_file.encode())
+  with open(os.path.join(py_par['temp_dir'], 'bbu_template.init'), 'r') as f:
+    for line in f:
+      if ( 'lat_filename' in line or 'current' in line or 'ran_seed' in line ): continue
+      h.update(line.encode())
+  return h.hexdigest()
+
+#==========================================================
+call_re = re.compile(r'''\bcall\s*,\s*file\s*=\s*(['"]?)([^'"\s,]+)\1''', re.IGNORECASE)
+
+def lattice_files ( lat_file ):
+# Return the list of lattice files: lat_file and the files called ("call, file = ...") by it, 
+# recursively. Called file names are relative to the directory of the calling file. 
+# Called files that do not exist are skipped (bmad will report them).
+###############################################################################
+  files = []
+  todo = [os.path.abspath(lat_file)]
+  while ( len(todo) > 0 ):
+    file_name = todo.pop(0)
+    if ( file_name in files or not os.path.isfile(file_name) ): continue
+    files.append(file_name)
+    with open(file_name, 'r', errors = 'replace') as f:
+      for line in f:
+        line = line.split('!')[0]
+        for m in call_re.finditer(line):
+          todo.append(os.path.normpath(os.path.join(os.path.dirname(file_name), os.path.expandvars(m.group(2)))))
+  return files
+
+#==========================================================
+def list_hom_files ( hom_dir ):
+# Return the sorted list of HOM files ("*dat") in hom_dir. The list is cached until hom_dir is modified.
+###############################################################################
+  hom_dir = os.path.expandvars(hom_dir)
+  mtime = os.path.getmtime(hom_dir)
+  if ( hom_dir in hom_file_cache and hom_file_cache[hom_dir][0] == mtime ): return hom_file_cache[hom_dir][1]
+  hom_files = sorted(glob.glob( os.path.join(hom_dir, '*dat') ))
+  hom_file_cache[hom_dir] = (mtime, hom_files)
+  return hom_files
+
 #==========================================================
 def  run_bbu ( temp_curr, py_par, mode ):
 # Prepare/update bbu.init and run the bbu program once for a specific test current 
+########################################################
+  write_bbu_init( temp_curr, py_par, mode )
+  if ( mode == 'threshold' ):
+    print ('Running BBU with current ', str(temp_curr), '(A)')
+  else:
+    print ('Subprocess begins!!!  Running BBU with current ', str(temp_curr), '(A)')
+  call_bbu( py_par, temp_curr, mode )  # Run bbu 
+
+#==========================================================
+def  write_bbu_init ( temp_curr, py_par, mode ):
+# Write bbu.init from bbu_template.init for a specific test current 
 ########################################################
   if ( mode == 'threshold' ):
     
@@ -156,9 +308,6 @@ def  run_bbu ( temp_curr, py_par, mode ):
       temp_file.write( line.replace( "temp_curr", str(temp_curr)) )  
     template_file.close()
     temp_file.close()
-    print ('Running BBU with current ', str(temp_curr), '(A)')
-
-    subprocess.call( py_par['exec_path'], shell = True)  # Run bbu 
 
   if ( mode == 'drscan' or mode == 'phase_scan' or mode == 'phase_xy_scan'):
     
@@ -173,5 +322,93 @@ def  run_bbu ( temp_curr, py_par, mode ):
     template_file.close()
     temp_file.close()
 
-    print ('Subprocess begins!!!  Running BBU with current ', str(temp_curr), '(A)')
-    subprocess.call( py_par['exec_path'], shell = True)  # Run bbu
+#==========================================================
+def call_bbu ( py_par, temp_curr, mode ):
+# Run the bbu program in py_par['temp_dir'], where bbu.init is.
+# If py_par['bbu_log'] is set, the bbu terminal output goes to bbu.log in that directory.
+# If py_par['persistent_worker'] is set, the run is done by a bbu worker process (see run_bbu_worker).
+########################################################
+  if ( py_par.get('persistent_worker', False) ):
+    run_bbu_worker( py_par, temp_curr, mode )
+  elif ( py_par.get('bbu_log', False) ):
+    with open(os.path.join(py_par['temp_dir'], 'bbu.log'), 'a') as log:
+      subprocess.call( py_par['exec_path'], shell = True, cwd = py_par['temp_dir'], stdout = log, stderr = subprocess.STDOUT )
+  else:
+    subprocess.call( py_par['exec_path'], shell = True, cwd = py_par['temp_dir'] )
+
+#==========================================================
+# Persistent bbu workers. A worker is a "bbu -worker" process, started in temp_dir, which keeps the
+# parsed and hybridized lattice in memory between runs and takes commands on stdin.
+# bbu_workers[temp_dir] = {'proc': Popen object, 'lat2': contents of lat2.lat last sent, 'lat': contents of the lattice files last parsed}
+
+bbu_workers = {}
+
+def run_bbu_worker ( py_par, temp_curr, mode ):
+# Run bbu at temp_curr with the worker for py_par['temp_dir'], starting the worker if needed.
+# lat2 is only sent when lat2.lat has changed, and the lattice is only reparsed when temp_lat.lat or 
+# rand_assign_homs.bmad have changed (EG: new HOM assignments in threshold mode).
+########################################################
+  temp_dir = py_par['temp_dir']
+  w = bbu_workers.get(temp_dir)
+  if ( w is None or w['proc'].poll() is not None ):
+    print ('Starting bbu worker in ', temp_dir)
+    proc = subprocess.Popen( py_par['exec_path'] + ' -worker', shell = True, cwd = temp_dir, text = True, 
+                            stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT )
+    w = {'proc': proc, 'lat2': None, 'lat': read_file_contents(temp_dir, ['temp_lat.lat', 'rand_assign_homs.bmad'])}
+    bbu_workers[temp_dir] = w
+
+  commands = []
+  lat = read_file_contents(temp_dir, ['temp_lat.lat', 'rand_assign_homs.bmad'])
+  if ( lat != w['lat'] ):
+    commands.append('reparse')
+    w['lat'] = lat
+
+  if ( mode == 'drscan' or mode == 'phase_scan' or mode == 'phase_xy_scan'):
+    lat2 = read_file_contents(temp_dir, ['lat2.lat'])
+    if ( lat2 != w['lat2'] ):
+      commands.append('lat2 ' + os.path.join(temp_dir,'lat2.lat'))
+      w['lat2'] = lat2
+
+  commands += ['current ' + repr(float(temp_curr)), 'run']
+  w['proc'].stdin.write('\n'.join(commands) + '\n')
+  w['proc'].stdin.flush()
+
+  log = None
+  if ( py_par.get('bbu_log', False) ): log = open(os.path.join(temp_dir, 'bbu.log'), 'a')
+  for line in w['proc'].stdout:
+    if ( line.strip() == 'BBU_WORKER_DONE' ): break
+    if ( log is None ): print (line, end = '')
+    else: log.write(line)
+  else:
+    if ( log is not None ): log.close()
+    raise RuntimeError('bbu worker in ' + temp_dir + ' stopped before finishing the run')
+  if ( log is not None ): log.close()
+
+#==========================================================
+def stop_bbu_worker ( temp_dir ):
+# Stop the bbu worker for temp_dir, if there is one.
+########################################################
+  w = bbu_workers.pop(temp_dir, None)
+  if ( w is None ): return
+  if ( w['proc'].poll() is None ):
+    w['proc'].stdin.write('quit\n')
+    w['proc'].stdin.close()
+  w['proc'].wait()
+
+#==========================================================
+def stop_all_bbu_workers ():
+  for temp_dir in list(bbu_workers):
+    stop_bbu_worker( temp_dir )
+
+atexit.register( stop_all_bbu_workers )
+
+#==========================================================
+def read_file_contents ( dir, file_names ):
+# Return the contents of the files in dir, concatenated. Missing files are skipped.
+########################################################
+  contents = ''
+  for name in file_names:
+    f_name = os.path.join(dir, name)
+    if ( os.path.isfile(f_name) ):
+      with open(f_name, 'r') as f: contents += f.read()
+  return contents
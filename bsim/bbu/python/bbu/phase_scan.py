@@ -5,179 +5,254 @@ import pylab
 import os
 import matplotlib.pyplot as plt
 import numpy as np
+from bbu import results_store, scan_plot
 import math
 
+# Default Twiss parameters at taylorW, used when py_par['twiss_file'] is not set.
+# 1-pass 2016_01_25, after LA.END.MAR\1 (setup_phase_scan)
+#   bW = 13.58259507, aW = -0.78076767
+# 4-pass 2016_05_17, after LA.END.MAR\1
+#   bW = 34.54001603, aW = -1.68026439 (x),  34.11944669, -1.65547205 (y)
+# 4-pass 2016_09_01, after LA.END.MAR\1
+#   bW = 30.36578721, aW = -1.21024368 (x),  29.99476043, -1.19124485 (y)
+# 1-pass 2016_01_25, after LA.END.MAR\1 (y)
+#   byW = 13.48215194, ayW = -0.75675121
+# 4-pass 2016_11_17, after LA.MAR.END\1. Also for 1-pass 2016_12_12 (setup_phase_xy_scan)
+#   bxW = 31.40988174, axW = -1.35641640, byW = 31.02811471, ayW = -1.33553551
+
+twiss_1d_default = {'beta_a': 13.58259507, 'alpha_a': -0.78076767}
+twiss_xy_default = {'beta_a': 31.40988174, 'alpha_a': -1.35641640, 'beta_b': 31.02811471, 'alpha_b': -1.33553551}
+
 #######################
-def setup_phase_scan ( phase, py_par ):
+def read_twiss ( twiss_file, ele_name = '' ):
 #######################
-  # Make lat2 txt file
-  # print("Filling lat2.txt with the new phase (Taylor) ")
-  # Calculate the arclength for this given recirculation time
+  # Read the Twiss parameters at taylorW from twiss_file. Two formats are accepted:
+  #   1) Lines of "name = value" with names beta_a, alpha_a, beta_b, alpha_b (or beta_x, alpha_x, beta_y, alpha_y).
+  #   2) A table, such as the output of Tao "show lattice", with a header line containing the column 
+  #      names Beta_a, Alpha_a, Beta_b, Alpha_b (case insensitive). The row of element ele_name is used,
+  #      or the last row if ele_name is blank.
+  # Out: dictionary with keys beta_a, alpha_a, beta_b, alpha_b
 
-  bW = 13.58259507     # 1-pass 2016_01_25, after LA.END.MAR\1  
-  aW = -0.78076767    
-  #bW = 34.54001603    # 4-pass 2016_05_17, after LA.END.MAR\1
-  #aW = -1.68026439
-  #bW = 30.36578721     # 4-pass 2016_09_01, after LA.END.MAR\1
-  #aW = -1.21024368
+  alias = {'beta_x': 'beta_a', 'alpha_x': 'alpha_a', 'beta_y': 'beta_b', 'alpha_y': 'alpha_b'}
+  twiss = {}
+  cols = None
+  row = None
 
+  f = open(os.path.expandvars(twiss_file), 'r')
+  for line in f:
+    line = line.split('!')[0].strip()
+    if (line == ''): continue
+    if ('=' in line and cols is None):
+      name, value = line.split('=')
+      name = name.strip().lower()
+      twiss[alias.get(name, name)] = float(value)
+      continue
+    words = line.lstrip('#').split()
+    lwords = [alias.get(w.lower(), w.lower()) for w in words]
+    if ('beta_a' in lwords):
+      cols = lwords
+      continue
+    if (cols is None or len(words) < len(cols)): continue
+    if (ele_name == '' or ele_name.upper() in [w.upper() for w in words]): row = words
+  f.close()
 
-  gW = (1+aW*aW)/bW
+  if (cols is not None and row is not None):
+    for name in ['beta_a', 'alpha_a', 'beta_b', 'alpha_b']:
+      if (name in cols): twiss[name] = float(row[cols.index(name)])
 
-  pW = float(phase)
+  if ('beta_a' not in twiss or 'alpha_a' not in twiss):
+    raise ValueError('CANNOT FIND BETA_A AND ALPHA_A IN TWISS FILE: ' + twiss_file)
+  return twiss
 
-  m11W = math.cos(pW) + aW*math.sin(pW)
-  m12W = bW*math.sin(pW)
-  m21W = -gW*math.sin(pW)
-  m22W = math.cos(pW) - aW*math.sin(pW)
+#######################
+def get_twiss ( py_par, twiss_default ):
+#######################
+  # Twiss parameters from py_par['twiss_file'] (and py_par['twiss_ele']) if set, otherwise twiss_default.
+  if (py_par.get('twiss_file', '') == ''): return twiss_default
+  return read_twiss( py_par['twiss_file'], py_par.get('twiss_ele', '') )
 
-  #taylorW: Taylor, {1: m11W | 1}, {1:  m12W | 2}, {2: m21W | 1}, {2:  m22W | 2}
+#######################
+def phase_matrices ( twiss, phase_x, phase_y = None, xy_coupled = 0 ):
+#######################
+  # Compute the taylorW matrix terms for arrays of phases in one pass.
+  # In: Twiss parameters, phase_x array, and for x-y scans phase_y array (same shape as phase_x)
+  # Out: dictionary of term name (EG: 'tt11') -> array of values (same shape as phase_x)
+  #
+  # phase_y = None: 1D phase scan in x only (terms tt11, tt12, tt21, tt22).
+  # xy_coupled = 0: Decoupled x-y phase advances (tt11...tt44 diagonal blocks).
+  # xy_coupled = 1: x-y coupled (tt13...tt42 off-diagonal blocks, diagonal blocks set to zero).
 
-  my_file = open(os.path.join(py_par['temp_dir'],'lat2.lat'),'w')
-    
-  print("Test phase included in lat2: ", pW)
-  my_file.write('taylorW[tt11]='+ str(m11W)+'\n')
-  my_file.write('taylorW[tt12]='+ str(m12W)+'\n')
-  my_file.write('taylorW[tt21]='+ str(m21W)+'\n')
-  my_file.write('taylorW[tt22]='+ str(m22W)+'\n')
+  px = np.asarray(phase_x, dtype = float)
+  bx, ax = twiss['beta_a'], twiss['alpha_a']
+  cx, sx = np.cos(px), np.sin(px)
+
+  if (phase_y is None or xy_coupled == 0):
+    gx = (1+ax*ax)/bx
+    m = {'tt11': cx + ax*sx, 'tt12': bx*sx, 'tt21': -gx*sx, 'tt22': cx - ax*sx}
+    if (phase_y is None): return m
+
+  py = np.asarray(phase_y, dtype = float)
+  by, ay = twiss['beta_b'], twiss['alpha_b']
+  cy, sy = np.cos(py), np.sin(py)
+
+  if (xy_coupled == 0):
+    gy = (1+ay*ay)/by
+    m.update({'tt33': cy + ay*sy, 'tt34': by*sy, 'tt43': -gy*sy, 'tt44': cy - ay*sy})
+    return m
 
+  elif (xy_coupled == 1):
+    zero = np.zeros(px.shape)
+    return {'tt13': math.sqrt(bx/by)*(cx + ay*sx),
+            'tt14': math.sqrt(bx*by)*sx,
+            'tt23': ((ay-ax)*cx-(1+ay*ax)*sx)/math.sqrt(bx*by),
+            'tt24': math.sqrt(by/bx)*(cx - ax*sx),
+            'tt31': math.sqrt(by/bx)*(cy + ax*sy),
+            'tt32': math.sqrt(by*bx)*sy,
+            'tt41': ((ax-ay)*cy-(1+ax*ay)*sy)/math.sqrt(by*bx),
+            'tt42': math.sqrt(bx/by)*(cy - ay*sy),
+            'tt11': zero, 'tt22': zero, 'tt33': zero, 'tt44': zero}
+
+  else:
+    raise ValueError("py_par['xy_coupled'] must be 0 or 1 !!")
+
+#######################
+def write_lat2 ( file_name, m, i = None ):
+#######################
+  # Write the taylorW terms m (from phase_matrices) to a lat2 file. 
+  # If i is given, the terms of the i-th grid point are written.
+  # Lattice file syntax
+  # taylorW: Taylor, {1: m11W | 1}, {1:  m12W | 2}, {2: m21W | 1}, {2:  m22W | 2}
+  my_file = open(file_name,'w')
+  for term in m:
+    val = m[term] if i is None else m[term].flat[i]
+    my_file.write('taylorW['+term+']='+ str(float(val))+'\n')
   my_file.close()
 
+#######################
+def make_phase_grid ( py_par, phase_x, phase_y = None ):
+#######################
+  # Pre-generate the lat2 files for all points of a 1D (phase_y = None) or 2D phase grid.
+  # The files are <temp_dir>/phase_grid/lat2_NNNN.lat with N the index into phase_x (phase_y).
+  # Out: list of lat2 file names
+  if (phase_y is None):
+    m = phase_matrices( get_twiss(py_par, twiss_1d_default), phase_x )
+  else:
+    m = phase_matrices( get_twiss(py_par, twiss_xy_default), phase_x, phase_y, py_par['xy_coupled'] )
+
+  grid_dir = os.path.join(py_par['temp_dir'], 'phase_grid')
+  os.makedirs(grid_dir, exist_ok = True)
+  files = []
+  for i in range(len(phase_x)):
+    files.append(os.path.join(grid_dir, 'lat2_'+str(i).zfill(4)+'.lat'))
+    write_lat2( files[-1], m, i )
+  return files
+
+#######################
+def setup_phase_scan ( phase, py_par ):
+#######################
+  # Make lat2 txt file with the taylorW matrix for a horizontal phase advance phase
+  pW = float(phase)
+  print("Test phase included in lat2: ", pW)
+  write_lat2( os.path.join(py_par['temp_dir'],'lat2.lat'), phase_matrices(get_twiss(py_par, twiss_1d_default), pW) )
+
 #######################
 def setup_phase_xy_scan ( py_par ):
 #######################
-  # Make lat2 txt file
-  # print("Filling lat2.txt with the new phase (Taylor) ")
-  # Calculate the arclength for this given recirculation time
-    
-  phasex = py_par['phase_x']
-  phasey = py_par['phase_y']
-
-  #1-pass 2016_01_25, after LA.END.MAR\1
-  #bxW = 13.58259507  
-  #axW = -0.78076767    
-  #byW = 13.48215194
-  #ayW = -0.75675121
-   
-  # 4-pass 2016_05_17, after LA.END.MAR\1
-  #bxW = 34.54001603   
-  #axW = -1.68026439
-  #byW = 34.11944669
-  #ayW = -1.65547205
-    
-  # 4-pass 2016_09_01, after LA.END.MAR\1
-  #bxW = 30.36578721   
-  #axW = -1.21024368
-  #byW = 29.99476043
-  #ayW = -1.19124485
-  
-  # 4-pass 2016_11_17, after LA.MAR.END\1
-  # Also for 1-pass 2016_12_12
-  bxW = 31.40988174
-  axW = -1.35641640
-  byW = 31.02811471
-  ayW = -1.33553551
-  
-  pxW = float(phasex)
-  pyW = float(phasey)
-  
-  if (py_par['xy_coupled'] == 0):
+  # Make lat2 txt file with the taylorW matrix for the phase advances py_par['phase_x'] and py_par['phase_y']
+  pxW = float(py_par['phase_x'])
+  pyW = float(py_par['phase_y'])
 
-    gxW = (1+axW*axW)/bxW
-    gyW = (1+ayW*ayW)/byW
-    
-    m11W = math.cos(pxW) + axW*math.sin(pxW)
-    m12W = bxW*math.sin(pxW)
-    m21W = -gxW*math.sin(pxW)
-    m22W = math.cos(pxW) - axW*math.sin(pxW)
-    m33W = math.cos(pyW) + ayW*math.sin(pyW)
-    m34W = byW*math.sin(pyW)
-    m43W = -gyW*math.sin(pyW)
-    m44W = math.cos(pyW) - ayW*math.sin(pyW)
-
-    my_file = open(os.path.join(py_par['temp_dir'],'lat2.lat'),'w')
-    
+  if (py_par['xy_coupled'] == 0):
     print("DECOUPLED X-Y phase included in lat2: ", pxW, pyW)
-    my_file.write('taylorW[tt11]='+ str(m11W)+'\n')
-    my_file.write('taylorW[tt12]='+ str(m12W)+'\n')
-    my_file.write('taylorW[tt21]='+ str(m21W)+'\n')
-    my_file.write('taylorW[tt22]='+ str(m22W)+'\n')
-    my_file.write('taylorW[tt33]='+ str(m33W)+'\n')
-    my_file.write('taylorW[tt34]='+ str(m34W)+'\n')
-    my_file.write('taylorW[tt43]='+ str(m43W)+'\n')
-    my_file.write('taylorW[tt44]='+ str(m44W)+'\n')
-    
-    my_file.close()
-
   elif (py_par['xy_coupled'] == 1):
-   
-    m13W = math.sqrt(bxW/byW)*(math.cos(pxW) + ayW*math.sin(pxW))
-    m14W = math.sqrt(bxW*byW)*math.sin(pxW)
-    m23W = ((ayW-axW)*math.cos(pxW)-(1+ayW*axW)*math.sin(pxW))/math.sqrt(bxW*byW)
-    m24W = math.sqrt(byW/bxW)*(math.cos(pxW) - axW*math.sin(pxW))
-
-    m31W = math.sqrt(byW/bxW)*(math.cos(pyW) + axW*math.sin(pyW))
-    m32W = math.sqrt(byW*bxW)*math.sin(pyW)
-    m41W = ((axW-ayW)*math.cos(pyW)-(1+axW*ayW)*math.sin(pyW))/math.sqrt(byW*bxW)
-    m42W = math.sqrt(bxW/byW)*(math.cos(pyW) - ayW*math.sin(pyW))
-
-    # Lattice file syntax
-    # taylorW: Taylor, {1: m11W | 1}, {1:  m12W | 2}, {2: m21W | 1}, {2:  m22W | 2}
-
-    my_file = open(os.path.join(py_par['temp_dir'],'lat2.lat'),'w')
-    
     print(" COUPLED X-Y phase included in lat2: ", pxW, ", ", pyW)
-    
-    my_file.write('taylorW[tt13]='+ str(m13W)+'\n')
-    my_file.write('taylorW[tt14]='+ str(m14W)+'\n')
-    my_file.write('taylorW[tt23]='+ str(m23W)+'\n')
-    my_file.write('taylorW[tt24]='+ str(m24W)+'\n')
-    
-    my_file.write('taylorW[tt31]='+ str(m31W)+'\n')
-    my_file.write('taylorW[tt32]='+ str(m32W)+'\n')
-    my_file.write('taylorW[tt41]='+ str(m41W)+'\n')
-    my_file.write('taylorW[tt42]='+ str(m42W)+'\n')
-
-    my_file.write('taylorW[tt11]= 0.0 '+'\n')
-    my_file.write('taylorW[tt22]= 0.0 '+'\n')
-    my_file.write('taylorW[tt33]= 0.0 '+'\n')
-    my_file.write('taylorW[tt44]= 0.0 '+'\n')
-    
-    my_file.close()
-
   else:
     print("py_par['xy_coupled'] must be 0 or 1 !!")
+    return
+
+  m = phase_matrices(get_twiss(py_par, twiss_xy_default), pxW, pyW, py_par['xy_coupled'])
+  write_lat2( os.path.join(py_par['temp_dir'],'lat2.lat'), m )
+
 #######################
 def make_phase_plot ( py_par ):
 ####################### 
-  x = []
-  y = []
-  f = []
-  lines = []
-  p = []
-  my_plotfile = "thresh_v_phase.txt"
-  f = open(os.path.join(py_par['temp_dir'],my_plotfile), 'r')
-  lines = f.readlines()
-  f.close()
+  # Plot Log(Ith) vs phase (see scan_plot.py for py_par['plot_format'])
+  # Results are taken from the results store if there is one, else from thresh_v_phase.txt in temp_dir
+  if (py_par.get('results_db', '') != ''):
+    rows = results_store.get_results(py_par['results_db'], 'phase_scan', py_par.get('scan_id', ''), True)
+    xv = np.array([r['x'] for r in rows])
+    yv = np.array([r['threshold'] for r in rows])
+  else:
+    xv, yv = scan_plot.read_scan_file(os.path.join(py_par['temp_dir'],'thresh_v_phase.txt'))
 
-  for line in lines:
-    p = line.split()
-    x.append(float(p[0]))
-    y.append(float(p[1]))
+  scan_plot.make_scan_plot(py_par, xv, yv, "Phase", 'thresh_v_phase')
 
-    xv = np.array(x)
-    yv = np.array(y)
 
-  plt.scatter(xv, yv, marker = 'o', color = 'b')
-  #plt.title("Phase Scan for Q=10^-4, R/Q=100Ohm, f=2E9Hz")
-  plt.rcParams.update({'font.size': 20})
-  plt.xlabel("Phase")
-  plt.ylabel("Ith(A)")
-  #plt.text(.15, .9, 'PRSTAB 7 (2004) Fig. 3.')
-  #fig = plt.figure()
-  #ax = fig.add_subplot(111)  
-  #ax.annotate('PRSTAB 7 (2004) Fig. 3.',xy=(0,0))
+#######################
+# Adaptive x-y phase map helpers (see bbu_main.phase_xy_adaptive_scanner).
+# Points are labeled by integer indices (i, j) into the finest grid. 
+# A cell is (i, j, size) with corners (i, j), (i+size, j), (i, j+size), (i+size, j+size).
+# ith is the dictionary (i, j) -> Ith, with NaN for points that did not converge.
+#######################
 
-  plt.yscale('log')
-  plt.show()
+def cell_corners ( cell ):
+  i, j, n = cell
+  return [(i, j), (i+n, j), (i, j+n), (i+n, j+n)]
 
+#######################
+def cells_to_refine ( cells, ith, tol, floor_tol ):
+#######################
+  # Return the cells to refine: Those where log10(Ith) changes by more than tol (decades) over the cell,
+  # those with a corner that did not converge, and those with a corner within floor_tol (decades) of 
+  # the lowest threshold found so far (the instability floor). A map flat to within floor_tol has no floor.
+  log_ith = np.log10(list(ith.values()))
+  log_min = np.nanmin(log_ith)
+  if (np.nanmax(log_ith) - log_min < floor_tol): log_min = -np.inf
+  refine = []
+  for cell in cells:
+    if (cell[2] < 2): continue
+    v = np.log10([ith[c] for c in cell_corners(cell)])
+    if (np.any(np.isnan(v)) or v.max() - v.min() > tol or v.min() < log_min + floor_tol): refine.append(cell)
+  return refine
+
+#######################
+def split_cell ( cell ):
+#######################
+  i, j, n = cell
+  h = n // 2
+  return [(i, j, h), (i+h, j, h), (i, j+h, h), (i+h, j+h, h)]
+
+#######################
+def grid_phase_map ( leaves, ith, nf ):
+#######################
+  # Fill the nf x nf finest grid by bilinear interpolation of log10(Ith) over each leaf cell.
+  # Out: Ith grid (nf x nf) and mask of the evaluated points
+  log_ith = np.full((nf, nf), np.nan)
+  for cell in leaves:
+    i, j, n = cell
+    v00, v10, v01, v11 = np.log10([ith[c] for c in cell_corners(cell)])
+    u = np.linspace(0, 1, n+1)[:,None]
+    w = np.linspace(0, 1, n+1)[None,:]
+    log_ith[i:i+n+1, j:j+n+1] = (1-u)*(1-w)*v00 + u*(1-w)*v10 + (1-u)*w*v01 + u*w*v11
+
+  evaluated = np.zeros((nf, nf), dtype = bool)
+  for (i, j) in ith:
+    log_ith[i, j] = np.log10(ith[(i, j)])
+    evaluated[i, j] = True
+  return 10**log_ith, evaluated
+
+#######################
+def make_phase_xy_map_plot ( py_par, map_file = 'phase_xy_map.npz', plot_file = 'phase_xy_map.png' ):
+#######################
+  # Plot log10(Ith) of the gridded adaptive phase map with the evaluated points, and save it to plot_file.
+  m = np.load(os.path.join(py_par['temp_dir'], map_file))
+  plt.switch_backend('Agg')
+  fig, ax = plt.subplots()
+  mesh = ax.pcolormesh(m['phase_x'], m['phase_y'], np.log10(m['ith']).T, shading = 'nearest')
+  fig.colorbar(mesh, ax = ax, label = 'log10(Ith(A))')
+  ix, iy = np.nonzero(m['evaluated'])
+  ax.plot(m['phase_x'][ix], m['phase_y'][iy], 'k.', markersize = 2)
+  ax.set_xlabel('Phase x')
+  ax.set_ylabel('Phase y')
+  fig.savefig(os.path.join(py_par['temp_dir'], plot_file))
+  plt.close(fig)
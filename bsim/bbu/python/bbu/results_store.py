@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Results store: One SQLite table with a row per threshold calculation, for all modes.
+# Any number of processes (scan points, campaign seeds, batch jobs) can append to the same file:
+# SQLite locks the file during a write and a writer waits up to `timeout` seconds for the lock.
+# Note: SQLite file locking is not reliable on some network file systems (NFS).
+#
+# Columns:
+#   scan       -- name of the scan (or campaign) the row belongs to
+#   mode       -- 'threshold', 'drscan', 'phase_scan' or 'phase_xy_scan'
+#   x, y       -- scan coordinate: tr/tb (drscan), phase (phase_scan), phase_x and phase_y (phase_xy_scan)
+#   threshold  -- Ith (A). NULL if not converged
+#   converged  -- 1 if Ith was found, 0 otherwise
+#   n_runs     -- number of bbu runs used
+#   wall_time  -- wall time of the threshold search (s)
+#   seed       -- bbu ran_seed
+#   time       -- when the row was written (seconds since the epoch)
+
+import sqlite3, time
+
+columns = ['scan', 'mode', 'x', 'y', 'threshold', 'converged', 'n_runs', 'wall_time', 'seed', 'time']
+
+#==========================================================
+def connect ( db_file, timeout = 60 ):
+# Open db_file, creating the results table if needed.
+###########################################################
+  conn = sqlite3.connect(db_file, timeout = timeout)
+  conn.row_factory = sqlite3.Row
+  with conn:
+    conn.execute('CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, ' +
+                 'scan TEXT, mode TEXT, x REAL, y REAL, threshold REAL, converged INTEGER, ' +
+                 'n_runs INTEGER, wall_time REAL, seed INTEGER, time REAL)')
+  return conn
+
+#==========================================================
+def add_result ( db_file, scan, mode, converged, threshold, x = None, y = None, n_runs = None, wall_time = None, seed = None ):
+# Append one row. Each call is its own transaction.
+###########################################################
+  if (not converged): threshold = None
+  conn = connect(db_file)
+  with conn:
+    conn.execute('INSERT INTO results (' + ', '.join(columns) + ') VALUES (?,?,?,?,?,?,?,?,?,?)',
+                 (scan, mode, x, y, threshold, int(bool(converged)), n_runs, wall_time, seed, time.time()))
+  conn.close()
+
+#==========================================================
+def get_results ( db_file, mode = None, scan = None, converged = None ):
+# Return the rows (as dictionaries) selected by mode, scan and converged (None => all),
+# ordered by x, y and then by the order in which they were written.
+###########################################################
+  where = []
+  values = []
+  for key, value in [('mode', mode), ('scan', scan), ('converged', converged)]:
+    if value is None: continue
+    where.append(key + ' = ?')
+    values.append(int(value) if key == 'converged' else value)
+  query = 'SELECT * FROM results'
+  if len(where) > 0: query += ' WHERE ' + ' AND '.join(where)
+  query += ' ORDER BY x, y, id'
+
+  conn = connect(db_file)
+  rows = [dict(r) for r in conn.execute(query, values)]
+  conn.close()
+  return rows
+
+#==========================================================
+def get_scans ( db_file ):
+# Return the list of scan names, oldest first.
+###########################################################
+  conn = connect(db_file)
+  scans = [r[0] for r in conn.execute('SELECT scan FROM results GROUP BY scan ORDER BY MIN(id)')]
+  conn.close()
+  return scans
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Plots of Ith versus the scan coordinate for DR_SCAN and PHASE_SCAN modes.
+# py_par['plot_format'] = 'png' or 'pdf': The plot is written to <temp_dir>/<name>.<format> using the
+#   non-interactive Agg backend, so no display is needed and the run never waits for a window to be closed.
+# py_par['plot_format'] = 'show': The plot is shown on screen and the run continues when the window is closed.
+
+import os
+import matplotlib.pyplot as plt
+import numpy as np
+
+#######################
+def use_backend ( py_par ):
+#######################
+  if (py_par.get('plot_format', 'png') != 'show'): plt.switch_backend('Agg')
+
+#######################
+def plot_file ( py_par, name ):
+#######################
+  return os.path.join(py_par['temp_dir'], name + '.' + py_par.get('plot_format', 'png'))
+
+#######################
+def read_scan_file ( file_name ):
+#######################
+  # Return the arrays (x, Ith) of the converged points in a scan output file with lines "x	Ith" or "DID NOT CONVERGE"
+  with open(file_name, 'r') as f:
+    data = [line.split() for line in f if line.strip() != 'DID NOT CONVERGE' and line.strip() != '']
+  data = np.array(data, dtype = float).reshape(-1, 2)
+  return data[:,0], data[:,1]
+
+#######################
+def new_scan_axes ( xlabel ):
+#######################
+  plt.rcParams.update({'font.size': 20})
+  fig, ax = plt.subplots()
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel("Ith (A)")
+  ax.set_yscale('log')
+  return fig, ax
+
+#######################
+def finish_plot ( py_par, fig, name ):
+#######################
+  # Show the plot or write it to its file
+  if (py_par.get('plot_format', 'png') == 'show'):
+    plt.show()
+  else:
+    fig.savefig(plot_file(py_par, name), bbox_inches = 'tight')
+    print('Plot written to', plot_file(py_par, name))
+  plt.close(fig)
+
+#######################
+def make_scan_plot ( py_par, x, ith, xlabel, name ):
+#######################
+  use_backend(py_par)
+  fig, ax = new_scan_axes(xlabel)
+  ax.scatter(x, ith, marker = 'o', color = 'b')
+  finish_plot(py_par, fig, name)
+
+#######################
+class LivePlot:
+#######################
+  # Plot of a scan that is updated as each scan point is completed (py_par['plot_live'] = True).
+  # On screen, the window is redrawn without stopping the scan. Otherwise the plot file is rewritten
+  # after each point, so the progress of a batch job can be followed by looking at the file.
+  # Points not yet done (and points that did not converge) are NaN and are not drawn.
+
+  def __init__ ( self, py_par, n_points, xlabel, name ):
+    self.py_par = py_par
+    self.name = name
+    self.show = (py_par.get('plot_format', 'png') == 'show')
+    use_backend(py_par)
+    if (self.show): plt.ion()
+    self.fig, self.ax = new_scan_axes(xlabel)
+    self.xy = np.full((n_points, 2), np.nan)
+    self.points = self.ax.scatter(self.xy[:,0], self.xy[:,1], marker = 'o', color = 'b')
+
+  def add ( self, n, x, ith ):
+    # Point n of the scan is done
+    self.xy[n] = (x, ith)
+    self.points.set_offsets(self.xy)
+    x0, x1 = np.nanmin(self.xy[:,0]), np.nanmax(self.xy[:,0])
+    y0, y1 = np.nanmin(self.xy[:,1]), np.nanmax(self.xy[:,1])
+    dx = 0.05 * (x1 - x0) if x1 > x0 else 0.5
+    self.ax.set_xlim(x0 - dx, x1 + dx)
+    self.ax.set_ylim(y0 / 1.5, y1 * 1.5)
+    if (self.show):
+      self.fig.canvas.draw_idle()
+      plt.pause(0.001)
+    else:
+      self.fig.savefig(plot_file(self.py_par, self.name), bbox_inches = 'tight')
+
+  def close ( self ):
+    if (self.show): plt.ioff()
+    finish_plot(self.py_par, self.fig, self.name)
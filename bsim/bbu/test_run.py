@@ -37,6 +37,14 @@ py_par = {  \
 'temp_dir': '',                # Will be created, LEAVE IT EMPTY
 'threshold_start_curr': 0.1,  # Initial test current for all modes
 'final_rel_tol': 1e-2,                     # Final threshold current accuracy. Small => slow
+'threshold_search': 'bisection',  # 'bisection' or 'regula_falsi' (interpolate the growth rate, fewer bbu runs)
+'warm_start': False,           # DR_SCAN, PHASE_SCAN: start each search from the threshold of a neighboring point
+'warm_start_width': 0.05,      # Relative half width of the warm start bracket
+'persistent_worker': False,    # Run bbu as a persistent worker ("bbu -worker") that keeps the lattice in memory
+'n_proc': 1,                   # Number of scan points (DR_SCAN, PHASE_SCAN) run in parallel. 0 => number of cores
+'results_db': 'bbu_results.db', # Results store (SQLite) in the working directory, shared by all modes and jobs. '' => not used
+'checkpoint_dir': '',          # Scan checkpoints in the working directory (EG: 'bbu_checkpoint'), used by --resume. '' => no checkpoints.
+                               # Jobs running at the same time in the same working directory must use different directories.
 
 ############## Parameters for DR_SCAN  mode:   #################################
 
@@ -52,6 +60,8 @@ py_par = {  \
 
 
 'plot_drscan': True,   # Create a python plot?
+'plot_format': 'png',  # DR_SCAN, PHASE_SCAN plots: 'png' or 'pdf' (written to file, no display needed) or 'show' (on screen, waits for the window to be closed)
+'plot_live': False,    # Update the plot as each scan point is done
 
 ############## Parameters for PHASE_SCAN  mode:   ##################################
 
@@ -66,6 +76,25 @@ py_par = {  \
 'phase_x': 0, 
 'phase_y': 0,   
 'xy_coupled': 1,        # 1=YES, 0=NO
+
+# Twiss parameters at taylorW for PHASE_SCAN modes. If blank, the values set in phase_scan.py are used.
+# Either "name = value" lines (beta_a, alpha_a, beta_b, alpha_b) or a Tao "show lattice" table (see README.TXT)
+'twiss_file': '',
+'twiss_ele': '',        # Element (row) to use in a twiss table. Blank => last row
+
+############## Parameters for PHASE_XY_GRID  mode:   ##################################
+'ndata_pnts_PHASE_X': 11, 
+'start_phase_x': 0.00,
+'end_phase_x': 6.28,
+'ndata_pnts_PHASE_Y': 11, 
+'start_phase_y': 0.00,
+'end_phase_y': 6.28,
+
+############## Parameters for PHASE_XY_ADAPTIVE  mode (also uses start/end_phase_x/y):   ####
+'adaptive_n0': 5,          # Initial grid is adaptive_n0 x adaptive_n0. Must be fine enough to see the Ith minima
+'adaptive_max_level': 3,   # Number of times a cell can be split into four
+'adaptive_tol': 0.2,       # Split a cell if log10(Ith) changes by more than this over the cell
+'adaptive_floor_tol': 0.3, # Split a cell if a corner is within this (decades) of the lowest Ith found
 ######## Parameters for THRESHOLD mode:  ######################################
 
 'random_homs': True,   # If True, will (randomly) assign new HOMs in 'hom_dir' to the cavities
@@ -86,6 +115,11 @@ def main(argv):
   print(time.time())
   working_dir = os.getcwd() # current directory
   print('WORKING DIR ',os.getcwd())
+
+  # --resume: Continue an interrupted DR_SCAN or PHASE_SCAN from its checkpoints. 
+  # The option is removed so the mode is chosen from the other arguments as usual.
+  py_par['resume'] = ('--resume' in sys.argv)
+  if (py_par['resume']): sys.argv.remove('--resume')
     
 # Decides which mode the program runs based on the number of arguments
   if (len(sys.argv) == 1):
@@ -93,7 +127,15 @@ def main(argv):
     bbu_par['lat_filename']= "'$DIST_BASE_DIR/bsim/bbu/examples/oneturn_lat.bmad'"
     mode = 'dr_scan'
     
-  if (len(sys.argv) == 2):
+  if (len(sys.argv) == 2 and sys.argv[1] == 'xy_grid'):
+    print('xy_grid argument given. PHASE_XY_GRID mode.')
+    mode = 'phase_xy_grid'
+
+  elif (len(sys.argv) == 2 and sys.argv[1] == 'xy_adaptive'):
+    print('xy_adaptive argument given. PHASE_XY_ADAPTIVE mode.')
+    mode = 'phase_xy_adaptive'
+
+  elif (len(sys.argv) == 2):
     print('2 argumnets (including python script) given. PHASE_SCAN mode.')
     mode = 'phase_scan'
     py_par['ONE_phase'] = sys.argv[1]   # If ndata_pnts >=2, ONE_phase is NOT used
@@ -131,6 +173,14 @@ def main(argv):
   # Create a temp_dir to save all temporary files  
   # The temp_dir has a randomly-generated name
   py_par['temp_dir'] = make_tempdir( 1, working_dir )  
+  # Results of this job are stored under the name of the temp_dir (see README.TXT)
+  py_par['scan_id'] = os.path.basename(py_par['temp_dir'])
+  py_par['ran_seed'] = bbu_par['ran_seed']
+  if (py_par['results_db'] != ''):
+    py_par['results_db'] = os.path.join(working_dir, py_par['results_db'])
+    print('Results stored in', py_par['results_db'], 'with scan name', py_par['scan_id'])
+  if (py_par['checkpoint_dir'] != ''):
+    py_par['checkpoint_dir'] = os.path.join(working_dir, py_par['checkpoint_dir'])
   os.chdir( py_par['temp_dir'])
   print('Temporary directory created:', py_par['temp_dir']) 
  
@@ -199,6 +249,8 @@ def main(argv):
     # save the result ( Ith vs tr/tb data)
     print('Copying thresh_v_trotb.txt to ', working_dir) 
     shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_trotb.txt'), 'thresh_v_trotb.txt')
+    if (py_par['plot_drscan'] and py_par['plot_format'] != 'show'):
+      shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_trotb.'+py_par['plot_format']), 'thresh_v_trotb.'+py_par['plot_format'])
 
   ## for phase scan
   if(mode == 'phase_scan'):
@@ -210,6 +262,8 @@ def main(argv):
     # save the result ( Ith vs phase data)
     print('Copying thresh_v_phase.txt to ', working_dir) 
     shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_phase.txt'), 'thresh_v_phase_'+str(py_par['ONE_phase'])+'.txt')
+    if (py_par['plot_phase_scan'] and py_par['plot_format'] != 'show'):
+      shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_phase.'+py_par['plot_format']), 'thresh_v_phase_'+str(py_par['ONE_phase'])+'.'+py_par['plot_format'])
   
   
   ## for phase_XY scan
@@ -221,6 +275,26 @@ def main(argv):
     print('Copying thresh_v_phase_xy.txt to ', working_dir) 
     shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_phase_xy.txt'), 'thresh_v_phase_'+str(py_par['phase_x'])+'_'+str(py_par['phase_y'])+'.txt')
   
+
+  ## for phase_XY grid scan
+  if(mode == 'phase_xy_grid'):
+    print('======  PHASE_XY_GRID MODE ======')
+    bbu_main.phase_xy_grid_scanner( py_par ) 
+    os.chdir(working_dir) # Go back to the working dir from temp dir
+    # save the result ( phasex, phasey, Ith data)
+    print('Copying thresh_v_phase_xy.txt to ', working_dir) 
+    shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_phase_xy.txt'), 'thresh_v_phase_xy_grid.txt')
+
+  ## for adaptive phase_XY map
+  if(mode == 'phase_xy_adaptive'):
+    print('======  PHASE_XY_ADAPTIVE MODE ======')
+    bbu_main.phase_xy_adaptive_scanner( py_par ) 
+    os.chdir(working_dir) # Go back to the working dir from temp dir
+    # save the result ( evaluated points, interpolated map and its plot )
+    print('Copying thresh_v_phase_xy.txt, phase_xy_map.npz and phase_xy_map.png to ', working_dir) 
+    shutil.copyfile(os.path.join(py_par['temp_dir'],'thresh_v_phase_xy.txt'), 'thresh_v_phase_xy_adaptive.txt')
+    shutil.copyfile(os.path.join(py_par['temp_dir'],'phase_xy_map.npz'), 'phase_xy_map.npz')
+    shutil.copyfile(os.path.join(py_par['temp_dir'],'phase_xy_map.png'), 'phase_xy_map.png')
   
   # For any mode, clean up the temporary directory
   # Comment out these two lines if you want to keep the temporary files for debugging 
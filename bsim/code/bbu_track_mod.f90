@@ -776,6 +776,7 @@ do i = 1, lat%n_ele_max
   if (ele%slave_status == multipass_slave$) cycle
   write(20,'(a)') trim(ele%name)
 enddo
+close(20)
 
 end subroutine rf_cav_names
 
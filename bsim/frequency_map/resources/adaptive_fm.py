@@ -0,0 +1,216 @@
+#! /usr/bin/env python3
+
+# Adaptive frequency map: Instead of tracking every point of a fine grid, track a coarse grid first and
+# then refine (up to n_levels times, halving the step each time) only the grid cells where the particles
+# of the cell corners are not all lost or all surviving, or where log10(dQ) changes by more than dQ_tol
+# over the cell. dQ = sqrt(dQx^2 + dQy^2) as in the plotting scripts.
+# frequency_map writes no row for a particle lost on an aperture (and a row with "*" tunes for a particle
+# outside the RF bucket), so every point of a deck that ran without error but has no row is taken as lost.
+# Only the points of decks that failed are unknown, and their cells are not refined.
+#
+# Edit the settings below and run this script. All input decks and outputs are put in work_dir.
+# At each level, the input decks of the new points are run locally with launch.py (n_proc at a time).
+# At the end, the tracked points are merged into work_dir/combined.npz (see fm_data.py), which can be
+# plotted with plot_freq_map_DA.py or plot_freq_map_MA.py (run in work_dir). Grid points that were not
+# tracked (inside cells that were not refined) are interpolated from the cell corners, and the array
+# "tracked" in combined.npz marks the points that were tracked.
+
+plane = 'DA'    # 'DA': scan x-y with fixed e.  'MA': scan x-e with fixed y.
+
+x0 = -0.03001
+x1 =  0.02999
+dx =  0.00128   # Coarse grid step. The final grid step is dx / 2**n_levels
+
+y0 = 0.00001    # For MA: y0 is the fixed y
+y1 = 0.00251
+dy = 0.00032
+
+e0 = 10.e-6     # For DA: e0 is the fixed e
+e1 = 10.e-6
+de = 0.008
+
+n_levels = 3
+dQ_tol = 1.0    # Refine a cell if log10(dQ) changes by more than this over the cell
+
+fft_turns = 1024
+n_turns = 2048
+
+lat_file = "/home/shanksj/chess/lat/chess-u/cu.lat"
+
+work_dir = 'adaptive_fm'
+exe = '$ACC_EXE/frequency_map'
+n_proc = 0      # Number of frequency_map runs at the same time. 0 => number of cores
+retries = 2
+
+###########################################################
+
+import os, glob
+import numpy as np
+import fm_data, launch
+
+def corners(cell):
+	i, j, n = cell
+	return [(i, j), (i+n, j), (i, j+n), (i+n, j+n)]
+
+def split_cell(cell):
+	i, j, n = cell
+	h = n // 2
+	return [(i, j, h), (i+h, j, h), (i, j+h, h), (i+h, j+h, h)]
+
+def log_dQ(row):
+	with np.errstate(divide = 'ignore'):
+		return np.log10(np.sqrt(row[9]**2 + row[10]**2))
+
+def cells_to_refine(cells, points, tol):
+	# Cells whose corners are not all lost or all surviving, or where log10(dQ) changes by more than tol.
+	refine = []
+	for cell in cells:
+		if cell[2] < 2: continue
+		rows = [points.get(c) for c in corners(cell)]
+		if any(r is None for r in rows): continue   # A corner's deck failed
+		lost = [np.isnan(r[3:]).any() for r in rows]
+		if any(lost):
+			if not all(lost): refine.append(cell)
+			continue
+		v = [log_dQ(r) for r in rows]
+		if max(v) - min(v) > tol: refine.append(cell)
+	#endfor
+	return refine
+
+def runs(indices):
+	# Split sorted integers into runs with a constant step. Returns a list of (start, stop, step).
+	out = []
+	k = 0
+	while k < len(indices):
+		if k+1 == len(indices):
+			out.append((indices[k], indices[k], 1))
+			break
+		step = indices[k+1] - indices[k]
+		m = k+1
+		while m+1 < len(indices) and indices[m+1] - indices[m] == step: m += 1
+		out.append((indices[k], indices[m], step))
+		k = m+1
+	#endwhile
+	return out
+
+def write_decks(level, new, grid):
+	# Write the input decks for the new grid points (i, j). One deck per run of equally spaced points in a row.
+	# Returns {deck: list of the (i, j) of the deck}
+	a0, ha, b0, hb = grid
+	rows = {}
+	for i, j in new: rows.setdefault(j, []).append(i)
+	decks = {}
+	for j in sorted(rows):
+		for k, (i_start, i_stop, step) in enumerate(runs(sorted(rows[j]))):
+			filename = 'L%1i_r%05d_%03d.in' % (level, j, k)
+			b = b0 + j*hb
+			par = {'x0': a0 + i_start*ha, 'x1': a0 + i_stop*ha, 'dx': step*ha}
+			if plane == 'DA':
+				par.update({'y0': b, 'y1': b, 'dy': hb, 'e0': e0, 'e1': e0, 'de': hb})
+			else:
+				par.update({'y0': y0, 'y1': y0, 'dy': hb, 'e0': b, 'e1': b, 'de': hb})
+			outFile = open(filename,'w')
+			outFile.write('&parameters\n')
+			outFile.write('aperture_limits = .false.\n')
+			for key in ['x0', 'y0', 'e0', 'x1', 'y1', 'e1', 'dx', 'dy', 'de']:
+				outFile.write(key + ' = ' + '%.12g' % par[key] + '\n')
+			outFile.write('lat_file = "'+lat_file+'"\n')
+			outFile.write('out_file_prefix = ' + filename + '\n')
+			outFile.write('n_turn = '+str(n_turns)+'\n')
+			outFile.write('fft_turns = '+str(fft_turns)+'\n')
+			outFile.write('/\n')
+			outFile.close()
+			decks[filename] = [(i, j) for i in range(i_start, i_stop+1, step)]
+	#endfor
+	return decks
+
+def lost_row(i, j, grid):
+	# Row of a particle lost on an aperture (not in the .fm output): NaN tunes.
+	a0, ha, b0, hb = grid
+	row = np.full(len(fm_data.columns), np.nan)
+	if plane == 'DA':
+		row[0:3] = [a0 + i*ha, b0 + j*hb, e0]
+	else:
+		row[0:3] = [a0 + i*ha, y0, b0 + j*hb]
+	return row
+
+def read_decks(decks, failed, grid):
+	# Read the outputs of the decks. Returns {(i, j): row of 12 values}
+	# Points of decks that ran (not in failed) with no row in the output are lost particles.
+	# Points of failed decks are left out (unknown).
+	a0, ha, b0, hb = grid
+	ib = 1 if plane == 'DA' else 2
+	points = {}
+	for deck, requested in decks.items():
+		if deck in failed: continue
+		found = {}
+		for file in glob.glob(deck + '*.fm'):
+			data = fm_data.read_fm(file)
+			ii = np.rint((data[:,0] - a0) / ha).astype(int)
+			jj = np.rint((data[:,ib] - b0) / hb).astype(int)
+			for i, j, row in zip(ii, jj, data): found[(i, j)] = row
+		#endfor
+		for p in requested:
+			points[p] = found[p] if p in found else lost_row(p[0], p[1], grid)
+	#endfor
+	return points
+
+def fill_leaves(leaves, points):
+	# Interpolate (bilinear) the grid points inside cells that were not refined from the cell corners.
+	filled = {}
+	for cell in leaves:
+		i, j, n = cell
+		if n < 2: continue
+		rows = [points.get(c) for c in corners(cell)]
+		if any(r is None for r in rows): continue
+		r00, r10, r01, r11 = rows
+		for di in range(n+1):
+			for dj in range(n+1):
+				if (i+di, j+dj) in points or (i+di, j+dj) in filled: continue
+				u = di / n
+				v = dj / n
+				filled[(i+di, j+dj)] = (1-u)*(1-v)*r00 + u*(1-v)*r10 + (1-u)*v*r01 + u*v*r11
+	#endfor
+	return filled
+
+if __name__ == '__main__':
+
+	exe = os.path.expandvars(exe)
+	if n_proc == 0: n_proc = os.cpu_count()
+	os.makedirs(work_dir, exist_ok = True)
+	os.chdir(work_dir)
+
+	S = 2**n_levels
+	if plane == 'DA':
+		b0, b1, db = y0, y1, dy
+	else:
+		b0, b1, db = e0, e1, de
+	na = int(round((x1-x0)/dx)) * S + 1
+	nb = int(round((b1-b0)/db)) * S + 1
+	grid = (x0, dx/S, b0, db/S)
+
+	points = {}
+	leaves = []
+	cells = [(i, j, S) for i in range(0, na-1, S) for j in range(0, nb-1, S)]
+	for level in range(n_levels+1):
+		new = sorted(set(c for cell in cells for c in corners(cell) if c not in points))
+		print('Level', level, ':', len(cells), 'cells,', len(new), 'new points')
+		decks = write_decks(level, new, grid)
+		failed = launch.run_local(list(decks), exe, n_proc, retries)
+		if len(failed) > 0: print('FAILED decks (their cells are not refined):', ' '.join(failed))
+		points.update(read_decks(decks, failed, grid))
+
+		if level == n_levels: break
+		refine = cells_to_refine(cells, points, dQ_tol)
+		leaves += [cell for cell in cells if cell not in refine]
+		cells = [sub for cell in refine for sub in split_cell(cell)]
+		if len(cells) == 0: break
+	#endfor
+	leaves += cells
+
+	filled = fill_leaves(leaves, points)
+	keys = list(points) + list(filled)
+	data = np.array([points[k] for k in points] + [filled[k] for k in filled]).reshape(-1, len(fm_data.columns))
+	tracked = np.arange(len(keys)) < len(points)
+	fm_data.save_combined('combined.npz', data, tracked = tracked)
+	print('Tracked', len(points), 'of', na*nb, 'grid points. Results in', os.path.join(work_dir, 'combined.npz'))
@@ -1,6 +1,8 @@
 #! /home/shanksj/misc/anaconda/bin/ipython
 
 import os, re, sys
+import numpy as np
+import fm_data
 
 outList = []
 
@@ -20,12 +22,20 @@ combinedFile.write('! column labels: \n')
 combinedFile.write('! x   y   z   Qx_0   Qy_0   Qz_0   Qx_1   Qy_1   Qz_1    delta(Qx)     delta(Qy)    delta(Qz)   \n')
 combinedFile.write('!\n!\n!\n!\n!\n!\n!\n')
 
+# Each .fm file is read once. Its lines are copied to combined.txt and its data parsed for combined.npz
+dataList = []
 for ix in outList:
 	outfile = open(ix,'r')
-	for line in outfile:
+	text = outfile.read()
+	outfile.close()
+	for line in text.splitlines(True):
 		if len(line.strip()) == 0: continue
 		combinedFile.write(line)
-	outfile.close()
+	dataList.append(fm_data.parse_fm(text))
 
 
 combinedFile.close()
+
+data = np.concatenate(dataList)
+fm_data.save_combined('combined.npz', data)
+print('Combined', len(outList), 'files,', len(data), 'points (' + str(int(np.isnan(data[:,3:]).any(axis=1).sum())) + ' lost) to combined.txt and combined.npz')
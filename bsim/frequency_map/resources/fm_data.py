@@ -0,0 +1,83 @@
+#! /usr/bin/env python3
+
+# Reading and writing of frequency_map outputs as NumPy arrays.
+# Each line of a .fm file has 12 columns:
+#   x   y   z   Qx0   Qy0   Qz0   Qx1   Qy1   Qz1   dQx   dQy   dQz
+# For a particle outside the RF bucket, the 9 tune columns are "*". Such rows are kept, with NaN tunes,
+# and flagged in the "lost" mask. A particle lost on an aperture has no row at all.
+# The combined data of all .fm files is saved by combine_outputs.py to combined.npz with one array
+# per column (named as above) plus the lost mask.
+
+import os, re
+import numpy as np
+
+columns = ['x', 'y', 'z', 'Qx0', 'Qy0', 'Qz0', 'Qx1', 'Qy1', 'Qz1', 'dQx', 'dQy', 'dQz']
+
+def parse_fm(text):
+	# Parse the text of a .fm (or combined.txt) file. Returns the (n_row, 12) array, NaN where the file has "*".
+	# Comment lines start with "#" or "!". Any field containing "*" (lost particle, or a Fortran field overflow) is NaN.
+	text = re.sub(r'^\s*[#!].*$', '', text, flags = re.MULTILINE)
+	text = re.sub(r'\S*\*\S*', 'nan', text)
+	values = np.array(text.split(), dtype = float)
+	if len(values) % len(columns) != 0:
+		raise ValueError('Number of values is not a multiple of ' + str(len(columns)))
+	return values.reshape(-1, len(columns))
+
+def read_fm(filename):
+	with open(filename, 'r') as f:
+		return parse_fm(f.read())
+
+def to_dict(data):
+	# Column dictionary of a (n_row, 12) array, with the lost mask.
+	d = {name: data[:, ic] for ic, name in enumerate(columns)}
+	d['lost'] = np.isnan(data[:, 3:]).any(axis = 1)
+	return d
+
+def save_combined(filename, data, **extra):
+	# extra: more per-row arrays to save (EG: the "tracked" mask of adaptive_fm.py)
+	np.savez(filename, **to_dict(data), **extra)
+
+def load_combined(filename = 'combined.npz'):
+	# Load combined frequency map data as a column dictionary (see to_dict).
+	# If filename does not exist, combined.txt in the same directory is read instead.
+	if os.path.exists(filename):
+		with np.load(filename) as f:
+			return {name: f[name] for name in f.files}
+	txtfile = os.path.join(os.path.dirname(filename), 'combined.txt')
+	print('No ' + filename + ', reading ' + txtfile)
+	return to_dict(read_fm(txtfile))
+
+def grid_axis(values):
+	# Recover a uniform grid from coordinate values (which may be missing some grid points).
+	# Returns the grid start, step, number of points and the grid index of each value.
+	u = np.unique(values)
+	if len(u) == 1: return u[0], 0., 1, np.zeros(len(values), dtype = int)
+	span = u[-1] - u[0]
+	steps = np.diff(u)
+	step = steps[steps > 1e-6 * span].min()   # Ignore differences from the rounding of the output
+	n = int(np.rint(span / step)) + 1
+	step = span / (n - 1)
+	return u[0], step, n, np.rint((values - u[0]) / step).astype(int)
+
+def grid_map(data, xname, yname, minimum = 1.e-12):
+	# Map the points of a 2D scan (coordinates xname and yname, EG: 'x' and 'y' or 'x' and 'z') onto their grid.
+	# Returns a dictionary with the grid axes xname and yname and, on the grid (shape [nx, ny]):
+	#   Qx0, Qy0, Qx, Qy -- initial and final tunes. Minimum where there is no data or the particle was lost
+	#   dQ               -- log10(sqrt(dQx^2 + dQy^2))
+	#   dQmask           -- True where dQ is not valid: no data, particle lost, or dQ < minimum/1e4
+	x0, dx, nx, ix = grid_axis(data[xname])
+	y0, dy, ny, iy = grid_axis(data[yname])
+	good = ~data['lost']
+	g = {xname: x0 + dx * np.arange(nx), yname: y0 + dy * np.arange(ny)}
+	for name, col in [('Qx0', 'Qx0'), ('Qy0', 'Qy0'), ('Qx', 'Qx1'), ('Qy', 'Qy1')]:
+		g[name] = np.full([nx, ny], minimum)
+		g[name][ix[good], iy[good]] = data[col][good]
+
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		logdQ = np.log10(np.sqrt(data['dQx']**2 + data['dQy']**2))
+	ok = good & (logdQ >= np.log10(minimum / 10000.))
+	g['dQ'] = np.full([nx, ny], minimum)
+	g['dQ'][ix[ok], iy[ok]] = logdQ[ok]
+	g['dQmask'] = np.ones([nx, ny], dtype = bool)
+	g['dQmask'][ix[ok], iy[ok]] = False
+	return g
@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# Run frequency_map over all input files "*.in" in the current directory.
+# By default the inputs are run locally, n_proc at a time (default: number of cores).
+# With -q, each input is submitted to the GRID with q.sh instead (as submit.py does).
+#
+# Usage: launch.py [-n n_proc] [-r retries] [-e executable] [-f] [-q] [-s q.sh] [input files]
+#   -n  Number of inputs run at the same time. Default: number of cores
+#   -r  Number of times a failed input is retried. Default: 2
+#   -e  frequency_map executable. Default: $ACC_EXE/frequency_map
+#   -f  Also run inputs that are already done (listed in launch.done)
+#   -q  Submit to the GRID with qsub instead of running locally
+#   -s  Path to q.sh (with -q). Default: q.sh
+#
+# The terminal output of each input goes to <input>.log. An input is done when frequency_map exits
+# without error and has written at least one <out_file_prefix>*.fm file. Done inputs are listed in
+# launch.done, so rerunning launch.py after an interruption only runs the inputs that are not done.
+
+import sys, os, re, glob, time, getopt, subprocess
+import concurrent.futures
+
+def run_input(exe, input):
+	# Run one input. Returns (ok, run time)
+	t0 = time.time()
+	with open(input + '.log', 'w') as log:
+		status = subprocess.call([exe, input], stdout = log, stderr = subprocess.STDOUT)
+	if status != 0: return False, time.time() - t0
+	prefix = out_file_prefix(input)
+	if prefix is not None and len(glob.glob(prefix + '*.fm')) == 0: return False, time.time() - t0
+	return True, time.time() - t0
+
+def out_file_prefix(input):
+	# out_file_prefix of an input file, or None if not set
+	for line in open(input, 'r'):
+		m = re.match(r'\s*out_file_prefix\s*=\s*[\'"]?([^\'"\s]+)', line)
+		if m: return m.group(1)
+	#endfor
+	return None
+
+def read_done():
+	if not os.path.exists('launch.done'): return set()
+	return set(line.strip() for line in open('launch.done', 'r'))
+
+def run_local(inputs, exe, n_proc, retries):
+	# Run the inputs in a pool of n_proc. Failed inputs are resubmitted up to retries times.
+	# Returns the list of inputs that failed.
+	n_total = len(inputs)
+	n_done = 0
+	failed = []
+	t0 = time.time()
+	print('Running', n_total, 'inputs,', n_proc, 'at a time')
+	with concurrent.futures.ThreadPoolExecutor(max_workers = n_proc) as pool:
+		futures = {pool.submit(run_input, exe, input): (input, 0) for input in inputs}
+		while futures:
+			finished, _ = concurrent.futures.wait(futures, return_when = concurrent.futures.FIRST_COMPLETED)
+			for future in finished:
+				input, attempt = futures.pop(future)
+				ok, dt = future.result()
+				if ok:
+					n_done += 1
+					with open('launch.done', 'a') as f: f.write(input + '\n')
+					eta = (time.time() - t0) / n_done * (n_total - n_done - len(failed))
+					print('[%d/%d] %s done in %.0f s. Estimated time left: %.0f s' % (n_done, n_total, input, dt, eta))
+				elif attempt < retries:
+					print('%s FAILED (see %s.log). Retry %d of %d' % (input, input, attempt + 1, retries))
+					futures[pool.submit(run_input, exe, input)] = (input, attempt + 1)
+				else:
+					failed.append(input)
+					print('%s FAILED (see %s.log). No more retries' % (input, input))
+				#endif
+			#endfor
+		#endwhile
+	return failed
+
+def run_qsub(inputs, qsh):
+	path = os.getcwd()
+	for input in inputs:
+		os.system('qsub -N ' + input + ' -v inputfile=' + input + ' -v workingdir=' + path + ' ' + qsh)
+	#endfor
+
+if __name__ == '__main__':
+
+	n_proc = os.cpu_count()
+	retries = 2
+	exe = os.path.join(os.environ.get('ACC_EXE', ''), 'frequency_map')
+	force = False
+	qsub = False
+	qsh = 'q.sh' # path to q.sh
+
+	opts, args = getopt.getopt(sys.argv[1:], 'n:r:e:fqs:')
+	for opt, val in opts:
+		if opt == '-n': n_proc = int(val)
+		if opt == '-r': retries = int(val)
+		if opt == '-e': exe = val
+		if opt == '-f': force = True
+		if opt == '-q': qsub = True
+		if opt == '-s': qsh = val
+	#endfor
+
+	if len(args) > 0:
+		inputs = args
+	else:
+		inputs = sorted(file for file in os.listdir(os.getcwd()) if re.match(r'.*\.in$', file))
+
+	if qsub:
+		run_qsub(inputs, qsh)
+		sys.exit()
+
+	if not force:
+		done = read_done()
+		if len(done) > 0: print('Skipping', len([i for i in inputs if i in done]), 'inputs already done (see launch.done)')
+		inputs = [i for i in inputs if i not in done]
+
+	failed = run_local(inputs, exe, n_proc, retries)
+	if len(failed) > 0:
+		sys.exit('Failed inputs: ' + ' '.join(failed))
+	print('All inputs done. Run combine_outputs.py to combine the outputs.')
@@ -7,12 +7,12 @@ import matplotlib.pyplot as plt
 import pylab, math
 import os
 import matplotlib.colors as colors
+import fm_data
 
 matplotlib.rcParams["savefig.directory"] = os.getcwd()
 matplotlib.rcParams['image.cmap'] = 'jet'
 
-filename = 'combined.txt'
-makeinputs = 'make_inputs_MA.py'
+filename = 'combined.npz'  # combined.txt is read if there is no combined.npz
 
 dQxcutoff = 2.5e-5
 dQycutoff = 2.5e-3
@@ -20,25 +20,8 @@ minimum = 1.e-12
 maximum = 0.1
 plotTitle = ""
 
-file = open(makeinputs,'r')
-for line in file:
-        fileline = line.split()
-        if len(fileline) == 0: continue
-        if   fileline[0] == 'x0':
-                x0 = float(fileline[2])
-        elif fileline[0] == 'x1':
-                x1 = float(fileline[2])
-        elif fileline[0] == 'dx':
-                dx = float(fileline[2])
-        elif fileline[0] == 'e0':
-                e0 = float(fileline[2])
-        elif fileline[0] == 'e1':
-                e1 = float(fileline[2])
-        elif fileline[0] == 'de':
-                de = float(fileline[2])
-        elif fileline[0] == 'for':
-                break
-file.close()
+# Grid parameters (x0, dx, ...) are taken from the data
+data = fm_data.load_combined(filename)
 
 xscale = 1.#/np.sqrt(22.74e-9  * 11.187)
 escale = 1.#/7.837E-04
@@ -54,87 +37,22 @@ Qymax = 1.0
 #######      Primary routine      #########
 ###########################################
 
-x = []
-y = []
-e = []
-Qx0 = []
-Qy0 = []
-Qz0 = []
-Qx = []
-Qy = []
-Qz = []
-dQ = []
-dQmask = []
-
-xsteps = int((x1-x0)/(dx))
-esteps = int((e1-e0)/(de))
-
-
-# populate arrays with float zeroes to start:
-
-Qx0    = np.zeros([xsteps,esteps])
-Qy0    = np.zeros([xsteps,esteps])
-Qx     = np.zeros([xsteps,esteps])
-Qy     = np.zeros([xsteps,esteps])
-dQ     = np.zeros([xsteps,esteps])
-dQmask = np.zeros([xsteps,esteps])
-
-Qx0.fill(minimum)
-Qx0.fill(minimum)
-Qx.fill(minimum)
-Qx.fill(minimum)
-dQ.fill(minimum)
-dQmask.fill(True)
-
-x = np.array([x0+ix*dx for ix in range(xsteps)])
-e = np.array([e0+ie*de for ie in range(esteps)])
-
-        
+grid = fm_data.grid_map(data, 'x', 'z', minimum)
+x = grid['x']
+e = grid['z']
+x0, x1 = x[0], x[-1]
+e0, e1 = e[0], e[-1]
+Qx0 = grid['Qx0']
+Qy0 = grid['Qy0']
+Qx = grid['Qx']
+Qy = grid['Qy']
+dQ = grid['dQ']
+dQmask = grid['dQmask']
+tot = len(data['lost'])
+
 logmin = np.abs(np.log10(minimum))
 logmax = np.abs(np.log10(maximum))
 
-
-tot = -1 # initialize total
-file = open(filename, 'r')
-for line in file:
-	fileLine = line.split()
-	if len(fileLine) == 0 or fileLine[0][0] == '!': continue
-	
-	tot = tot+1
-
-	if any(fileLine[ix] == '*' for ix in range(len(fileLine))):
-		continue
-
-	thisx = float(fileLine[0])
-	thisy = float(fileLine[1])
-	thise = float(fileLine[2])
-	thisQx0 = float(fileLine[3])
-	thisQy0 = float(fileLine[4])
-	thisQz0 = float(fileLine[5])
-	thisQx = float(fileLine[6])
-	thisQy = float(fileLine[7])
-	thisQz = float(fileLine[8])
-	thisdQx = float(fileLine[9])
-	thisdQy = float(fileLine[10])
-	thisdQz = float(fileLine[11])
-
-	xidx = int(round(((thisx-x0) / dx),1))
-	eidx = int(round(((thise-e0) / de),1))
-
-	if (xidx > len(Qx0)-1) or (eidx > len(Qx0[0])-1): continue
-	
-	Qx0[xidx][eidx] = thisQx0
-	Qy0[xidx][eidx] = thisQy0
-	Qx[xidx][eidx] = thisQx
-	Qy[xidx][eidx] = thisQy
-	thisdQ = np.sqrt( (np.abs(thisdQx))**2 + (np.abs(thisdQy))**2 )
-	if (np.log10(thisdQ) < np.log10(minimum/10000.)):
-		dQ[xidx][yidx] = minimum
-		continue
-	else:
-		dQ[xidx][eidx] = np.log10(thisdQ)
-		dQmask[xidx][eidx] = False
-
 x = [ix*xscale for ix in x]
 e = [ie*escale for ie in e]
 
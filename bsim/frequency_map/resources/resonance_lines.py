@@ -0,0 +1,88 @@
+#! /usr/bin/env python3
+
+# Resonance lines p*Qx + q*Qy + r*Qs = n in the tune plane, for the analytic tune plane overlay of the
+# frequency map plots.
+# orders = (pMax, qMax, rMax, nMax, pqrMax, pqMax): |p| <= pMax, |q| <= qMax, |r| <= rMax, 0 <= n <= nMax,
+#   |p|+|q|+|r| <= pqrMax and |p|+|q| <= pqMax.
+# window = (Qxmin, Qxmax, Qymin, Qymax)
+# Each line is labeled "(p,q,r,n)" at the middle of the longest stretch of the line (inside the window)
+# that is not crossed by another line.
+# The lines and label positions are computed for all lines at once and cached per (Qs, orders, window).
+
+import functools
+import numpy as np
+from matplotlib.collections import LineCollection
+
+def line_coefs(Qs, orders):
+	# Returns (p, q, r, n) of all resonance lines, as integer arrays, and the lines as a*Qx + b*Qy = c.
+	pMax, qMax, rMax, nMax, pqrMax, pqMax = orders
+	p, q, r, n = [a.ravel() for a in np.meshgrid(np.arange(-pMax, pMax+1), np.arange(-qMax, qMax+1),
+	                                             np.arange(-rMax, rMax+1), np.arange(nMax+1), indexing = 'ij')]
+	keep = (np.abs(p)+np.abs(q)+np.abs(r) <= pqrMax) & (np.abs(p)+np.abs(q) <= pqMax) & ((p != 0) | (q != 0))
+	# For n = 0, (p,q,r,0) and (-p,-q,-r,0) are the same line
+	keep &= ~((n == 0) & ((p < 0) | ((p == 0) & (q < 0))))
+	p, q, r, n = p[keep], q[keep], r[keep], n[keep]
+	return (p, q, r, n), (p.astype(float), q.astype(float), n - r*Qs)
+
+def intersections(a1, b1, c1, a2, b2, c2):
+	# Intersection points of every line 1 with every line 2 (broadcast). NaN for parallel lines.
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		det = a1*b2 - a2*b1
+		x = (c1*b2 - c2*b1) / det
+		y = (a1*c2 - a2*c1) / det
+	x[det == 0] = np.nan
+	y[det == 0] = np.nan
+	return x, y
+
+@functools.lru_cache(maxsize = 32)
+def resonance_lines(Qs, orders, window):
+	# Returns:
+	#   segments -- (L, 2, 2) array of line end points, for Qx and Qy from 0 to 1
+	#   labels   -- list of "(p,q,r,n)" strings
+	#   label_xy -- (L, 2) label positions. NaN for lines that do not cross the window
+	#   angle    -- (L,) line angles in degrees, in (-90, 90]
+	(p, q, r, n), (a, b, c) = line_coefs(Qs, tuple(orders))
+	Qxmin, Qxmax, Qymin, Qymax = window
+
+	vertical = (b == 0)
+	with np.errstate(divide = 'ignore', invalid = 'ignore'):
+		segments = np.where(vertical[:,None,None],
+		                    np.stack([np.stack([c/a, np.zeros_like(c)], -1), np.stack([c/a, np.ones_like(c)], -1)], 1),
+		                    np.stack([np.stack([np.zeros_like(c), c/b], -1), np.stack([np.ones_like(c), (c-a)/b], -1)], 1))
+
+	# Intersections with all other lines and with the window borders (slightly inside the window)
+	ab = np.array([[1., 0., 1.00001*Qxmin], [1., 0., 0.99999*Qxmax], [0., 1., 1.00001*Qymin], [0., 1., 0.99999*Qymax]])
+	a2 = np.concatenate([a, ab[:,0]])
+	b2 = np.concatenate([b, ab[:,1]])
+	c2 = np.concatenate([c, ab[:,2]])
+	x, y = intersections(a[:,None], b[:,None], c[:,None], a2[None,:], b2[None,:], c2[None,:])
+	inside = (x > Qxmin) & (x < Qxmax) & (y > Qymin) & (y < Qymax)
+
+	# Position along each line, from the point of the line closest to the origin, in the direction 
+	# of increasing Qx (increasing Qy for vertical lines). On a tie, the gap at lower Qx (Qy) is used.
+	norm = np.sqrt(a*a + b*b)
+	s = np.where(b != 0, np.sign(b), -np.sign(a))
+	ux, uy = s*b/norm, -s*a/norm
+	t = np.where(inside, ux[:,None]*x + uy[:,None]*y, np.nan)
+	t.sort(axis = 1)   # NaN sorted to the end
+	gaps = np.diff(t, axis = 1)
+	has_gap = ~np.all(np.isnan(gaps), axis = 1)
+	igap = np.argmax(np.where(np.isnan(gaps), -np.inf, gaps), axis = 1)
+	rows = np.arange(len(a))
+	t_label = np.where(has_gap, t[rows, igap] + gaps[rows, igap]/2, np.nan)
+
+	label_xy = np.stack([c*a/norm**2 + t_label*ux, c*b/norm**2 + t_label*uy], -1)
+	angle = np.degrees(np.arctan2(uy, ux))
+	labels = ['(%1i,%1i,%1i,%1i)' % v for v in zip(p, q, r, n)]
+	return segments, labels, label_xy, angle
+
+def plot_resonance_lines(ax, Qs, orders, window, size = 10.0):
+	# Draw the resonance lines and their labels on the tune plane axes ax.
+	# Call after the axis limits and aspect are set, since the label angles depend on them.
+	segments, labels, label_xy, angle = resonance_lines(float(Qs), tuple(orders), tuple(window))
+	ax.add_collection(LineCollection(segments, colors = '0.0', linewidths = 0.5, linestyles = 'solid'))
+	ok = ~np.isnan(label_xy[:,0])
+	# Transform the angles from plot to screen coordinates
+	screen_angle = ax.transData.transform_angles(angle[ok], label_xy[ok])
+	for (xl, yl), text, rot in zip(label_xy[ok], np.array(labels)[ok], screen_angle):
+		ax.text(xl, yl, text, size = size, ha = 'center', va = 'bottom', rotation_mode = 'anchor', rotation = rot)
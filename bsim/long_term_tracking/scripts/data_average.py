@@ -1,54 +1,158 @@
+#!/usr/bin/env python3
+
 # Python script to do averaging, over some number of rows of data, in files created by the long_term_tracking program.
 # The output is a table of averaged values.
-# This script is meant to be modified to suit the current needs.
+#
+# Usage:
+#   data_average.py {-n <n_ave>} {-chunk <n_chunk>} {-out <out_file_name>} <data_file_name>
+# Defaults:
+#   <n_ave>         = 5                       # Averaging window.
+#   <n_chunk>       = 100000                  # Number of rows read and averaged at a time.
+#   <out_file_name> = <data_file_name>.ave
+#
+# The functions here can also be used from Python. EG:
+#   import data_average
+#   params = data_average.read_header('my_data.dat')
+#   data_average.average_file('my_data.dat', 'my_data.ave', n_ave = 11)
 
 import sys
+import os
+import itertools
 import numpy as np
 
+# For bmad_header.py. When this file is run with execfile / exec, __file__ is not defined and only $ACC_ROOT_DIR/util is used.
+if '__file__' in globals(): sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../util'))
+if 'ACC_ROOT_DIR' in os.environ: sys.path.append(os.path.join(os.environ['ACC_ROOT_DIR'], 'util'))
+import bmad_header
+
+#------------------------------------------------------------------------------------------
+# Read header parameters (potentially useful). Names have "%" replaced by "_". EG: ltt%ramping_on -> ltt_ramping_on
+
+def read_header(dat_file_name):
+  return bmad_header.read_header(dat_file_name, percent = '_')[0]
+
+#------------------------------------------------------------------------------------------
+# Centered average of the rows of a 2D array, done for all columns at once with a cumulative sum.
+# The output has n_ave-1 rows less than the input. EG: With n_ave = 5, the output will not contain
+# rows corresponding to the first two rows and the last two rows of the input.
+# The average is centered if n_ave is an odd number.
+
+def moving_average(data, n_ave):
+  if len(data) < n_ave: return np.zeros((0, data.shape[1]))
+  csum = np.cumsum(np.vstack([np.zeros((1, data.shape[1])), data]), axis = 0)
+  return (csum[n_ave:] - csum[:-n_ave]) / n_ave
+
+#------------------------------------------------------------------------------------------
+# Number of leading numeric columns of a data line. Trailing columns that are not numbers
+# (EG: the particle "State" column) are not averaged.
+
+def n_numeric_columns(line):
+  n = 0
+  for word in line.split():
+    try:
+      float(word)
+    except ValueError:
+      break
+    n += 1
+  return n
+
+#------------------------------------------------------------------------------------------
+# Column name header line (EG: "## Turn | x px ... | spin_x spin_y spin_z State") with the names of
+# the trailing columns that are not averaged removed, so it names only the n_col averaged columns.
+
+def header_for_columns(line, n_col):
+  n_drop = len([word for word in line.lstrip('#').split() if word != '|']) - n_col
+  if n_drop <= 0: return line
+  text = line.rstrip()
+  for i in range(n_drop):
+    text = text[:len(text) - len(text.split()[-1])].rstrip(' |')
+  return text + '\n'
+
+#------------------------------------------------------------------------------------------
+# Average a data file, reading n_chunk rows at a time so that memory use does not depend on the file size.
+# The last n_ave-1 rows of each chunk are carried over to the next chunk so the output is the same as
+# averaging the whole file at once. Header lines with the column names ("Turn" in the line) are copied to the output,
+# without the names of the columns that are not averaged (see header_for_columns).
+
+def average_file(dat_file_name, out_file_name, n_ave = 5, n_chunk = 100000):
+  usecols = None
+  tail = None
+  n_out = 0
+  headers = []   # Header lines waiting for the number of columns to be known
+
+  with open(dat_file_name, 'r') as datf, open(out_file_name, 'w') as outf:
+    def write_ave(lines):
+      nonlocal usecols, tail, n_out
+      if len(lines) == 0: return
+      if usecols is None: usecols = range(n_numeric_columns(lines[0]))
+      for header in headers: outf.write(header_for_columns(header, len(usecols)))
+      headers.clear()
+      data = np.loadtxt(lines, usecols = usecols, ndmin = 2)
+      if tail is not None: data = np.vstack([tail, data])
+      ave = moving_average(data, n_ave)
+      np.savetxt(outf, ave, fmt = '%.16g')
+      n_out += len(ave)
+      tail = data[max(0, len(data)-n_ave+1):]
+
+    while True:
+      raw_lines = list(itertools.islice(datf, n_chunk))
+      lines = []
+      for line in raw_lines:
+        if line[0] == '#':
+          if 'Turn' in line:
+            write_ave(lines)
+            lines = []
+            if usecols is None:
+              headers.append(line)
+            else:
+              outf.write(header_for_columns(line, len(usecols)))
+          continue
+        if line.strip() == '': continue
+        lines.append(line)
+
+      write_ave(lines)
+      if len(raw_lines) < n_chunk: break
 
-datf = open(sys.argv[1], 'r')
+    for header in headers: outf.write(header)
 
-# Read header parameters (potentially useful).
+  return n_out
 
-T = True      # Since "T" and "F" are used in the data file parameter header
-F = False
+#------------------------------------------------------------------------------------------
 
-for line in datf:
-  if line[0] == '#':
-    if '=' not in line: continue    # Not a parameter
-    line = line.replace('%', '_')   # EG: ltt%ramping_on -> ltt_ramping_on
-    exec(line[1:].strip())
+if __name__ == '__main__':
 
-  else:
-    break
+  dat_file_name = ''
+  out_file_name = ''
+  n_ave = 5
+  n_chunk = 100000
 
-# Now do a centered average.  
-# With n_ave = 5, the output will not contain rows corresponding to the first two rows and the last two
-# rows of the input data file.
+  i = 1
+  while i < len(sys.argv):
+    n = len(sys.argv[i])
+    if sys.argv[i] == '-chunk'[:n]:
+      n_chunk = int(sys.argv[i+1])
+      i += 1
 
-n_ave = 5     # Averaging window. The algorithm assumes this is an odd number
-n_here = -1
+    elif sys.argv[i] == '-n':
+      n_ave = int(sys.argv[i+1])
+      i += 1
 
-rows = [None] * n_ave
-out_name = sys.argv[1] + '.ave'
-outf = open(out_name, 'w')
-datf.seek(0)
+    elif sys.argv[i] == '-out'[:n]:
+      out_file_name = sys.argv[i+1]
+      i += 1
 
-for line in datf:
-  if 'Turn' in line: outf.write(line)
-  if line.strip() == '': continue
-  if line[0] == '#': continue
+    elif sys.argv[i][0] == '-':
+      dat_file_name = ''
+      break
 
-  cols = np.array(list(map(float, line.split())))
+    else:
+      dat_file_name = sys.argv[i]
 
-  if n_here == n_ave-1:
-    rows = rows[1:] + [cols]
-  else:
-    n_here += 1
-    rows[n_here] = cols
+    i += 1
 
-  if n_here == n_ave-1:
-    sum_row = sum(rows) / n_ave
-    outf.write(' '.join(list(map(str, sum_row))) + '\n')
+  if dat_file_name == '' or n_ave < 1 or n_chunk < 1:
+    sys.exit('Usage: data_average.py {-n <n_ave>} {-chunk <n_chunk>} {-out <out_file_name>} <data_file_name>')
 
-print ('Created: ' + out_name)
+  if out_file_name == '': out_file_name = dat_file_name + '.ave'
+  average_file(dat_file_name, out_file_name, n_ave, n_chunk)
+  print ('Created: ' + out_file_name)
@@ -4,13 +4,15 @@
 #   execfile('this_file_name')
 
 import sys
-import re
+import os
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
 import matplotlib.ticker as ticker
 
-T = True    # For converting from data file header T/F notation
-F = False
+# For bmad_header.py. When this file is run with execfile / exec, __file__ is not defined and only $ACC_ROOT_DIR/util is used.
+if '__file__' in globals(): sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../util'))
+if 'ACC_ROOT_DIR' in os.environ: sys.path.append(os.path.join(os.environ['ACC_ROOT_DIR'], 'util'))
+import bmad_header
 
 # Check version
 
@@ -21,7 +23,8 @@ if sys.version_info[0] == 2 or sys.version_info[1] < 6: sys.exit("MUST USE PYTHO
 def print_help():
   print ('''
 Usage:
-  tune_scan_density_plot.py {-cmap <color_map>} {-column <col_to_plot>} {-min <min_val>} {-max <max_val>} {-z <z_index>} {<data_file_name>}
+  tune_scan_density_plot.py {-cmap <color_map>} {-column <col_to_plot>} {-min <min_val>} {-max <max_val>} {-z <z_index>}
+                            {-all} {<data_file_name>}
 
 Defaults:
   <color_map>    = "gnuplot2_r" # Color map. Google "matplotlib color maps" for more info.
@@ -30,114 +33,178 @@ Defaults:
   <min_val>      = 0            # Set all data values = max(min_val, data_val).
   <z_index>      = 0            # Qz slice index (0 = first slice at Qx = Q_z0).
   <data_file_name> = tune_scan.dat
-''')
-  exit() 
 
-# Defaults
+  -all                          # Instead of displaying slice <z_index>, write every Qz slice to
+                                #   <data_file_name>.col<col_to_plot>.z<z_index>.png
 
-dat_file_name = 'tune_scan.dat'
-dat_col = 8
-z_index = 0
-min_val = 0
-max_val = -1
-cmap = 'gnuplot2_r'
+The data of <data_file_name> is cached in <data_file_name>.npy, which is used as long as it is
+newer than <data_file_name>.
+''')
+  exit()
+
+#------------------------------------------------------------------------------------------
+# Read data file parameters in header lines.
+# Returns the parameters, the column labels and the number of header lines.
+
+def read_header(dat_file_name):
+  params, n_header, line = bmad_header.read_header(dat_file_name, end = '#-')
+  return params, line.split()[1:], n_header
+
+#------------------------------------------------------------------------------------------
+# Read the data block with one NumPy call. The data is cached in <dat_file_name>.npy, which is
+# reused as long as it is at least as new as the data file.
+
+def read_data(dat_file_name, n_header):
+  npy_file_name = dat_file_name + '.npy'
+  if os.path.exists(npy_file_name) and os.path.getmtime(npy_file_name) >= os.path.getmtime(dat_file_name):
+    return np.load(npy_file_name)
+
+  dat = np.loadtxt(dat_file_name, skiprows = n_header, ndmin = 2)
+  try:
+    np.save(npy_file_name + '.tmp.npy', dat)
+    os.replace(npy_file_name + '.tmp.npy', npy_file_name)
+  except OSError:
+    print (f'Note: Cannot write cache file: {npy_file_name}')
+  return dat
+
+#------------------------------------------------------------------------------------------
+# Assemble the data into a [na_max+1, nb_max+1, nz_max+1, n_col] array (all Qz slices at once).
+# Returns the array and a [na_max+1, nb_max+1, nz_max+1] mask of the points present in the data.
+
+def data_cube(dat, params):
+  ja, jb, jz = [np.rint(dat[:,i]).astype(int) for i in range(3)]
+  shape = (params['na_max']+1, params['nb_max']+1, params.get('nz_max', jz.max())+1)
+  cube = np.zeros(shape + (dat.shape[1],))
+  cube[ja, jb, jz] = dat
+  present = np.zeros(shape, dtype = bool)
+  present[ja, jb, jz] = True
+  return cube, present
+
+#------------------------------------------------------------------------------------------
+# Density matrix of one column and Qz slice. Points where the particle was not tracked (data_turns = 0)
+# are set to max_val. Points not in the data are zero.
+
+def density_matrix(cube, present, dat_col, z_index, min_val, max_val):
+  pix_mat = np.clip(cube[:, :, z_index, dat_col], min_val, max_val)
+  pix_mat[cube[:, :, z_index, 6] == 0] = max_val
+  pix_mat[~present[:, :, z_index]] = 0
+  return pix_mat
+
+#------------------------------------------------------------------------------------------
+
+def plot_slice(fig, pix_mat, params, title, cmap):
+  x_min = params['Q_a0']
+  x_max = params['Q_a1']
+  y_min = params['Q_b0']
+  y_max = params['Q_b1']
+
+  ax = fig.add_subplot(111)
+
+  if x_max-x_min > y_max - y_min:
+    it = max(1, int((y_max-y_min) * 8 / (x_max-x_min)))
+    ax.yaxis.set_major_locator(ticker.MaxNLocator(it))
+  else:
+    it = max(1, int((x_max-x_min) * 8 / (y_max-y_min)))
+    ax.xaxis.set_major_locator(ticker.MaxNLocator(it))
 
-# Command line arguments
+  dens = ax.imshow(np.transpose(pix_mat), origin = 'lower', extent = (x_min, x_max, y_min, y_max))
+  dens.set_cmap(cmap)
+  ax.set_xlabel('Qa')
+  ax.set_ylabel('Qb')
+  ax.set_title(title)
 
-i = 1
-while i < len(sys.argv):
-  n = len(sys.argv[i])
-  if sys.argv[i] == '-':
-    print_help()
+  fig.colorbar(dens)
 
-  elif sys.argv[i] == '-column'[:n]:
-    dat_col = int(sys.argv[i+1])
-    i += 1
+#------------------------------------------------------------------------------------------
 
-  elif sys.argv[i] == '-max'[:n]:
-    max_val = float(sys.argv[i+1])
-    i += 1
+def slice_title(params, col_label, dat_col, z_index):
+  if params['rf_on']:
+    return f'{col_label[dat_col]}  Qz: {params["Q_z0"]+z_index*params["dQ_z"]}'
+  else:
+    return f'{col_label[dat_col]}  pz: {params["pz0"]+z_index*params["dpz"]}'
 
-  elif sys.argv[i] == '-min'[:n]:
-    min_val = float(sys.argv[i+1])
-    i += 1
+#------------------------------------------------------------------------------------------
 
-  elif sys.argv[i] == '-z'[:n]:
-    z_index = int(sys.argv[i+1])
-    i += 1
+if __name__ == '__main__':
 
-  elif sys.argv[i][0] == '-':
-    print_help()
-    
-  else:
-    dat_file_name = sys.argv[i]
+  # Defaults
 
-  i += 1
+  dat_file_name = 'tune_scan.dat'
+  dat_col = 8
+  z_index = 0
+  min_val = 0
+  max_val = -1
+  cmap = 'gnuplot2_r'
+  all_slices = False
 
-# Read data file parameters in header lines and data file data
+  # Command line arguments
 
-dat_file = open (dat_file_name)
+  i = 1
+  while i < len(sys.argv):
+    n = len(sys.argv[i])
+    if sys.argv[i] == '-':
+      print_help()
 
-for n_header in range(1, 1000):
-  line = dat_file.readline()
-  if line[0:2] == '#-': break
-  print (line.strip())
-  exec (line[1:].strip())
+    elif sys.argv[i] == '-all'[:n]:
+      all_slices = True
 
-col_label = line.split()[1:]
-dat_file.close()
+    elif sys.argv[i] == '-column'[:n]:
+      dat_col = int(sys.argv[i+1])
+      i += 1
 
-# [jx, jy, jz, n_turn, dat]
-pix_dat = np.loadtxt(dat_file_name, usecols=(0,1,2,6,dat_col), skiprows = n_header)
+    elif sys.argv[i] == '-cmap'[:n]:
+      cmap = sys.argv[i+1]
+      i += 1
 
-# Create density matrix
+    elif sys.argv[i] == '-max'[:n]:
+      max_val = float(sys.argv[i+1])
+      i += 1
 
-na_min = 0
-nb_min = 0
+    elif sys.argv[i] == '-min'[:n]:
+      min_val = float(sys.argv[i+1])
+      i += 1
 
-print (f'na min/max: {na_min}, {na_max}')
-print (f'nb min/max: {nb_min}, {nb_max}')
+    elif sys.argv[i] == '-z'[:n]:
+      z_index = int(sys.argv[i+1])
+      i += 1
 
-pix_mat = np.zeros((na_max+1, nb_max+1))
-if max_val < 0: max_val = pix_dat[:,4].max()
+    elif sys.argv[i][0] == '-':
+      print_help()
 
-for pix in pix_dat:
-  if round(pix[2]) != z_index: continue
-  if pix[3] == 0:
-    pix_mat[int(round(pix[0])), int(round(pix[1]))] = max_val
-  else:
-    pix_mat[int(round(pix[0])), int(round(pix[1]))] = max(min(pix[4], max_val), min_val)
+    else:
+      dat_file_name = sys.argv[i]
 
-# And plot
+    i += 1
+
+  # Read data file parameters in header lines and data file data
 
-x_min = Q_a0
-x_max = Q_a1
-y_min = Q_b0
-y_max = Q_b1
+  params, col_label, n_header = read_header(dat_file_name)
+  for name, value in params.items(): print (f'{name} = {value}')
 
-if 'ix_plot' not in locals(): ix_plot = 0
-ix_plot = ix_plot + 1
+  cube, present = data_cube(read_data(dat_file_name, n_header), params)
 
-fig = plt.figure(ix_plot)
-ax = fig.add_subplot(111)
+  print (f'na min/max: 0, {params["na_max"]}')
+  print (f'nb min/max: 0, {params["nb_max"]}')
 
-if x_max-x_min > y_max - y_min:
-  it = max(1, int((y_max-y_min) * 8 / (x_max-x_min)))
-  ax.yaxis.set_major_locator(ticker.MaxNLocator(it))
-else:
-  it = max(1, int((x_max-x_min) * 8 / (y_max-y_min)))
-  ax.xaxis.set_major_locator(ticker.MaxNLocator(it))
+  if max_val < 0: max_val = cube[:, :, :, dat_col][present].max()
 
-dens = ax.imshow(np.transpose(pix_mat), origin = 'lower', extent = (x_min, x_max, y_min, y_max))
-dens.set_cmap(cmap)
-ax.set_xlabel('Qa')
-ax.set_ylabel('Qb')
-if rf_on:
-  ax.set_title(f'{col_label[dat_col]}  Qz: {Q_z0+z_index*dQ_z}')
-else:
-  ax.set_title(f'{col_label[dat_col]}  pz: {pz0+z_index*dpz}')
+  # And plot
 
+  if all_slices: matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
 
-fig.colorbar(dens)
+  if all_slices:
+    for iz in range(cube.shape[2]):
+      fig = plt.figure()
+      pix_mat = density_matrix(cube, present, dat_col, iz, min_val, max_val)
+      plot_slice(fig, pix_mat, params, slice_title(params, col_label, dat_col, iz), cmap)
+      file_name = f'{dat_file_name}.col{dat_col}.z{iz}.png'
+      fig.savefig(file_name)
+      plt.close(fig)
+      print (f'Written: {file_name}')
 
-plt.show()
+  else:
+    fig = plt.figure()
+    pix_mat = density_matrix(cube, present, dat_col, z_index, min_val, max_val)
+    plot_slice(fig, pix_mat, params, slice_title(params, col_label, dat_col, z_index), cmap)
+    plt.show()
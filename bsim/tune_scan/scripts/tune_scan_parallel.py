@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Run a tune scan in parallel on one machine without MPI.
+# The tune grid of the master input file is split into parts along Q_a (or Q_b). Each part is run with
+# the single threaded tune_scan program in a pool of local processes, and the data files of the parts
+# are merged into one data file, as tune_scan (or tune_scan_mpi) would have written it.
+
+import sys
+import os
+import re
+import subprocess
+import concurrent.futures
+
+# Check version
+
+if sys.version_info[0] == 2 or sys.version_info[1] < 6: sys.exit("MUST USE PYTHON 3.6 OR GREATER!")
+
+# Help
+
+def print_help():
+  print ('''
+Usage:
+  tune_scan_parallel.py {-n <n_proc>} {-parts <n_parts>} {-axis <axis>} {-exe <executable>}
+                        {-dir <parts_dir>} {-force} {<master_input_file_name>}
+
+Defaults:
+  <n_proc>       = number of cores  # Number of tune_scan processes run at the same time.
+  <n_parts>      = 4 * <n_proc>     # Number of parts the grid is split into (at most one per grid line).
+  <axis>         = a or b           # Split along Q_a or Q_b. Default: the one with the most grid points.
+  <executable>   = $ACC_EXE/tune_scan
+  <parts_dir>    = tune_scan_parts  # Directory for the input, data, and log files of the parts.
+  <master_input_file_name> = tune_scan.init
+
+  -force                            # Rerun parts that are already done. By default, a part is not rerun if
+                                    #   its data file exists and its input file has not changed.
+
+The merged data file is written to ts%dat_out_file of the master input file.
+''')
+  exit()
+
+#------------------------------------------------------------------------------------------
+# Read the ts%<name> = <value> settings of the master input file. Names are lower case.
+
+def read_init(init_file_name):
+  params = {}
+  for line in open(init_file_name):
+    line = line.split('!')[0]
+    for name, value in re.findall(r'ts%(\w+)\s*=\s*("[^"]*"|\'[^\']*\'|[^\s,]+)', line, flags = re.IGNORECASE):
+      params[name.lower()] = value.strip('"\'')
+
+  return params
+
+def param_value(params, name):
+  return float(params[name.lower()].lower().replace('d', 'e'))
+
+#------------------------------------------------------------------------------------------
+# Grid start, step and number of steps (as in ts_init_params) along axis 'a' or 'b'.
+
+def grid_axis(params, axis):
+  q0 = param_value(params, f'Q_{axis}0')
+  q1 = param_value(params, f'Q_{axis}1')
+  dq = param_value(params, f'dQ_{axis}')
+  n = round(abs((q1 - q0) / dq)) if dq > 0 else 0
+  return q0, dq, n
+
+#------------------------------------------------------------------------------------------
+# Write the input file of a part: The master input file with the grid range along the axis and
+# the data file set for the part. Only the ts%<name> = <value> assignments that are set for the part
+# are removed, so other assignments on the same line are kept.
+
+def write_part_init(init_file_name, part_init, part_dat, axis, q0, q1):
+  set_re = re.compile(rf'ts%(q_{axis}0|q_{axis}1|dat_out_file)\s*=\s*("[^"]*"|\'[^\']*\'|[^\s,!]+)[ \t]*,?[ \t]*', flags = re.IGNORECASE)
+  lines = []
+  for line in open(init_file_name):
+    code, bang, comment = line.partition('!')
+    new_code = set_re.sub('', code)
+    if new_code != code:
+      if new_code.strip(' \t,\n') == '' and bang == '': continue
+      line = new_code + bang + comment
+    lines.append(line)
+    if re.match(r'\s*&params', line, flags = re.IGNORECASE):
+      lines.append(f'  ts%Q_{axis}0 = {q0:.12g}\n')
+      lines.append(f'  ts%Q_{axis}1 = {q1:.12g}\n')
+      lines.append(f'  ts%dat_out_file = "{part_dat}"\n')
+
+  text = ''.join(lines)
+  if os.path.exists(part_init) and open(part_init).read() == text: return False
+  with open(part_init, 'w') as f: f.write(text)
+  return True
+
+#------------------------------------------------------------------------------------------
+
+def run_part(exe, part_init):
+  with open(part_init + '.log', 'w') as log:
+    return subprocess.call([exe, part_init], stdout = log, stderr = subprocess.STDOUT)
+
+#------------------------------------------------------------------------------------------
+# Merge the data files of the parts. The grid index along the axis of each part is shifted by the
+# start index of the part and the rows are sorted in the order tune_scan writes them (ja fastest).
+# The header is the header of the first part with the grid range along the axis set to the full range.
+
+def merge_parts(parts, axis, q_range, n_max, dat_file_name):
+  icol = 0 if axis == 'a' else 1
+  header = {f'Q_{axis}0': f'{q_range[0]:12.4E}', f'Q_{axis}1': f'{q_range[1]:12.4E}', f'n{axis}_max': f'{n_max:8d}'}
+  head_lines = []
+  rows = []
+
+  for ip, (part_dat, j_start) in enumerate(parts):
+    with open(part_dat) as f:
+      for line in f:
+        if line[0] == '#':
+          if ip > 0: continue
+          m = re.match(r'(#\s*(\w+)\s*= )', line)
+          if m and m.group(2) in header: line = m.group(1) + header[m.group(2)] + '\n'
+          head_lines.append(line)
+          continue
+        j = [int(line[6*i:6*i+6]) for i in range(3)]
+        j[icol] += j_start
+        rows.append(((j[2], j[1], j[0]), '%6d%6d%6d' % tuple(j) + line[18:]))
+
+  rows.sort(key = lambda r: r[0])
+  with open(dat_file_name, 'w') as f:
+    f.writelines(head_lines)
+    f.writelines(r[1] for r in rows)
+
+#------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+  # Defaults
+
+  init_file_name = 'tune_scan.init'
+  n_proc = os.cpu_count()
+  n_parts = -1
+  axis = ''
+  exe = os.path.join(os.environ.get('ACC_EXE', ''), 'tune_scan')
+  parts_dir = 'tune_scan_parts'
+  force = False
+
+  # Command line arguments
+
+  i = 1
+  while i < len(sys.argv):
+    n = len(sys.argv[i])
+    if sys.argv[i] == '-':
+      print_help()
+
+    elif sys.argv[i] == '-axis'[:n]:
+      axis = sys.argv[i+1]
+      i += 1
+
+    elif sys.argv[i] == '-dir'[:n]:
+      parts_dir = sys.argv[i+1]
+      i += 1
+
+    elif sys.argv[i] == '-exe'[:n]:
+      exe = sys.argv[i+1]
+      i += 1
+
+    elif sys.argv[i] == '-force'[:n]:
+      force = True
+
+    elif sys.argv[i] == '-n':
+      n_proc = int(sys.argv[i+1])
+      i += 1
+
+    elif sys.argv[i] == '-parts'[:n]:
+      n_parts = int(sys.argv[i+1])
+      i += 1
+
+    elif sys.argv[i][0] == '-':
+      print_help()
+
+    else:
+      init_file_name = sys.argv[i]
+
+    i += 1
+
+  # Grid and parts
+
+  params = read_init(init_file_name)
+  dat_file_name = params.get('dat_out_file', os.path.splitext(init_file_name)[0] + '.dat')
+
+  if axis == '': axis = 'a' if grid_axis(params, 'a')[2] >= grid_axis(params, 'b')[2] else 'b'
+  if axis not in ['a', 'b']: sys.exit('-axis MUST BE "a" OR "b"')
+  q0, dq, n_max = grid_axis(params, axis)
+  if n_parts < 1: n_parts = 4 * n_proc
+  n_parts = min(n_parts, n_max + 1)
+
+  os.makedirs(parts_dir, exist_ok = True)
+  parts = []
+  to_run = []
+  for ip in range(n_parts):
+    j_start = ip * (n_max + 1) // n_parts
+    j_end = (ip + 1) * (n_max + 1) // n_parts - 1
+    part_init = os.path.join(parts_dir, f'part_{ip:03d}.init')
+    part_dat = os.path.join(parts_dir, f'part_{ip:03d}.dat')
+    changed = write_part_init(init_file_name, part_init, part_dat, axis, q0 + j_start * dq, q0 + j_end * dq)
+    parts.append((part_dat, j_start))
+    if force or changed or not os.path.exists(part_dat):
+      if os.path.exists(part_dat): os.remove(part_dat)
+      to_run.append(part_init)
+
+  # Run
+
+  print (f'Q_{axis} grid: {n_max+1} points split into {n_parts} parts. {len(to_run)} parts to run, {n_proc} at a time.')
+  failed = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers = n_proc) as pool:
+    futures = {pool.submit(run_part, exe, part_init): part_init for part_init in to_run}
+    for n_done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+      part_init = futures[future]
+      if future.result() == 0:
+        print (f'[{n_done}/{len(to_run)}] Done: {part_init}')
+      else:
+        failed.append(part_init)
+        print (f'[{n_done}/{len(to_run)}] FAILED: {part_init} (see {part_init}.log)')
+
+  missing = [part_dat for part_dat, j_start in parts if not os.path.exists(part_dat)]
+  if len(failed) > 0 or len(missing) > 0:
+    sys.exit('PARTS FAILED OR MISSING DATA. NO MERGED DATA FILE WRITTEN. RERUN TO RUN ONLY THESE PARTS.')
+
+  # Merge
+
+  q_range = (q0, param_value(params, f'Q_{axis}1'))
+  merge_parts(parts, axis, q_range, n_max, dat_file_name)
+  print (f'Written: {dat_file_name}')
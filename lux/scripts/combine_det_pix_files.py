@@ -4,10 +4,13 @@
 # This is useful when a simulation has to be broken up into multiple runs.
 
 import sys
+import os
 import math
 
-T = True    # For converting from det_pix file header T/F notation
-F = False
+# For bmad_header.py. When this file is run with execfile / exec, __file__ is not defined and only $ACC_ROOT_DIR/util is used.
+if '__file__' in globals(): sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../util'))
+if 'ACC_ROOT_DIR' in os.environ: sys.path.append(os.path.join(os.environ['ACC_ROOT_DIR'], 'util'))
+import bmad_header
 
 class pix_class:
   def __init__(self):
@@ -59,38 +62,36 @@ def rms(rms_old, ave_old, intens_old, rms_now, ave_now, intens_now):
 pix_table = {}
 
 for arg in sys.argv[1:]:
+  par, n_header, line = bmad_header.read_header(arg, end = '#--')  # Look at a det_pix file to understand this.
   det_file = open(arg, 'r')
+  for i in range(n_header): det_file.readline()
 
-  for n_header in range(1, 1000):
-    line = det_file.readline()
-    if line[0:3] == '#--': break
-    exec (line)              # This defines photons_tracked, etc. Look at a det_pix file to understand this.
-    if arg == sys.argv[1]:   # If first time.
-      z = line.split('=')
-      exec (z[0].strip() + '_tot =' +  z[1])  # This initalizes photons_tracked_tot, etc.
-
-  if arg != sys.argv[1]:
-    master_parameter_file_tot  = master_parameter_file_tot + ', ' + master_parameter_file
-    lattice_file_tot           = lattice_file_tot + ', ' + lattice_file
-    photons_tracked_tot        = photons_tracked_tot + photons_tracked
-    nx_active_min_tot = min(nx_active_min_tot, nx_active_min)
-    nx_active_max_tot = max(nx_active_max_tot, nx_active_max)
-    ny_active_min_tot = min(ny_active_min_tot, ny_active_min)
-    ny_active_max_tot = max(ny_active_max_tot, ny_active_max)
-    intensity_x_unnorm_tot = intensity_x_unnorm_tot + intensity_x_unnorm
-    intensity_y_unnorm_tot = intensity_y_unnorm_tot + intensity_y_unnorm
-
-    intensity_unnorm_old   = intensity_unnorm_tot
-    intensity_unnorm_tot   = intensity_unnorm_tot + intensity_unnorm
-
-    normilization_tot    = normalization * photons_tracked / photons_tracked_tot
-    intensity_x_norm_tot = intensity_x_unnorm_tot * normalization_tot
-    intensity_y_norm_tot = intensity_y_norm_tot + intensity_y_norm * normalization_tot
-    intensity_norm_tot   = intensity_norm_tot + intensity_norm * normalization_tot
-    x_rms_det            = rms(x_rms_det_tot, x_center_det_tot, intensity_unnorm_old, x_rms_det, x_center_det, intensity_unnorm)
-    y_rms_det            = rms(y_rms_det_tot, y_center_det_tot, intensity_unnorm_old, y_rms_det, y_center_det, intensity_unnorm)
-    x_center_det_tot     = ave(x_center_det_tot, intensity_unnorm_old, x_center_det, intensity_unnorm)
-    y_center_det_tot     = ave(y_center_det_tot, intensity_unnorm_old, y_center_det, intensity_unnorm)
+  if arg == sys.argv[1]:   # If first time.
+    tot = dict(par)        # This initalizes tot['n_track_tot'], etc.
+
+  else:
+    tot['master_parameter_file'] = tot['master_parameter_file'] + ', ' + par['master_parameter_file']
+    tot['lattice_file']          = tot['lattice_file'] + ', ' + par['lattice_file']
+    for name in ['n_track_tot', 'n_at_detec', 'n_hit_pixel']:
+      tot[name] = tot[name] + par[name]
+    tot['nx_active_min'] = min(tot['nx_active_min'], par['nx_active_min'])
+    tot['nx_active_max'] = max(tot['nx_active_max'], par['nx_active_max'])
+    tot['ny_active_min'] = min(tot['ny_active_min'], par['ny_active_min'])
+    tot['ny_active_max'] = max(tot['ny_active_max'], par['ny_active_max'])
+    tot['intensity_x_unnorm'] = tot['intensity_x_unnorm'] + par['intensity_x_unnorm']
+    tot['intensity_y_unnorm'] = tot['intensity_y_unnorm'] + par['intensity_y_unnorm']
+
+    intensity_unnorm_old      = tot['intensity_unnorm']
+    tot['intensity_unnorm']   = tot['intensity_unnorm'] + par['intensity_unnorm']
+
+    tot['normalization']      = par['normalization'] * par['n_track_tot'] / tot['n_track_tot']
+    tot['intensity_x_norm']   = tot['intensity_x_unnorm'] * tot['normalization']
+    tot['intensity_y_norm']   = tot['intensity_y_unnorm'] * tot['normalization']
+    tot['intensity_norm']     = tot['intensity_unnorm'] * tot['normalization']
+    tot['x_rms_det']    = rms(tot['x_rms_det'], tot['x_center_det'], intensity_unnorm_old, par['x_rms_det'], par['x_center_det'], par['intensity_unnorm'])
+    tot['y_rms_det']    = rms(tot['y_rms_det'], tot['y_center_det'], intensity_unnorm_old, par['y_rms_det'], par['y_center_det'], par['intensity_unnorm'])
+    tot['x_center_det'] = ave(tot['x_center_det'], intensity_unnorm_old, par['x_center_det'], par['intensity_unnorm'])
+    tot['y_center_det'] = ave(tot['y_center_det'], intensity_unnorm_old, par['y_center_det'], par['intensity_unnorm'])
 
   #----------------------------
 
@@ -153,27 +154,30 @@ def sort_order(key):
 
 out_file = open('dp.dat', 'w')
 
-out_file.write('master_parameter_file             = "[' + master_parameter_file_tot + ']"\n')
-out_file.write('lattice_file                      = "[' + lattice_file_tot + ']"\n')
-out_file.write('intensity_normalization_coef      = ' + to_str(intensity_normalization_coef_tot, '.6g') + '\n')
-out_file.write('normalization_includes_pixel_area = ' + to_str(normalization_includes_pixel_area_tot, '.6g') + '\n')
-out_file.write('normalization       = ' + to_str(normalization_tot, '.6g') + '\n')
-out_file.write('intensity_x_unnorm  = ' + to_str(intensity_x_unnorm_tot, '.6g') + '\n')
-out_file.write('intensity_x_norm    = ' + to_str(intensity_x_norm_tot, '.6g') + '\n')
-out_file.write('intensity_y_unnorm  = ' + to_str(intensity_y_unnorm_tot, '.6g') + '\n')
-out_file.write('intensity_y_norm    = ' + to_str(intensity_y_norm_tot, '.6g') + '\n')
-out_file.write('intensity_unnorm    = ' + to_str(intensity_unnorm_tot, '.6g') + '\n')
-out_file.write('intensity_norm      = ' + to_str(intensity_norm_tot, '.6g') + '\n')
-out_file.write('dx_pixel            = ' + to_str(dx_pixel_tot, '.6g') + '\n')
-out_file.write('dy_pixel            = ' + to_str(dy_pixel_tot, '.6g') + '\n')
-out_file.write('nx_active_min       = ' + to_str(nx_active_min_tot, '.6g') + '\n')
-out_file.write('nx_active_max       = ' + to_str(nx_active_max_tot, '.6g') + '\n')
-out_file.write('ny_active_min       = ' + to_str(ny_active_min_tot, '.6g') + '\n')
-out_file.write('ny_active_max       = ' + to_str(ny_active_max_tot, '.6g') + '\n')
-out_file.write('x_center_det        = ' + to_str(x_center_det_tot, '.6g') + '\n')
-out_file.write('y_center_det        = ' + to_str(y_center_det_tot, '.6g') + '\n')
-out_file.write('x_rms_det           = ' + to_str(x_rms_det_tot, '.6g') + '\n')
-out_file.write('y_rms_det           = ' + to_str(y_rms_det_tot, '.6g') + '\n')
+out_file.write('master_parameter_file             = "[' + tot['master_parameter_file'] + ']"\n')
+out_file.write('lattice_file                      = "[' + tot['lattice_file'] + ']"\n')
+out_file.write('intensity_normalization_coef      = ' + to_str(tot['intensity_normalization_coef'], '.6g') + '\n')
+out_file.write('normalization_includes_pixel_area = ' + to_str(tot['normalization_includes_pixel_area'], '.6g') + '\n')
+out_file.write('normalization       = ' + to_str(tot['normalization'], '.6g') + '\n')
+out_file.write('intensity_x_unnorm  = ' + to_str(tot['intensity_x_unnorm'], '.6g') + '\n')
+out_file.write('intensity_x_norm    = ' + to_str(tot['intensity_x_norm'], '.6g') + '\n')
+out_file.write('intensity_y_unnorm  = ' + to_str(tot['intensity_y_unnorm'], '.6g') + '\n')
+out_file.write('intensity_y_norm    = ' + to_str(tot['intensity_y_norm'], '.6g') + '\n')
+out_file.write('intensity_unnorm    = ' + to_str(tot['intensity_unnorm'], '.6g') + '\n')
+out_file.write('intensity_norm      = ' + to_str(tot['intensity_norm'], '.6g') + '\n')
+out_file.write('n_track_tot         = ' + to_str(tot['n_track_tot'], 'd') + '\n')
+out_file.write('n_at_detec          = ' + to_str(tot['n_at_detec'], 'd') + '\n')
+out_file.write('n_hit_pixel         = ' + to_str(tot['n_hit_pixel'], 'd') + '\n')
+out_file.write('dx_pixel            = ' + to_str(tot['dx_pixel'], '.6g') + '\n')
+out_file.write('dy_pixel            = ' + to_str(tot['dy_pixel'], '.6g') + '\n')
+out_file.write('nx_active_min       = ' + to_str(tot['nx_active_min'], '.6g') + '\n')
+out_file.write('nx_active_max       = ' + to_str(tot['nx_active_max'], '.6g') + '\n')
+out_file.write('ny_active_min       = ' + to_str(tot['ny_active_min'], '.6g') + '\n')
+out_file.write('ny_active_max       = ' + to_str(tot['ny_active_max'], '.6g') + '\n')
+out_file.write('x_center_det        = ' + to_str(tot['x_center_det'], '.6g') + '\n')
+out_file.write('y_center_det        = ' + to_str(tot['y_center_det'], '.6g') + '\n')
+out_file.write('x_rms_det           = ' + to_str(tot['x_rms_det'], '.6g') + '\n')
+out_file.write('y_rms_det           = ' + to_str(tot['y_rms_det'], '.6g') + '\n')
 
 out_file.write('''
 #-----------------------------------------------------
@@ -4,13 +4,16 @@
 #   execfile('this_file_name')
 
 import sys
+import os
 import re
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 
-T = True    # For converting from det_pix file header T/F notation
-F = False
+# For bmad_header.py. When this file is run with execfile / exec, __file__ is not defined and only $ACC_ROOT_DIR/util is used.
+if '__file__' in globals(): sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../util'))
+if 'ACC_ROOT_DIR' in os.environ: sys.path.append(os.path.join(os.environ['ACC_ROOT_DIR'], 'util'))
+import bmad_header
 
 # Check version
 
@@ -90,17 +93,10 @@ else:
 
 # Read data file parameters in header lines and data file data
 
-dat_file = open (dat_file_name)
+# Header lines start with "#", except in old style files.
 
-for n_header in range(1, 1000):
-  line = dat_file.readline()
-  if line[0:3] == '#--': break
-  if (line[0] == '#'): line = line[1:] # Remove beginning "#". Old style did not have beginning "#".
-  line = line.strip() 
-  print (line) 
-  exec (line)
-
-dat_file.close()
+params, n_header, line = bmad_header.read_header(dat_file_name, end = '#--')
+for name, value in params.items(): print (name + ' = ' + str(value))
 
 pix_dat = np.loadtxt(dat_file_name, usecols=(0,1,p_col), skiprows = n_header)
 
@@ -108,10 +104,10 @@ pix_dat = np.loadtxt(dat_file_name, usecols=(0,1,p_col), skiprows = n_header)
 
 # Create density matrix
 
-nx_min = nx_active_min - x_margin  # For border
-nx_max = nx_active_max + x_margin
-ny_min = ny_active_min - y_margin  # For border
-ny_max = ny_active_max + y_margin
+nx_min = params['nx_active_min'] - x_margin  # For border
+nx_max = params['nx_active_max'] + x_margin
+ny_min = params['ny_active_min'] - y_margin  # For border
+ny_max = params['ny_active_max'] + y_margin
 
 print ('nx min/max: ' + str(nx_min) + ', ' + str(nx_max))
 print ('ny min/max: ' + str(ny_min) + ', ' + str(ny_max))
@@ -123,10 +119,10 @@ for pix in pix_dat:
 
 # And plot
 
-x_min = scale * nx_min * dx_pixel
-x_max = scale * nx_max * dx_pixel
-y_min = scale * ny_min * dy_pixel
-y_max = scale * ny_max * dy_pixel
+x_min = scale * nx_min * params['dx_pixel']
+x_max = scale * nx_max * params['dx_pixel']
+y_min = scale * ny_min * params['dy_pixel']
+y_max = scale * ny_max * params['dy_pixel']
 
 if 'ix_plot' not in locals(): ix_plot = 0
 ix_plot = ix_plot + 1
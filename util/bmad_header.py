@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#+
+# Parser for the "name = value" parameter header lines of data files written by Bmad based programs
+# (tune_scan, long_term_tracking, lux, etc.). EG:
+#   # lat_file                   = "small_ring.bmad"
+#   # Q_a0                       =   1.0000E-01
+#   # rf_on                      =    T
+#   # ltt%exclude_from_maps      = beambeam::*
+#   # x_center_det        =  1.23450E-03  # 1.2345 pixels
+#
+# Values are converted to Python types:
+#   T, F, .true., .false.          -> bool
+#   123                            -> int
+#   1.0E-01, 1.0d-3                -> float
+#   "abc" or 'abc'                 -> str (without the quotes)
+#   [1, 2, 3] or 1 2 3             -> list of the above
+#   Anything else                  -> str (as is). EG: beambeam::*
+# Names are kept as in the file, including "%" in component names (EG: ltt%ramping_on), unless a
+# replacement for "%" is given. Text after a "#" or "!" that is not in a quoted string is a comment.
+#
+# Nothing in the file is executed, so this is safe to use with files from anywhere.
+#
+# Use from a script in the Bmad Distribution, EG:
+#   sys.path.append(os.path.join(os.environ['ACC_ROOT_DIR'], 'util'))
+#   import bmad_header
+#   params, n_header, end_line = bmad_header.read_header('tune_scan.dat', end = '#-')
+#-
+
+import re
+
+logicals = {'t': True, 'f': False, '.t.': True, '.f.': False, '.true.': True, '.false.': False, 'true': True, 'false': False}
+
+token_re   = re.compile(r'"[^"]*"|\'[^\']*\'|[^\s,]+')
+name_re    = re.compile(r'[A-Za-z_][\w%.()\[\]]*$')
+int_re     = re.compile(r'[+-]?\d+$')
+float_re   = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?$')
+comment_re = re.compile(r'"[^"]*"|\'[^\']*\'|[#!]')
+non_finite = {'nan', 'inf', '+inf', '-inf', 'infinity', '+infinity', '-infinity'}
+
+#------------------------------------------------------------------------------------
+# Convert one value word. Returns (value, is_typed) where is_typed is False if the word is not
+# a number, logical, or quoted string.
+
+def scalar (word):
+  if len(word) > 1 and word[0] == word[-1] and word[0] in '"\'': return word[1:-1], True
+  lower = word.lower()
+  if lower in logicals: return logicals[lower], True
+  if int_re.match(word): return int(word), True
+  if float_re.match(word): return float(lower.replace('d', 'e')), True
+  if lower in non_finite: return float(lower), True
+  return word, False
+
+#------------------------------------------------------------------------------------
+# Convert the value text of a header line (after the "=", comment removed).
+
+def parse_value (text):
+  text = text.strip()
+
+  if len(text) > 1 and text[0] == '[' and text[-1] == ']':
+    return [scalar(word)[0] for word in token_re.findall(text[1:-1])]
+
+  words = token_re.findall(text)
+  if len(words) == 0: return ''
+  if len(words) == 1: return scalar(words[0])[0]
+
+  values = [scalar(word) for word in words]
+  if all(typed for value, typed in values): return [value for value, typed in values]
+  return text
+
+#------------------------------------------------------------------------------------
+# Remove a trailing comment ("#" or "!" not in a quoted string).
+
+def strip_comment (text):
+  for m in comment_re.finditer(text):
+    if m.group(0) in '#!': return text[:m.start()]
+  return text
+
+#------------------------------------------------------------------------------------
+# Parse one header line. A beginning "#" (or "##") is ignored.
+# Returns (name, value), or None if the line is not a "name = value" line.
+
+def parse_line (line, percent = '%'):
+  line = line.strip().lstrip('#')
+  if '=' not in line: return None
+
+  name, text = line.split('=', 1)
+  name = name.strip()
+  if not name_re.match(name): return None
+
+  if percent != '%': name = name.replace('%', percent)
+  return name, parse_value(strip_comment(text))
+
+#------------------------------------------------------------------------------------
+# Read the header of a data file.
+# The header ends at the first line starting with end (EG: "#-"), or, if end is None, at the first line
+# that does not start with "#". Blank lines and lines that are not "name = value" lines are skipped.
+# Use percent to replace the "%" in names. EG: percent = '_' gives ltt_ramping_on for ltt%ramping_on.
+#
+# Returns:
+#   params    -- Dict of name: value.
+#   n_header  -- Number of header lines, including the end line if end is given.
+#   end_line  -- The line that ended the header ('' at end of file).
+
+def read_header (file_name, end = None, percent = '%'):
+  params = {}
+  n_header = 0
+  end_line = ''
+
+  with open(file_name, 'r') as f:
+    for line in f:
+      if end is None:
+        if line[0] != '#' and line.strip() != '':
+          end_line = line
+          break
+      elif line.startswith(end):
+        n_header += 1
+        end_line = line
+        break
+
+      n_header += 1
+      name_value = parse_line(line, percent)
+      if name_value is not None: params[name_value[0]] = name_value[1]
+
+  return params, n_header, end_line
@@ -1,87 +1,137 @@
+#!/usr/bin/env python3
+
+import os, sys
 import numpy as np
 import matplotlib.pyplot as plt
-import time
-# Input parameters
+
+# Help
+
+def print_help():
+  print ('''
+Usage:
+  plot_field_vs_z.py {-data <dat_file>} {-fit <fit_file>} {-xy <x>,<y>} {-xy <x>,<y> ...} {-field <components>}
+
+  -xy     may be given multiple times. Each (x, y) must correspond to a grid position.
+  -field  is a comma separated list of field components. EG: "-field Bx,Bz".
+Options may be abbreviated as long as the abbreviation is unambiguous (EG: "-fie" for -field).
+
+Defaults:
+  <dat_file>   = bmad_field.table
+  <fit_file>   = fit.table
+  <x>,<y>      = 0.1,0.2
+  <components> = Bz
+
+A cached copy of each table is kept in <table_file>.npy and is reused until the table is modified.
+''')
+  exit()
+
+# Defaults
 
 dat_file_name = 'bmad_field.table'
 fit_file_name = 'fit.table'
-x_val = 0.1    # Must correspond to a grid x-position value
-y_val = 0.2    # Must correspond to a grid y-position value
-plot_type = 'Bz'
+xy_vals = []
+plot_types = ['Bz']
+b_col = {'Bx': 3, 'By': 4, 'Bz': 5}
 
-# Read header
+# Command line arguments
 
-dat_file = open(dat_file_name, 'r')
+i = 1
+while i < len(sys.argv):
+  n = len(sys.argv[i])
+  if sys.argv[i] == '-':
+    print_help()
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-pos_scale = float(vals[0])
+  elif sys.argv[i] == '-data'[:n] and n > 1 and i+1 < len(sys.argv):
+    dat_file_name = sys.argv[i+1]
+    i += 1
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-field_scale = float(vals[0])
+  elif sys.argv[i] == '-fit'[:n] and n > 3 and i+1 < len(sys.argv):
+    fit_file_name = sys.argv[i+1]
+    i += 1
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-nx_min = float(vals[0])
-nx_max = float(vals[1])
+  elif sys.argv[i] == '-field'[:n] and n > 3 and i+1 < len(sys.argv):
+    plot_types = sys.argv[i+1].split(',')
+    for p in plot_types:
+      if p not in b_col: print_help()
+    i += 1
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-ny_min = float(vals[0])
-ny_max = float(vals[1])
+  elif sys.argv[i] == '-xy'[:n] and n > 1 and i+1 < len(sys.argv):
+    vals = sys.argv[i+1].split(',')
+    xy_vals.append((float(vals[0]), float(vals[1])))
+    i += 1
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-nz_min = float(vals[0])
-nz_max = float(vals[1])
+  else:
+    print_help()
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-del_x = float(vals[0])
-del_y = float(vals[1])
-del_z = float(vals[2])
+  i += 1
 
-vals = dat_file.readline().replace(',', ' ').split('!')[0].split()
-x_off = float(vals[0])
-y_off = float(vals[1])
-z_off = float(vals[2])
+if len(xy_vals) == 0: xy_vals = [(0.1, 0.2)]
 
-dat_file.close()
+#----------------------------------------------
+# Load a field table. The table is cached as a .npy file whose modification time is set to
+# that of the table. The cache is used only if the two modification times agree.
 
-# Read data and fit tables
+def load_table(file_name):
+  npy_name = file_name + '.npy'
+  t_table = os.path.getmtime(file_name)
 
-if plot_type == 'Bx':
-  b_row = 3
-elif plot_type == 'By':
-  b_row = 4
-else:
-  b_row = 5
+  if os.path.exists(npy_name) and os.path.getmtime(npy_name) == t_table:
+    return np.load(npy_name)
 
-x_dat = []
-y_dat = []
+  table = np.loadtxt(file_name, skiprows = 7, comments = '!', ndmin = 2)
+  try:
+    np.save(npy_name, table)
+    os.utime(npy_name, (t_table, t_table))
+  except OSError:
+    pass
+  return table
 
-dat_table = np.loadtxt(dat_file_name, skiprows = 7)
-for row in dat_table:
-  if abs(row[0] - x_val) > 1e-5*del_x: continue
-  if abs(row[1] - y_val) > 1e-5*del_y: continue
-  x_dat.append(row[2])
-  y_dat.append(row[b_row])
+#----------------------------------------------
+# Return the rows of table on the (x_val, y_val) line.
 
+def xy_slice(table, x_val, y_val):
+  mask = (np.abs(table[:,0] - x_val) <= 1e-5*del_x) & (np.abs(table[:,1] - y_val) <= 1e-5*del_y)
+  return table[mask]
 
-x_fit = []
-y_fit = []
+# Read header
+
+dat_file = open(dat_file_name, 'r')
+header = [dat_file.readline().replace(',', ' ').split('!')[0].split() for n in range(7)]
+dat_file.close()
+
+pos_scale = float(header[0][0])
+field_scale = float(header[1][0])
+del_x, del_y, del_z = [float(v) for v in header[5][0:3]]
 
-fit_table = np.loadtxt(fit_file_name, skiprows = 7)
-for row in fit_table:
-  if abs(row[0] - x_val) > 1e-5*del_x: continue
-  if abs(row[1] - y_val) > 1e-5*del_y: continue
-  x_fit.append(row[2])
-  y_fit.append(row[b_row])
+# Read data and fit tables
+
+dat_table = load_table(dat_file_name)
+if os.path.exists(fit_file_name):
+  fit_table = load_table(fit_file_name)
+else:
+  print ('No fit table: ' + fit_file_name)
+  fit_table = None
 
 # Plot
 
-plt.plot(x_dat, y_dat, 'ro', markersize = 1, label = dat_file_name)
-plt.plot(x_fit, y_fit, 'go', markersize = 1, label = fit_file_name)
-plt.plot([], [], ' ', label = 'x = ' + str(x_val))  # For creating the legend
-plt.plot([], [], ' ', label = 'y = ' + str(y_val))
+fig, axes = plt.subplots(len(plot_types), 1, sharex = True, squeeze = False)
+
+for ip, plot_type in enumerate(plot_types):
+  ax = axes[ip,0]
+  b_row = b_col[plot_type]
+
+  for (x_val, y_val) in xy_vals:
+    xy_label = ' (x, y) = (' + str(x_val) + ', ' + str(y_val) + ')'
+    dat = xy_slice(dat_table, x_val, y_val)
+    if len(dat) == 0: print ('No grid points at' + xy_label)
+    line = ax.plot(dat[:,2], dat[:,b_row], 'o', markersize = 1, label = dat_file_name + xy_label)
+    if fit_table is not None:
+      fit = xy_slice(fit_table, x_val, y_val)
+      ax.plot(fit[:,2], fit[:,b_row], '-', linewidth = 1, color = line[0].get_color(), label = fit_file_name + xy_label)
+
+  ax.set_ylabel(plot_type)
+  ax.legend(fontsize = 'small')
 
-plt.xlabel('Z')
-plt.ylabel(plot_type)
-plt.legend()
+axes[-1,0].set_xlabel('Z')
 
 plt.show()
@@ -5,155 +5,447 @@
 # Parse opera field map table to bmad field map format.
 # Developed by: Henry Lovelace III
 
-import os, sys, stat, math
-import glob
+import os, sys, time, warnings
+import itertools
 import numpy as np
-import time
-import matplotlib.pyplot as plt
+
 #########################################################################
 
-def main( argv ):
-  opera_file = sys.argv[1]
-  o_f = open(opera_file,'r')
-  bmad_parse = os.path.join(os.getcwd(),'bmad_parse_'+opera_file)
-  b_p=open(bmad_parse,'w')
+#Gauss (1e-4)or Tesla (1)
+units = 1e-4
+
+# Number of grid points formatted per write to the output file.
+n_block = 100000
+
+# Number of table rows read per chunk in streaming mode.
+n_chunk = 1000000
 
 #########################################################################
-#Gauss (1e-4)or Tesla (1)
-  units = 1e-4
-
-#ITERATOR AND POINTS
-  i=8
-  x=0
-  y=0
-  z=0
-###Set increment for points###
-  increment = .01
-##############################
-  nodes=o_f.readlines()
-  tot_nodes=nodes[0].split()
-  all_nodes=int(tot_nodes[0])*int(tot_nodes[1])*int(tot_nodes[2])
-
-###Set increment for points for file###
-  if 'M' in nodes[1]:increment_x = 1.0
-  if 'CM' in nodes[1]:increment_x = .01
-  if 'LENGU' in nodes[1]:increment_x = .01
-  if 'MM' in nodes[1]:increment_x = .001
-  
-  if 'M' in nodes[2]:increment_y = 1.0
-  if 'CM' in nodes[2]:increment_y = .01
-  if 'LENGU' in nodes[2]:increment_y = .01
-  if 'MM' in nodes[2]:increment_y = .001
-
-  if 'M' in nodes[3]:increment_z = 1.0
-  if 'CM' in nodes[3]:increment_z = .01
-  if 'LENGU' in nodes[3]:increment_z = .01
-  if 'MM' in nodes[3]:increment_z = .001
- 
-# Hard coded limit to array in Python is 536,870,912 on 32 bit system
+
+def print_help():
+  print ('''
+Usage:
+  opera_fieldmap_to_bmad.py {-hdf5} {-stream} {-chunk <n_rows>} <opera_table_file>
+  opera_fieldmap_to_bmad.py -fit_table {-ascii} {-residual <fit_table_file>} <opera_table_file>
+
+  -hdf5    # Write the grid in the Bmad HDF5 grid_field format instead of ASCII.
+           # Use in a lattice file with: grid_field = call::bmad_parse_<name>.h5
+  -stream  # Process the table in chunks of <n_rows> rows (default 1000000). 
+           # Memory use is independent of the table size. ASCII output only.
+  -fit_table  # Write the field table used by cartesian_map_fit instead of a grid_field.
+              # Default is the binary form bmad_field.table.binary (use field_file = "binary::bmad_field.table.binary").
+              # With -ascii the ASCII form bmad_field.table is written.
+  -residual   # Compare the fit table written by "cartesian_map_fit fit_table" with the OPERA data and
+              # print the RMS field residual for each z-plane.
+
+Output is the file bmad_parse_<opera_table_file> (or bmad_parse_<name>.h5) in the current directory.
+''')
+  exit()
+
+#########################################################################
+# Length conversion factor to meters for a column header line like " 1 X [CM]".
+
+def length_scale(line):
+  if 'MM' in line: return .001
+  if 'CM' in line or 'LENGU' in line: return .01
+  return 1.0
+
+#########################################################################
+# Read the OPERA header.
+# The first line is the number of nodes along x, y, z. Column definition lines follow.
+# The header ends at the first line that has six or more numbers (the first data line).
+# Returns: n_nodes [nx, ny, nz], length scale for x, y, z, number of header lines.
+
+def read_opera_header(o_f):
+  n_nodes = [int(v) for v in o_f.readline().split()[0:3]]
+  columns = []
+  n_header = 1
+
+  while True:
+    pos = o_f.tell()
+    line = o_f.readline()
+    if line == '': break
+    vals = line.split()
+    if len(vals) >= 6:
+      try:
+        [float(v) for v in vals]
+        o_f.seek(pos)
+        break
+      except ValueError:
+        pass
+    columns.append(line)
+    n_header += 1
+
+  scale = [length_scale(columns[i]) if i < len(columns) else 1.0 for i in range(3)]
+  return n_nodes, scale, n_header
+
+#########################################################################
+# Load the whole table in one call.
+# Returns: array of shape (n_pts, 6) with x, y, z in meters and Bx, By, Bz in Tesla.
+
+def load_opera_table(opera_file):
+  with open(opera_file, 'r') as o_f:
+    n_nodes, scale, n_header = read_opera_header(o_f)
+    data = np.loadtxt(o_f, usecols = range(6), ndmin = 2)
+
+  data[:,0:3] *= scale
+  data[:,3:6] *= units
+  return n_nodes, data
+
+#########################################################################
+# Generator returning the table in chunks of n_chunk rows.
+# Units are converted as in load_opera_table.
+
+def read_opera_chunks(opera_file):
+  with open(opera_file, 'r') as o_f:
+    n_nodes, scale, n_header = read_opera_header(o_f)
+    while True:
+      lines = list(itertools.islice(o_f, n_chunk))
+      if len(lines) == 0: return
+      data = np.loadtxt(lines, usecols = range(6), ndmin = 2)
+      data[:,0:3] *= scale
+      data[:,3:6] *= units
+      yield data
+
+#########################################################################
+# First streaming pass: Find the grid from the set of distinct coordinates along each axis.
+# Only the distinct coordinate values are kept so memory use does not scale with the table size.
+
+def scan_opera_grid(opera_file):
+  with open(opera_file, 'r') as o_f:
+    n_nodes, scale, n_header = read_opera_header(o_f)
+
+  coords = [np.zeros(0), np.zeros(0), np.zeros(0)]
+  for data in read_opera_chunks(opera_file):
+    for i in range(3):
+      coords[i] = np.union1d(coords[i], data[:,i])
+
+  r0 = np.zeros(3)
+  dr = np.zeros(3)
+  for i in range(3):
+    r0[i] = coords[i][0]
+    if len(coords[i]) > 1:
+      diff = np.diff(coords[i])
+      dr[i] = diff.mean()
+      if not np.allclose(diff, dr[i], rtol = 1e-4): sys.exit('NON-UNIFORM GRID SPACING ALONG AXIS: ' + 'xyz'[i])
+
+  g_size = np.array([len(c) for c in coords])
+  if any(g_size != n_nodes):
+    print ('WARNING: GRID SIZE ' + str(list(g_size)) + ' DOES NOT MATCH HEADER ' + str(n_nodes))
+
+  return g_size, r0, dr
+
+#########################################################################
+# Second streaming pass: Index each chunk, check that every point is on the grid, and write it out.
+# Bmad pt() lines carry explicit indices so the points are written in table order.
+
+def convert_streaming(opera_file, bmad_parse):
+  g_size, r0, dr = scan_opera_grid(opera_file)
+  dr_safe = np.where(dr == 0, 1.0, dr)
+  n_tot = int(np.prod(g_size))
+  n_done = 0
+
+  with open(bmad_parse, 'w') as b_p:
+    write_bmad_header(b_p, r0, dr)
+    chunks = read_opera_chunks(opera_file)
+    data = next(chunks, None)
+
+    while data is not None:
+      next_data = next(chunks, None)
+
+      idx = np.rint((data[:,0:3] - r0) / dr_safe).astype(int)
+      off_grid = np.abs(data[:,0:3] - (r0 + idx * dr)).max(axis = 1) > 1e-3 * dr_safe.min()
+      if off_grid.any():
+        sys.exit('\nPOINT NOT ON GRID AT DATA ROW: ' + str(n_done + np.argmax(off_grid) + 1))
+
+      write_grid_points(b_p, idx, data[:,3:6], next_data is None)
+      n_done += len(data)
+      print ('\rPoints processed: %d / %d  (%.1f%%)' % (n_done, n_tot, 100.0 * n_done / max(n_tot, 1)), end = '', flush = True)
+      data = next_data
+
+  print ('')
+  if n_done != n_tot:
+    print ('WARNING: NUMBER OF POINTS IN TABLE (' + str(n_done) + ') DOES NOT MATCH GRID SIZE (' + str(n_tot) + ')')
+
+#########################################################################
+# Infer the grid from the point coordinates.
+# Returns: r0 (grid origin), dr (grid spacing), and integer indices (n_pts, 3) of each point.
+
+def grid_from_data(data, n_nodes):
+  r0 = np.zeros(3)
+  dr = np.zeros(3)
+  for i in range(3):
+    coord = np.unique(data[:,i])
+    r0[i] = coord[0]
+    if len(coord) > 1:
+      diff = np.diff(coord)
+      dr[i] = diff.mean()
+      if not np.allclose(diff, dr[i], rtol = 1e-4): sys.exit('NON-UNIFORM GRID SPACING ALONG AXIS: ' + 'xyz'[i])
+    if len(coord) != n_nodes[i]:
+      print ('WARNING: NUMBER OF GRID POINTS ALONG ' + 'xyz'[i] + ' IS ' + str(len(coord)) +
+                                                    ' BUT HEADER SAYS ' + str(n_nodes[i]))
+
+  idx = np.zeros((len(data), 3), dtype = int)
+  for i in range(3):
+    if dr[i] != 0: idx[:,i] = np.rint((data[:,i] - r0[i]) / dr[i])
+
+  u, count = np.unique(idx, axis = 0, return_counts = True)
+  if (count > 1).any():
+    dup = np.flatnonzero((idx == u[np.argmax(count > 1)]).all(axis = 1))
+    sys.exit('DATA ROWS ' + str(dup[0] + 1) + ' AND ' + str(dup[1] + 1) + ' ARE AT THE SAME GRID POINT')
+
+  return r0, dr, idx
+
+#########################################################################
+# Write the grid points as "pt(i,j,k) = (Bx, By, Bz)" lines in blocks of n_block points.
+
+def write_grid_points(b_p, idx, B, last_block):
+  row_fmt = 'pt( %d, %d, %d) = (%.10g, %.10g, %.10g),\n'
+  n_pts = len(idx)
+  for n0 in range(0, n_pts, n_block):
+    n1 = min(n0 + n_block, n_pts)
+    block = np.hstack((idx[n0:n1], B[n0:n1])).ravel().tolist()
+    text = (row_fmt * (n1 - n0)) % tuple(block)
+    if last_block and n1 == n_pts: text = text[:-2] + '}\n'
+    b_p.write(text)
+
+#########################################################################
+
+def write_bmad_header(b_p, r0, dr):
   b_p.write('{ geometry = xyz, \n')
   b_p.write('  field_type = magnetic, \n')
   b_p.write('  field_scale = 1.0, \n')
   b_p.write('  ele_anchor_pt = center, \n') # double check your field map, you may want to change this.
-
 #(x,y,z) = dr * (ix,iy,iz) + r0 + r_anchor
+  b_p.write('r0=('+str(r0[0])+', '+str(r0[1])+', '+str(r0[2])+'),\n')
+  b_p.write('dr=('+str(dr[0])+', '+str(dr[1])+', '+str(dr[2])+'), \n')
 
-  initial_value=nodes[8].split()
-  initial_x=float(initial_value[0])*increment_x#*1e-2         
-  initial_y=float(initial_value[1])*increment_y#*1e-2
-  initial_z=float(initial_value[2])*increment_z#*1e-2
-  b_p.write('r0=('+str(initial_x)+', '+str(initial_y)+', '+str(initial_z)+'),\n')
-#Stupid iteration I will find something smarter 
-  test_x = initial_x
-  test_y = initial_y
-  test_z = initial_z
-  
-  dr_x = 0
-  dr_y = 0
-  dr_z = 0
-
-  for x in range (int(tot_nodes[0])):
-   for y in range (int(tot_nodes[1])):
-    for z in range (int(tot_nodes[2])):       
-     find_dr=nodes[i].split()
-     if i==int(all_nodes+7):
-      break
-     else:
-      dr_x = np.abs(float(find_dr[0])-test_x)
-      if dr_x != 0:
-       dr_x_set = dr_x
-      test_x = float(find_dr[0])
-      i=i+1
-  i = 8
-
-  for x in range (int(tot_nodes[0])):
-   for y in range (int(tot_nodes[1])):
-    for z in range (int(tot_nodes[2])):       
-     find_dr=nodes[i].split()
-     if i==int(all_nodes+7):
-      break
-     else:
-      dr_y = np.abs(float(find_dr[1])-test_y)
-      if dr_y != 0:
-       dr_y_set = dr_y
-      test_y = float(find_dr[1])
-      i=i+1
-  i = 8
-
-  for x in range (int(tot_nodes[0])):
-   for y in range (int(tot_nodes[1])):
-    for z in range (int(tot_nodes[2])):       
-     find_dr=nodes[i].split()
-     if i==int(all_nodes+7):
-      break
-     else:
-      dr_z = np.abs(float(find_dr[2])-float(test_z))
-      if dr_z != 0:
-       dr_z_set = dr_z
-      test_z = float(find_dr[2])
-      i=i+1
-
-  i = 8
-  dr_x_set = dr_x_set*increment_x
-  dr_y_set = dr_y_set*increment_y
-  dr_z_set = dr_z_set*increment_z
-  b_p.write('dr=('+str(dr_x_set)+', '+str(dr_y_set)+', '+str(dr_z_set)+'), \n')
-#end of stupid iteration
-################################################################################
-  for x in range (int(tot_nodes[0])):
-   for y in range (int(tot_nodes[1])):
-    for z in range (int(tot_nodes[2])):       
-     B_fields=nodes[i].split()
-     magnet_fields_Bx = float(B_fields[3])*units
-     magnet_fields_By = float(B_fields[4])*units
-     magnet_fields_Bz = float(B_fields[5])*units
-     
-     if i==int(all_nodes+7):
-      b_p.write('pt( '+str(x)+', '+str(y)+', '+str(z)+') = ('+str(magnet_fields_Bx)+', '+str(magnet_fields_By)+', '+str(magnet_fields_Bz)+')}\n')  
-      break         
-     else:
-      b_p.write('pt( '+str(x)+', '+str(y)+', '+str(z)+') = ('+str(magnet_fields_Bx)+', '+str(magnet_fields_By)+', '+str(magnet_fields_Bz)+'),\n')
-      i=i+1
-
-
-def append_zero(i):
- if i<10:
-   return '0'+str(i)
- else:
-   return str(i)
-
-
-def append_two_zero(i):
-  if i<10:
-    return '00'+str(i)
-  elif i < 100:
-    return '0'+str(i)
-  else:
-    return str(i)
+#########################################################################
+# Write the grid in the openPMD based HDF5 layout read by Bmad's hdf5_read_grid_field.
+# Field components are stored as complex (r, i) compound datasets in C order.
 
+def write_hdf5_grid_field(h5_name, r0, dr, idx, B):
+  try:
+    import h5py
+  except ImportError:
+    sys.exit('THE h5py MODULE IS NEEDED TO WRITE HDF5 FILES!')
 
+  g_size = idx.max(axis = 0) + 1
+  complex_t = np.dtype([('r', np.float64), ('i', np.float64)])
 
-if __name__ == "__main__":
-  main(sys.argv[1:])
+  with h5py.File(h5_name, 'w') as f:
+    f.attrs['dataType']          = np.bytes_('Bmad:grid_field')
+    f.attrs['openPMD']           = np.bytes_('2.0.0')
+    f.attrs['openPMDextension']  = np.bytes_('BeamPhysics;SpeciesType')
+    f.attrs['externalFieldPath'] = np.bytes_('/ExternalFieldMesh/%T/')
+    f.attrs['software']          = np.bytes_('opera_fieldmap_to_bmad')
+    f.attrs['softwareVersion']   = np.bytes_('1.0')
+    f.attrs['date']              = np.bytes_(time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    g = f.create_group('ExternalFieldMesh/1')
+    g.attrs['gridGeometry']        = np.bytes_('rectangular')
+    g.attrs['axisLabels']          = np.array([b'x', b'y', b'z'])
+    g.attrs['fieldScale']          = 1.0
+    g.attrs['componentFieldScale'] = 1.0
+    g.attrs['eleAnchorPt']         = np.bytes_('center')   # double check your field map, you may want to change this.
+    g.attrs['gridOriginOffset']    = np.asarray(r0, dtype = np.float64)
+    g.attrs['gridSpacing']         = np.asarray(dr, dtype = np.float64)
+    g.attrs['harmonic']            = np.int32(0)
+    g.attrs['interpolationOrder']  = np.int32(1)
+    g.attrs['gridLowerBound']      = np.zeros(3, dtype = np.int32)
+    g.attrs['gridSize']            = g_size.astype(np.int32)
+    g.attrs['gridCurvatureRadius'] = 0.0
+
+    b = g.create_group('magneticField')
+    for i, name in enumerate(['x', 'y', 'z']):
+      comp = np.zeros(tuple(g_size), dtype = complex_t)
+      comp['r'][idx[:,0], idx[:,1], idx[:,2]] = B[:,i]
+      d = b.create_dataset(name, data = comp)
+      d.attrs['gridDataOrder'] = np.bytes_('C')
+      d.attrs['localName']     = np.bytes_(name)
+      d.attrs['unitSI']        = 1.0
+      d.attrs['unitDimension'] = np.array([0, 1, -2, -1, 0, 0, 0], dtype = np.float64)  # Tesla
+      d.attrs['unitSymbol']    = np.bytes_('T')
+
+#########################################################################
+# Grid indices and origin offset in the cartesian_map_fit convention.
+# cartesian_map_fit computes the index of a point as nint(x / del_grid) so the grid origin offset
+# r0_grid is the part of r0 that is not a multiple of the grid spacing.
+
+def fit_table_grid(r0, dr, idx):
+  dr_safe = np.where(dr == 0, 1.0, dr)
+  n_min = np.rint(r0 / dr_safe).astype(int)
+  return idx + n_min, r0 - n_min * dr
+
+#########################################################################
+# Write the ASCII cartesian_map_fit field table. Lengths are in meters and fields in Tesla.
+
+def write_fit_table_ascii(table_name, dr, ijk, r0_grid, B):
+  n_min = ijk.min(axis = 0)
+  n_max = ijk.max(axis = 0)
+
+  with open(table_name, 'w') as t_f:
+    header = [('1.0', 'length_scale'), ('1.0', 'field_scale'),
+              ('%d, %d' % (n_min[0], n_max[0]), 'Nx_min, Nx_max'),
+              ('%d, %d' % (n_min[1], n_max[1]), 'Ny_min, Ny_max'),
+              ('%d, %d' % (n_min[2], n_max[2]), 'Nz_min, Nz_max'),
+              ('%.10g, %.10g, %.10g' % tuple(dr), 'Distance between points: del_x, del_y, del_z'),
+              ('%.10g, %.10g, %.10g' % tuple(r0_grid), 'Grid origin offset x_off, y_off, z_off')]
+    for val, comment in header:
+      t_f.write(val.ljust(30) + ' ! ' + comment + '\n')
+
+    row_fmt = '%.10g %.10g %.10g %.10g %.10g %.10g\n'
+    for n0 in range(0, len(ijk), n_block):
+      n1 = min(n0 + n_block, len(ijk))
+      block = np.hstack((ijk[n0:n1] * dr, B[n0:n1])).ravel().tolist()
+      t_f.write((row_fmt * (n1 - n0)) % tuple(block))
+
+#########################################################################
+# Write the binary cartesian_map_fit field table read with field_file = "binary::<file>".
+# This is a Fortran sequential unformatted file: Each record is bracketed by its length in bytes.
+# Lengths are in meters and fields in Tesla.
+
+def write_fit_table_binary(table_name, dr, ijk, r0_grid, B):
+  def record(b_f, *arrays):
+    body = b''.join(np.ascontiguousarray(a).tobytes() for a in arrays)
+    n = np.array([len(body)], dtype = np.int32).tobytes()
+    b_f.write(n + body + n)
+
+  n_min = ijk.min(axis = 0).astype(np.int32)
+  n_max = ijk.max(axis = 0).astype(np.int32)
+
+  pt_t = np.dtype([('n0', np.int32), ('ijk', np.int32, 3), ('B', np.float64, 3), ('valid', np.int32), ('n1', np.int32)])
+  pts = np.zeros(len(ijk), dtype = pt_t)
+  pts['n0'] = pts['n1'] = pt_t.itemsize - 8
+  pts['ijk'] = ijk
+  pts['B'] = B
+  pts['valid'] = 1     # Fortran .true.
+
+  with open(table_name, 'wb') as b_f:
+    record(b_f, np.array([1.0, 1.0]))        # length_scale, field_scale
+    for i in range(3):
+      record(b_f, np.array([n_min[i], n_max[i]], dtype = np.int32))
+    record(b_f, np.asarray(dr, dtype = np.float64))
+    record(b_f, np.asarray(r0_grid, dtype = np.float64))
+    pts.tofile(b_f)
 
+#########################################################################
+# Print the RMS difference, for each z-plane, between the OPERA data and a fit table
+# written by "cartesian_map_fit fit_table". This is the same comparison plot_field_vs_z.py plots.
+
+def print_fit_residual(fit_file, ijk, B):
+  with open(fit_file, 'r') as f_f:
+    header = [f_f.readline().replace(',', ' ').split('!')[0].split() for i in range(7)]
+  f_field_scale  = float(header[1][0])
+  f_del = np.array([float(v) for v in header[5]])
+
+  fit = np.loadtxt(fit_file, skiprows = 7, comments = '!', ndmin = 2)
+  f_ijk = np.rint(fit[:,0:3] / np.where(f_del == 0, 1.0, f_del)).astype(int)
+  f_B = fit[:,3:6] * f_field_scale
+
+  n_min = ijk.min(axis = 0)
+  g_size = ijk.max(axis = 0) - n_min + 1
+  B_dat = np.full(tuple(g_size) + (3,), np.nan)
+  B_fit = np.full(tuple(g_size) + (3,), np.nan)
+  B_dat[tuple((ijk - n_min).T)] = B
+
+  f_ijk = f_ijk - n_min
+  ok = np.all((f_ijk >= 0) & (f_ijk < g_size), axis = 1)
+  B_fit[tuple(f_ijk[ok].T)] = f_B[ok]
+
+  dB = B_fit - B_dat
+  n_pt = np.sum(~np.isnan(dB[...,0]), axis = (0, 1))
+  with warnings.catch_warnings():   # z-planes with no matched points give NaN (no "Mean of empty slice" warning)
+    warnings.simplefilter('ignore', category = RuntimeWarning)
+    rms = np.sqrt(np.nanmean(dB**2, axis = (0, 1)))
+    rms_all = np.sqrt(np.nanmean(dB**2, axis = (0, 1, 2)))
+
+  print ('Fit residual per z-plane (Tesla):')
+  print ('    iz   n_pts       dBx_rms       dBy_rms       dBz_rms')
+  for k in range(g_size[2]):
+    print ('%6d  %6d  %12.4e  %12.4e  %12.4e' % (k + n_min[2], n_pt[k], rms[k,0], rms[k,1], rms[k,2]))
+  print ('   All  %6d  %12.4e  %12.4e  %12.4e' % ((n_pt.sum(),) + tuple(rms_all)))
+
+#########################################################################
+
+def main(argv):
+  global n_chunk
+  hdf5 = False
+  stream = False
+  fit_table = False
+  ascii = False
+  fit_file = ''
+  opera_file = ''
+
+  i = 0
+  while i < len(argv):
+    if argv[i] == '-hdf5':
+      hdf5 = True
+    elif argv[i] == '-stream':
+      stream = True
+    elif argv[i] == '-chunk' and i+1 < len(argv):
+      n_chunk = int(argv[i+1])
+      i += 1
+    elif argv[i] == '-fit_table':
+      fit_table = True
+    elif argv[i] == '-ascii':
+      ascii = True
+    elif argv[i] == '-residual' and i+1 < len(argv):
+      fit_file = argv[i+1]
+      i += 1
+    elif argv[i][0] == '-':
+      print_help()
+    else:
+      opera_file = argv[i]
+    i += 1
+
+  if opera_file == '': print_help()
+  if stream and (fit_table or fit_file != ''): sys.exit('STREAMING MODE CANNOT BE USED WITH -fit_table OR -residual!')
+  if hdf5 and (fit_table or fit_file != ''): sys.exit('-hdf5 CANNOT BE USED WITH -fit_table OR -residual!')
 
+  if stream:
+    if hdf5: sys.exit('STREAMING MODE ONLY SUPPORTS ASCII OUTPUT!')
+    bmad_parse = os.path.join(os.getcwd(), 'bmad_parse_' + os.path.basename(opera_file))
+    convert_streaming(opera_file, bmad_parse)
+    print ('Wrote: ' + bmad_parse)
+    return
+
+  n_nodes, data = load_opera_table(opera_file)
+  r0, dr, idx = grid_from_data(data, n_nodes)
+
+  if fit_table or fit_file != '':
+    ijk, r0_grid = fit_table_grid(r0, dr, idx)
+    if fit_table and ascii:
+      write_fit_table_ascii('bmad_field.table', dr, ijk, r0_grid, data[:,3:6])
+      print ('Wrote: bmad_field.table')
+    elif fit_table:
+      write_fit_table_binary('bmad_field.table.binary', dr, ijk, r0_grid, data[:,3:6])
+      print ('Wrote: bmad_field.table.binary')
+      print ('In the fitNNNN.in file use: field_file = "binary::bmad_field.table.binary"')
+    if fit_file != '': print_fit_residual(fit_file, ijk, data[:,3:6])
+    return
+
+  if hdf5:
+    h5_name = os.path.join(os.getcwd(), 'bmad_parse_' + os.path.splitext(os.path.basename(opera_file))[0] + '.h5')
+    write_hdf5_grid_field(h5_name, r0, dr, idx, data[:,3:6])
+    print ('Number of grid points: ' + str(len(idx)))
+    print ('Wrote: ' + h5_name)
+    return
+
+  # Order points with z varying fastest.
+  order = np.lexsort((idx[:,2], idx[:,1], idx[:,0]))
+  idx = idx[order]
+  B = data[order, 3:6]
+
+  bmad_parse = os.path.join(os.getcwd(), 'bmad_parse_' + os.path.basename(opera_file))
+  with open(bmad_parse, 'w') as b_p:
+    write_bmad_header(b_p, r0, dr)
+    write_grid_points(b_p, idx, B, True)
+
+  print ('Number of grid points: ' + str(len(idx)))
+  print ('Wrote: ' + bmad_parse)
+
+#########################################################################
+
+if __name__ == "__main__":
+  main(sys.argv[1:])